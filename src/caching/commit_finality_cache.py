@@ -0,0 +1,130 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import asyncio
+import threading
+
+import utils
+from caching.lru_cache import LruCache
+
+# Commits whose finality is remembered.
+COMMIT_FINALITY_CACHE_SIZE = utils.getenv_int('COMMIT_FINALITY_CACHE_SIZE', 10000)
+# Seconds a commit that reached a terminal state is remembered as finished.
+COMMIT_FINISHED_CACHE_TTL = utils.getenv_int('COMMIT_FINISHED_CACHE_TTL', 3600)
+# Seconds a commit is remembered as not finished.
+COMMIT_PENDING_CACHE_TTL = utils.getenv_int('COMMIT_PENDING_CACHE_TTL', 10)
+
+
+class _Lookup:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.invalidated = False
+
+
+# Caches whether a commit is finished in the git repository, with separate
+# TTLs for finished and pending commits. Concurrent lookups of the same commit
+# share a single upstream call (single flight), in threads and on the loop.
+# Instance is shared across threads.
+class CommitFinalityCache:
+
+    def __init__(self, lookup, lookup_async, max_entries=COMMIT_FINALITY_CACHE_SIZE,
+                 finished_ttl=COMMIT_FINISHED_CACHE_TTL, pending_ttl=COMMIT_PENDING_CACHE_TTL):
+        self._lookup = lookup
+        self._lookup_async = lookup_async
+        self._finished_ttl = finished_ttl
+        self._pending_ttl = pending_ttl
+        self._cache = LruCache(max_entries, finished_ttl)
+
+        self._lock = threading.Lock()
+        # commit_id -> lookup in flight
+        self._lookups = {}
+        # commit_id -> (future, lookup) in flight on the event loop
+        self._async_lookups = {}
+
+        self.collapsed_count = 0
+
+    def is_commit_finished(self, commit_id) -> bool:
+        finished = self._cache.get(commit_id)
+        if finished is not None:
+            return finished
+
+        with self._lock:
+            lookup = self._lookups.get(commit_id)
+            is_leader = lookup is None
+            if is_leader:
+                lookup = _Lookup()
+                self._lookups[commit_id] = lookup
+            else:
+                self.collapsed_count += 1
+
+        if not is_leader:
+            lookup.done.wait()
+            if lookup.error is not None:
+                raise lookup.error
+            return lookup.result
+
+        try:
+            lookup.result = self._lookup(commit_id)
+            self._remember(commit_id, lookup, lookup.result)
+            return lookup.result
+        except Exception as e:
+            lookup.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._lookups.get(commit_id) is lookup:
+                    del self._lookups[commit_id]
+            lookup.done.set()
+
+    async def is_commit_finished_async(self, commit_id) -> bool:
+        finished = self._cache.get(commit_id)
+        if finished is not None:
+            return finished
+
+        in_flight = self._async_lookups.get(commit_id)
+        if in_flight is not None:
+            self.collapsed_count += 1
+            return await asyncio.shield(in_flight[0])
+
+        future = asyncio.get_running_loop().create_future()
+        lookup = _Lookup()
+        self._async_lookups[commit_id] = (future, lookup)
+        try:
+            finished = await self._lookup_async(commit_id)
+            self._remember(commit_id, lookup, finished)
+            future.set_result(finished)
+            return finished
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Retrieved here so an exception nobody else waited for is not reported
+            future.exception()
+            raise
+        finally:
+            if self._async_lookups.get(commit_id, (None,))[0] is future:
+                del self._async_lookups[commit_id]
+
+    def invalidate(self, commit_id):
+        """Forgets a commit, including the result of a lookup in flight."""
+        self._cache.pop(commit_id)
+        with self._lock:
+            lookup = self._lookups.pop(commit_id, None)
+        if lookup is not None:
+            lookup.invalidated = True
+        in_flight = self._async_lookups.pop(commit_id, None)
+        if in_flight is not None:
+            in_flight[1].invalidated = True
+
+    def get_metrics(self) -> dict:
+        metrics = self._cache.get_metrics('commit_finality')
+        metrics['commit_finality_lookups_collapsed_total'] = self.collapsed_count
+        return metrics
+
+    def _remember(self, commit_id, lookup, finished):
+        # None is a lookup that was skipped, the commit is checked again next time
+        if finished is not None and not lookup.invalidated:
+            self._cache.put(commit_id, finished, self._finished_ttl if finished else self._pending_ttl)
@@ -0,0 +1,186 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import utils
+
+# Bytes of commit messages, and the values parsed from them, kept in memory
+# per git repository.
+COMMIT_MESSAGE_CACHE_BYTES = utils.getenv_int('COMMIT_MESSAGE_CACHE_BYTES', 8 * 1024 * 1024)
+# Directory of the commit message caches, one SQLite database per git
+# repository. Empty keeps the cache in memory only.
+COMMIT_MESSAGE_CACHE_DIR = os.getenv('COMMIT_MESSAGE_CACHE_DIR', '')
+# Approximate bytes of bookkeeping per cached commit.
+ENTRY_OVERHEAD = 200
+
+MESSAGE_FIELD = 'message'
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_commit_message_cache(repository_url) -> 'CommitMessageCache':
+    """Returns the commit message cache of a git repository.
+
+    Caches are shared by the connectors of the same repository and, when
+    COMMIT_MESSAGE_CACHE_DIR is set, reloaded from disk after a restart."""
+    with _caches_lock:
+        cache = _caches.get(repository_url)
+        if cache is None:
+            cache = CommitMessageCache(COMMIT_MESSAGE_CACHE_BYTES, _get_path(repository_url))
+            _caches[repository_url] = cache
+        return cache
+
+
+def _get_path(repository_url):
+    if not COMMIT_MESSAGE_CACHE_DIR:
+        return None
+    name = hashlib.sha1(repository_url.encode('utf-8')).hexdigest()
+    return os.path.join(COMMIT_MESSAGE_CACHE_DIR, f'{name}.db')
+
+
+# Least recently used cache of commit messages and the values parsed from them,
+# bounded by their size in bytes. Commit messages never change, so entries do
+# not expire.
+#
+# With a path the entries are also written through to a SQLite database and
+# loaded from it on start. Failing to use the database only costs the
+# persistence, never a lookup.
+# Instance is shared across threads.
+class CommitMessageCache:
+
+    def __init__(self, max_bytes, path=None):
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # commit_id -> {field: value}, least recently used first
+        self._entries = OrderedDict()
+        self._size = 0
+
+        self.hit_count = 0
+        self.miss_count = 0
+        self.eviction_count = 0
+
+        self._connection = None
+        if path:
+            self._open(path)
+
+    def get(self, commit_id):
+        """Returns the message of a commit, None if it is not cached."""
+        with self._lock:
+            entry = self._entries.get(commit_id)
+            if entry is None:
+                self.miss_count += 1
+                return None
+            self._entries.move_to_end(commit_id)
+            self.hit_count += 1
+            return entry[MESSAGE_FIELD]
+
+    def put(self, commit_id, message):
+        with self._lock:
+            entry = self._entries.get(commit_id)
+            if entry is not None and entry[MESSAGE_FIELD] == message:
+                return
+            self._store(commit_id, {MESSAGE_FIELD: message})
+
+    def parse(self, commit_id, field, message, parser):
+        """Returns parser(message), computed once per commit and kept as field
+        of its entry. The value must be JSON serializable."""
+        with self._lock:
+            entry = self._entries.get(commit_id)
+            if entry is not None and field in entry:
+                return entry[field]
+
+        value = parser(message)
+        with self._lock:
+            entry = self._entries.get(commit_id)
+            if entry is not None and entry[MESSAGE_FIELD] == message:
+                self._store(commit_id, {**entry, field: value})
+        return value
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_metrics(self) -> dict:
+        return {
+            'commit_message_cache_size': len(self._entries),
+            'commit_message_cache_bytes': self._size,
+            'commit_message_cache_hits_total': self.hit_count,
+            'commit_message_cache_misses_total': self.miss_count,
+            'commit_message_cache_evictions_total': self.eviction_count,
+        }
+
+    # Called with the lock held
+    def _store(self, commit_id, entry):
+        self._forget(commit_id)
+        self._entries[commit_id] = entry
+        self._size += _entry_size(commit_id, entry)
+
+        # The newest entry stays even if it alone exceeds the budget
+        evicted = []
+        while self._size > self._max_bytes and len(self._entries) > 1:
+            evicted_id = next(iter(self._entries))
+            self._forget(evicted_id)
+            evicted.append(evicted_id)
+            self.eviction_count += 1
+        self._write(commit_id, entry, evicted)
+
+    def _forget(self, commit_id):
+        entry = self._entries.pop(commit_id, None)
+        if entry is not None:
+            self._size -= _entry_size(commit_id, entry)
+
+    def _open(self, path):
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS commit_messages ('
+                'commit_id TEXT PRIMARY KEY, entry TEXT NOT NULL, stored_at REAL NOT NULL)')
+            rows = self._connection.execute(
+                'SELECT commit_id, entry FROM commit_messages ORDER BY stored_at').fetchall()
+        except (OSError, sqlite3.Error) as e:
+            logging.error(f'Failed to open commit message cache {path}: {e}')
+            self._connection = None
+            return
+
+        with self._lock:
+            evicted = []
+            for commit_id, entry in rows:
+                self._entries[commit_id] = json.loads(entry)
+                self._size += _entry_size(commit_id, self._entries[commit_id])
+            while self._size > self._max_bytes and self._entries:
+                evicted_id = next(iter(self._entries))
+                self._forget(evicted_id)
+                evicted.append(evicted_id)
+            self._write(None, None, evicted)
+        logging.info(f'Loaded {len(self._entries)} commit messages from {path}')
+
+    # Called with the lock held
+    def _write(self, commit_id, entry, evicted):
+        if self._connection is None:
+            return
+        try:
+            with self._connection:
+                self._connection.execute('BEGIN')
+                if commit_id is not None:
+                    self._connection.execute(
+                        'INSERT OR REPLACE INTO commit_messages VALUES (?, ?, ?)',
+                        (commit_id, json.dumps(entry), time.time()))
+                self._connection.executemany(
+                    'DELETE FROM commit_messages WHERE commit_id = ?', [(evicted_id,) for evicted_id in evicted])
+        except sqlite3.Error as e:
+            logging.error(f'Failed to persist commit message of {commit_id}: {e}')
+
+
+def _entry_size(commit_id, entry) -> int:
+    return ENTRY_OVERHEAD + len(commit_id) + sum(len(str(value)) for value in entry.values())
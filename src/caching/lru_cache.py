@@ -0,0 +1,61 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import threading
+import time
+from collections import OrderedDict
+
+
+# Bounded least recently used cache whose entries expire after a TTL.
+# Instance is shared across threads.
+class LruCache:
+
+    def __init__(self, max_entries, ttl):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        # key -> (expires_at, value), least recently used first
+        self._entries = OrderedDict()
+
+        self.hit_count = 0
+        self.miss_count = 0
+        self.eviction_count = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hit_count += 1
+                    return entry[1]
+                del self._entries[key]
+            self.miss_count += 1
+            return default
+
+    def put(self, key, value, ttl=None):
+        """Stores a value, with the cache's TTL unless one is given."""
+        if self._max_entries <= 0:
+            return
+        expires_at = time.monotonic() + (self._ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self.eviction_count += 1
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_metrics(self, name) -> dict:
+        return {
+            f'{name}_cache_size': len(self._entries),
+            f'{name}_cache_hits_total': self.hit_count,
+            f'{name}_cache_misses_total': self.miss_count,
+            f'{name}_cache_evictions_total': self.eviction_count,
+        }
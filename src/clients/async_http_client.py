@@ -0,0 +1,58 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import asyncio
+import logging
+
+import httpx
+import utils
+
+# Timeout in seconds for upstream calls made on the event loop.
+ASYNC_HTTP_TIMEOUT = utils.getenv_int('ASYNC_HTTP_TIMEOUT', 30)
+# Negotiate HTTP/2 with upstreams that support it, so concurrent calls are
+# multiplexed over a few connections. Needs the h2 package (httpx[http2]).
+ASYNC_HTTP2 = utils.getenv_bool('ASYNC_HTTP2', True)
+# Calls in flight per upstream host.
+ASYNC_HTTP_MAX_CONCURRENCY_PER_HOST = utils.getenv_int('ASYNC_HTTP_MAX_CONCURRENCY_PER_HOST', 32)
+
+_async_client = None
+_host_semaphores = {}
+
+
+# Returns the process wide non-blocking HTTP client used in ASGI server mode.
+# It must only be used from the event loop that runs the ASGI application.
+def get_async_http_client() -> httpx.AsyncClient:
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(timeout=ASYNC_HTTP_TIMEOUT, http2=_is_http2_available())
+    return _async_client
+
+
+async def async_request(method, url, **kwargs) -> httpx.Response:
+    """Sends a call with the shared client, bounded by the concurrency limit of the url's host."""
+    host = httpx.URL(url).host
+    semaphore = _host_semaphores.get(host)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(ASYNC_HTTP_MAX_CONCURRENCY_PER_HOST)
+        _host_semaphores[host] = semaphore
+    async with semaphore:
+        return await get_async_http_client().request(method, url, **kwargs)
+
+
+async def close_async_http_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    _host_semaphores.clear()
+
+
+def _is_http2_available() -> bool:
+    if not ASYNC_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logging.warning('The h2 package is not installed, upstream calls use HTTP/1.1')
+        return False
+    return True
@@ -2,8 +2,11 @@
 # Licensed under the MIT License.
 
 import base64
+import requests
 import utils
 import logging
+from clients.async_http_client import async_request
+from clients.http_session import get_http_session, host_concurrency_limit, prewarm_http_session
 from configuration.gitops_config import GitOpsConfig
 
 class AzdoClient:
@@ -23,3 +26,23 @@ class AzdoClient:
 
     def get_rest_api_url(self) -> str:
         return self.org_url
+
+    # Calls go through the keep-alive session of the url's host, bounded by
+    # the host's concurrency limit. The limit applies to every blocking call,
+    # status posts and task callbacks wait behind a busy sweep too.
+    def get(self, url) -> requests.Response:
+        with host_concurrency_limit(url):
+            return get_http_session(url).get(url=url, headers=self.headers)
+
+    def post(self, url, json) -> requests.Response:
+        with host_concurrency_limit(url):
+            return get_http_session(url).post(url=url, headers=self.headers, json=json)
+
+    async def get_async(self, url):
+        return await async_request('GET', url, headers=self.headers)
+
+    async def post_async(self, url, json):
+        return await async_request('POST', url, headers=self.headers, json=json)
+
+    def prewarm(self, connections=1):
+        prewarm_http_session(self.org_url, connections)
@@ -1,7 +1,13 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
+from urllib.parse import urlsplit
+
+import requests
 import utils
+from clients.async_http_client import async_request
+from clients.http_session import get_http_session, prewarm_http_session
+from clients.github_rate_limiter import get_rate_limiter, RateLimitedError, READ_PRIORITY, WRITE_PRIORITY
 from configuration.gitops_config import GitOpsConfig
 
 
@@ -12,9 +18,65 @@ class GitHubClient:
         # token is supposed to be stored in a secret without any transformations
         self.token = utils.getenv("PAT")
         self.headers = {'Authorization': f'token {self.token}'}
+        # Calls are paced against the rate limit budget of the token, which
+        # is shared by all connectors using it
+        self.rate_limiter = get_rate_limiter(self.token)
+        self.graphql_rate_limiter = get_rate_limiter(self.token, 'graphql')
 
     def get_rest_api_headers(self) -> dict:
         return self.headers
 
     def get_rest_api_url(self) -> str:
         return self.org_url
+
+    # https://api.github.com/graphql, or https://host/api/graphql on GitHub Enterprise Server
+    def get_graphql_api_url(self) -> str:
+        parts = urlsplit(self.org_url)
+        if parts.path.startswith('/api/v3'):
+            return f'{parts.scheme}://{parts.netloc}/api/graphql'
+        return f'{parts.scheme}://{parts.netloc}/graphql'
+
+    # Owner of the repositories under org_url
+    def get_owner(self) -> str:
+        return self.org_url.rstrip('/').rsplit('/', 1)[-1]
+
+    # Lookups yield to writes when the budget runs low. With wait=False a
+    # lookup that would have to wait raises RateLimitedError instead.
+    def get(self, url, wait=True) -> requests.Response:
+        self.rate_limiter.acquire(READ_PRIORITY, wait)
+        return self._check_rate_limit(get_http_session(url).get(url=url, headers=self.headers))
+
+    def post(self, url, json) -> requests.Response:
+        self.rate_limiter.acquire(WRITE_PRIORITY)
+        return self._check_rate_limit(get_http_session(url).post(url=url, headers=self.headers, json=json))
+
+    async def get_async(self, url, wait=True):
+        await self.rate_limiter.acquire_async(READ_PRIORITY, wait)
+        return self._check_rate_limit(await async_request('GET', url, headers=self.headers))
+
+    async def post_async(self, url, json):
+        await self.rate_limiter.acquire_async(WRITE_PRIORITY)
+        return self._check_rate_limit(await async_request('POST', url, headers=self.headers, json=json))
+
+    # GraphQL queries are lookups against their own rate limit budget
+    def graphql(self, query, variables, wait=True) -> requests.Response:
+        url = self.get_graphql_api_url()
+        self.graphql_rate_limiter.acquire(READ_PRIORITY, wait)
+        response = get_http_session(url).post(url=url, headers=self.headers, json={'query': query, 'variables': variables})
+        return self._check_rate_limit(response, self.graphql_rate_limiter)
+
+    async def graphql_async(self, query, variables, wait=True):
+        url = self.get_graphql_api_url()
+        await self.graphql_rate_limiter.acquire_async(READ_PRIORITY, wait)
+        response = await async_request('POST', url, headers=self.headers, json={'query': query, 'variables': variables})
+        return self._check_rate_limit(response, self.graphql_rate_limiter)
+
+    def prewarm(self, connections=1):
+        prewarm_http_session(self.org_url, connections)
+
+    def _check_rate_limit(self, response, rate_limiter=None):
+        # Rate limited calls are raised as transient errors, so that failed
+        # status posts are retried instead of dropped as client errors
+        if (rate_limiter or self.rate_limiter).observe(response):
+            raise RateLimitedError(f'GitHub rate limit exceeded: {response.status_code} {response.text}')
+        return response
@@ -0,0 +1,213 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import asyncio
+import re
+import threading
+
+import utils
+from clients.github_client import GitHubClient
+
+# Look up commit states and messages with batched GraphQL queries instead of
+# one REST call per commit.
+GITHUB_GRAPHQL_BATCHING = utils.getenv_bool('GITHUB_GRAPHQL_BATCHING', True)
+# Milliseconds concurrent commit lookups are collected for before they are
+# sent as one query. A full batch is sent right away.
+GITHUB_GRAPHQL_BATCH_WINDOW = utils.getenv_int('GITHUB_GRAPHQL_BATCH_WINDOW', 20)
+# Commits looked up per GraphQL query.
+GITHUB_GRAPHQL_BATCH_SIZE = utils.getenv_int('GITHUB_GRAPHQL_BATCH_SIZE', 50)
+
+# GraphQL rejects the whole query if one object id is malformed
+COMMIT_ID_PATTERN = re.compile(r'^[0-9a-fA-F]{40}$')
+
+COMMIT_FIELDS = '... on Commit { message status { state } }'
+
+
+class GraphQLError(Exception):
+    """The GraphQL query returned errors instead of data."""
+
+
+class _Lookup:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Batch:
+    def __init__(self):
+        # commit_id -> lookup
+        self.lookups = {}
+        self.full = threading.Event()
+
+
+# Collects the commit lookups made within a short window, from threads or from
+# the event loop, and sends them as a single GraphQL query for the commits'
+# messages and combined status states. The lookup that opens a batch sends it
+# once the window passes or the batch is full, so a thread only ever sends the
+# batch holding its own lookup and later batches are sent by their own
+# openers.
+#
+# A lookup returns {'message': ..., 'state': ...} with the state spelled like
+# the REST combined status ('success', 'failure', 'pending'), or None if the
+# commit does not exist or its id cannot be queried. A failed query is raised
+# to every lookup it carried.
+# Instance is shared across threads.
+class CommitLookupBatcher:
+
+    def __init__(self, github_client: GitHubClient, repo_name, window=GITHUB_GRAPHQL_BATCH_WINDOW,
+                 batch_size=GITHUB_GRAPHQL_BATCH_SIZE):
+        self._github_client = github_client
+        self._owner = github_client.get_owner()
+        self._repo_name = repo_name
+        self._window = window / 1000
+        self._batch_size = max(1, batch_size)
+
+        self._lock = threading.Lock()
+        # commit_id -> lookup waiting for its batch to be sent
+        self._pending = {}
+        # Batch taking new lookups
+        self._batch = None
+
+        # commit_id -> future waiting for the next query on the event loop
+        self._async_pending = {}
+        self._async_timer = None
+        self._async_queries = set()
+
+        self.query_count = 0
+        self.lookup_count = 0
+
+    def lookup(self, commit_id):
+        if not COMMIT_ID_PATTERN.match(commit_id):
+            return None
+
+        with self._lock:
+            self.lookup_count += 1
+            batch = None
+            lookup = self._pending.get(commit_id)
+            if lookup is None:
+                lookup = _Lookup()
+                self._pending[commit_id] = lookup
+                if self._batch is None or len(self._batch.lookups) >= self._batch_size:
+                    batch = _Batch()
+                    self._batch = batch
+                self._batch.lookups[commit_id] = lookup
+                if len(self._batch.lookups) >= self._batch_size:
+                    self._batch.full.set()
+
+        if batch is not None:
+            batch.full.wait(self._window)
+            with self._lock:
+                if self._batch is batch:
+                    self._batch = None
+                for batch_commit_id in batch.lookups:
+                    del self._pending[batch_commit_id]
+            self._send(batch.lookups)
+
+        lookup.done.wait()
+        if lookup.error is not None:
+            raise lookup.error
+        return lookup.result
+
+    async def lookup_async(self, commit_id):
+        if not COMMIT_ID_PATTERN.match(commit_id):
+            return None
+
+        self.lookup_count += 1
+        future = self._async_pending.get(commit_id)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._async_pending[commit_id] = future
+            if len(self._async_pending) >= self._batch_size:
+                self._flush_async()
+            elif self._async_timer is None:
+                self._async_timer = loop.call_later(self._window, self._flush_async)
+        return await asyncio.shield(future)
+
+    def get_metrics(self) -> dict:
+        return {
+            'github_graphql_queries_total': self.query_count,
+            'github_graphql_commit_lookups_total': self.lookup_count,
+        }
+
+    def _send(self, batch):
+        try:
+            response = self._github_client.graphql(*self._build_query(batch), wait=False)
+            results = self._parse_response(response, list(batch))
+        except Exception as e:
+            for lookup in batch.values():
+                lookup.error = e
+                lookup.done.set()
+            return
+        for commit_id, lookup in batch.items():
+            lookup.result = results.get(commit_id)
+            lookup.done.set()
+
+    def _flush_async(self):
+        if self._async_timer is not None:
+            self._async_timer.cancel()
+            self._async_timer = None
+        batch = self._async_pending
+        self._async_pending = {}
+        commit_ids = list(batch)
+        for start in range(0, len(commit_ids), self._batch_size):
+            query = asyncio.get_running_loop().create_task(
+                self._send_async({commit_id: batch[commit_id] for commit_id in commit_ids[start:start + self._batch_size]}))
+            # Keeps the task referenced until it is done
+            self._async_queries.add(query)
+            query.add_done_callback(self._async_queries.discard)
+
+    async def _send_async(self, batch):
+        try:
+            response = await self._github_client.graphql_async(*self._build_query(batch), wait=False)
+            results = self._parse_response(response, list(batch))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+                    # Retrieved here so an exception nobody waited for is not reported
+                    future.exception()
+            return
+        for commit_id, future in batch.items():
+            if not future.done():
+                future.set_result(results.get(commit_id))
+
+    def _build_query(self, commit_ids):
+        variables = {'owner': self._owner, 'name': self._repo_name}
+        parameters = ['$owner: String!', '$name: String!']
+        fields = []
+        for index, commit_id in enumerate(commit_ids):
+            variables[f'c{index}'] = commit_id
+            parameters.append(f'$c{index}: GitObjectID!')
+            fields.append(f'c{index}: object(oid: $c{index}) {{ {COMMIT_FIELDS} }}')
+        query = f'query({", ".join(parameters)}) {{ repository(owner: $owner, name: $name) {{ {" ".join(fields)} }} }}'
+        self.query_count += 1
+        return query, variables
+
+    def _parse_response(self, response, commit_ids) -> dict:
+        # Throw appropriate exception if request failed
+        response.raise_for_status()
+        body = response.json()
+        repository = (body.get('data') or {}).get('repository')
+        if repository is None:
+            raise GraphQLError(f'GraphQL commit lookup failed: {body.get("errors")}')
+
+        results = {}
+        for index, commit_id in enumerate(commit_ids):
+            commit = repository.get(f'c{index}')
+            if commit is None or 'message' not in commit:
+                continue
+            status = commit.get('status') or {}
+            results[commit_id] = {'message': commit['message'], 'state': _map_state(status.get('state'))}
+        return results
+
+
+def _map_state(state) -> str:
+    # The REST combined status reports errors as failures and has no
+    # "expected" state
+    if state is None or state == 'EXPECTED':
+        return 'pending'
+    if state == 'ERROR':
+        return 'failure'
+    return state.lower()
@@ -0,0 +1,161 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import asyncio
+import datetime
+import email.utils
+import hashlib
+import logging
+import os
+import threading
+import time
+
+import utils
+
+# Priorities of GitHub calls. Status posts and dispatches go before lookups
+# when the budget runs low.
+WRITE_PRIORITY = 0
+READ_PRIORITY = 1
+
+# Fraction of the rate limit reserved for writes. Reads wait for the reset
+# once the remaining budget drops to it.
+GITHUB_RATE_LIMIT_READ_RESERVE = float(os.getenv('GITHUB_RATE_LIMIT_READ_RESERVE', '0.1'))
+# Fraction of the rate limit below which calls are spread evenly over the
+# time left until the reset instead of being sent as they come.
+GITHUB_RATE_LIMIT_PACING_THRESHOLD = float(os.getenv('GITHUB_RATE_LIMIT_PACING_THRESHOLD', '0.2'))
+# Seconds to pause after hitting a secondary rate limit without Retry-After.
+GITHUB_SECONDARY_RATE_LIMIT_PAUSE = utils.getenv_int('GITHUB_SECONDARY_RATE_LIMIT_PAUSE', 60)
+
+
+class RateLimitedError(Exception):
+    """The call was rejected by a GitHub rate limit, or would have to wait for one."""
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(token, resource='core') -> 'GitHubRateLimiter':
+    """Returns the rate limiter of a token, shared by every connector using it.
+    The REST API (core) and GraphQL budgets are separate."""
+    key = (hashlib.sha256(token.encode('utf-8')).hexdigest(), resource)
+    with _rate_limiters_lock:
+        rate_limiter = _rate_limiters.get(key)
+        if rate_limiter is None:
+            rate_limiter = GitHubRateLimiter()
+            _rate_limiters[key] = rate_limiter
+        return rate_limiter
+
+
+# Token bucket over the GitHub REST budget of one token. The budget is learned
+# from the X-RateLimit-* headers of every response. While it is plentiful calls
+# go out immediately, below the pacing threshold they are spaced evenly until
+# the reset, and when it is spent, or GitHub asks to back off with Retry-After
+# or a secondary rate limit, all calls pause until the limit resets.
+# Instance is shared across threads.
+class GitHubRateLimiter:
+
+    def __init__(self, read_reserve=GITHUB_RATE_LIMIT_READ_RESERVE,
+                 pacing_threshold=GITHUB_RATE_LIMIT_PACING_THRESHOLD,
+                 secondary_pause=GITHUB_SECONDARY_RATE_LIMIT_PAUSE):
+        self._read_reserve = read_reserve
+        self._pacing_threshold = pacing_threshold
+        self._secondary_pause = secondary_pause
+
+        self._lock = threading.Lock()
+        # Unknown until the first response of the current window
+        self._limit = None
+        self._remaining = None
+        # Epoch seconds
+        self._reset_at = 0.0
+        self._paused_until = 0.0
+        self._next_slot = 0.0
+
+        self.delayed_count = 0
+        self.rate_limited_count = 0
+
+    def acquire(self, priority, wait=True):
+        """Blocks until a call of the given priority may be sent.
+        Raises RateLimitedError instead of blocking if wait is False."""
+        delay = self._reserve(priority, wait)
+        if delay > 0:
+            logging.info(f'GitHub rate limit: delaying call by {delay:.1f} seconds')
+            time.sleep(delay)
+
+    async def acquire_async(self, priority, wait=True):
+        delay = self._reserve(priority, wait)
+        if delay > 0:
+            logging.info(f'GitHub rate limit: delaying call by {delay:.1f} seconds')
+            await asyncio.sleep(delay)
+
+    def observe(self, response) -> bool:
+        """Learns the budget from a response. Returns True if GitHub rejected the call with a rate limit."""
+        headers = response.headers
+        now = time.time()
+        with self._lock:
+            if 'X-RateLimit-Remaining' in headers:
+                self._limit = int(headers.get('X-RateLimit-Limit', self._limit or 0)) or None
+                self._remaining = int(headers['X-RateLimit-Remaining'])
+                self._reset_at = float(headers.get('X-RateLimit-Reset', 0))
+
+            if response.status_code not in (403, 429):
+                return False
+
+            if 'Retry-After' in headers:
+                paused_until = now + self._get_retry_after(headers['Retry-After'], now)
+            elif self._remaining == 0:
+                paused_until = self._reset_at
+            elif 'secondary rate limit' in response.text.lower():
+                paused_until = now + self._secondary_pause
+            else:
+                # Not a rate limit, e.g. missing permissions
+                return False
+
+            self._paused_until = max(self._paused_until, paused_until)
+            self.rate_limited_count += 1
+            logging.warning(f'GitHub rate limit hit, pausing calls for {self._paused_until - now:.0f} seconds')
+            return True
+
+    def _get_retry_after(self, retry_after, now) -> float:
+        """Seconds to wait from a Retry-After header, given either as seconds or as an HTTP-date."""
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+        try:
+            retry_at = email.utils.parsedate_to_datetime(retry_after)
+            if retry_at.tzinfo is None:
+                retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+            return max(0.0, retry_at.timestamp() - now)
+        except (TypeError, ValueError):
+            logging.warning(f'Invalid Retry-After {retry_after!r}, pausing calls for {self._secondary_pause} seconds')
+            return self._secondary_pause
+
+    def _reserve(self, priority, wait) -> float:
+        now = time.time()
+        with self._lock:
+            wait_until = self._paused_until
+            slot = None
+            if self._remaining is not None and now >= self._reset_at:
+                # A new window started, learn its budget from the next response
+                self._remaining = None
+
+            if self._remaining is not None and self._limit:
+                reserve = self._limit * self._read_reserve if priority == READ_PRIORITY else 0
+                if self._remaining <= reserve:
+                    wait_until = max(wait_until, self._reset_at)
+                elif self._remaining < self._limit * self._pacing_threshold:
+                    slot = max(now, self._next_slot)
+                    wait_until = max(wait_until, slot)
+
+            delay = max(0.0, wait_until - now)
+            if delay > 0:
+                if not wait:
+                    raise RateLimitedError(f'GitHub call would wait {delay:.1f} seconds for the rate limit')
+                self.delayed_count += 1
+
+            if slot is not None:
+                self._next_slot = slot + (self._reset_at - now) / self._remaining
+            if self._remaining is not None and wait_until < self._reset_at:
+                self._remaining -= 1
+            return delay
@@ -0,0 +1,82 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import logging
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import utils
+
+# Keep-alive connections kept open per host.
+HTTP_POOL_MAXSIZE = utils.getenv_int('HTTP_POOL_MAXSIZE', 20)
+# Blocking calls in flight per host, across the connectors. 0 disables the
+# limit.
+HTTP_MAX_CONCURRENCY_PER_HOST = utils.getenv_int('HTTP_MAX_CONCURRENCY_PER_HOST', 16)
+# Timeout in seconds of a connection pre-warming request.
+HTTP_PREWARM_TIMEOUT = 10
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_host_semaphores = {}
+
+
+def get_http_session(url) -> requests.Session:
+    """Returns the process wide keep-alive session for the host of url.
+
+    Clients of every connector talking to the same host share its pool, so
+    status posts reuse open TCP+TLS connections instead of handshaking."""
+    base_url = _get_base_url(url)
+    with _sessions_lock:
+        session = _sessions.get(base_url)
+        if session is None:
+            session = requests.Session()
+            # A session only talks to its own host, so it needs a single pool
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_MAXSIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[base_url] = session
+        return session
+
+
+@contextmanager
+def host_concurrency_limit(url):
+    """Holds one of the call slots of the host of url, waiting for one if all are taken."""
+    if HTTP_MAX_CONCURRENCY_PER_HOST <= 0:
+        yield
+        return
+    base_url = _get_base_url(url)
+    with _sessions_lock:
+        semaphore = _host_semaphores.get(base_url)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(HTTP_MAX_CONCURRENCY_PER_HOST)
+            _host_semaphores[base_url] = semaphore
+    with semaphore:
+        yield
+
+
+def prewarm_http_session(url, connections=1):
+    """Opens keep-alive connections to the host of url in the background."""
+    base_url = _get_base_url(url)
+    session = get_http_session(base_url)
+
+    def prewarm():
+        try:
+            # Unauthenticated request to the host root. It does not count
+            # against the budget of the clients' tokens, but api.github.com
+            # counts it against the unauthenticated per-IP rate limit. The
+            # connection is kept alive even if that limit rejects it.
+            session.head(base_url, timeout=HTTP_PREWARM_TIMEOUT)
+        except requests.RequestException as e:
+            logging.debug(f'Failed to pre-warm connection to {base_url}: {e}')
+
+    for _ in range(min(connections, HTTP_POOL_MAXSIZE)):
+        threading.Thread(target=prewarm, name='http-prewarm', daemon=True).start()
+
+
+def _get_base_url(url) -> str:
+    parts = urlsplit(url.strip())
+    return f'{parts.scheme}://{parts.netloc}/'
@@ -0,0 +1,198 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import heapq
+import itertools
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from queue import Empty
+
+from operators.git_commit_status import GitCommitStatus
+
+
+@dataclass
+class QueuedCommitStatus:
+    req_time: int
+    commit_status: GitCommitStatus
+
+
+def commit_status_key(commit_status: GitCommitStatus):
+    return (commit_status.commit_id, commit_status.status_name, commit_status.genre)
+
+
+# Value classes of a status. When a bounded queue is full the lowest class is
+# shed first: Flux per-resource NotApplicable summaries, then in-progress
+# states. Terminal states are never shed.
+SHED_NOT_APPLICABLE = 0
+SHED_IN_PROGRESS = 1
+SHED_TERMINAL = 2
+SHED_CLASS_NAMES = ('not_applicable', 'in_progress')
+IN_PROGRESS_STATES = {'Progressing', 'Running', 'Inconclusive', 'OutOfSync', 'DependencyNotReady', 'info'}
+
+
+def shed_class(commit_status: GitCommitStatus) -> int:
+    if commit_status.state == 'NotApplicable':
+        return SHED_NOT_APPLICABLE
+    if commit_status.state in IN_PROGRESS_STATES:
+        return SHED_IN_PROGRESS
+    return SHED_TERMINAL
+
+
+def is_terminal(commit_status: GitCommitStatus) -> bool:
+    return shed_class(commit_status) == SHED_TERMINAL
+
+
+# Commit status queue ordered by request time that keeps only the latest
+# pending status per (commit_id, status_name, genre). Git providers only
+# show the newest status for a context, so an older status that has not been
+# posted yet is dropped when a newer one for the same context arrives.
+# The newer status takes the queue position of its own request time.
+#
+# With a high watermark the queue is bounded: a full queue sheds lower value
+# statuses to make room, and reports itself as saturated until it drains
+# below the low watermark so that ingest can push back on senders. Terminal
+# statuses are still accepted past the high watermark, which admission
+# control keeps to the statuses of requests already in flight. Shed statuses
+# are reported to on_shed(queued_status), outside the queue's lock.
+# Instance is shared across threads.
+class CoalescingCommitStatusQueue:
+
+    def __init__(self, high_watermark=0, low_watermark=None, on_shed=None):
+        self._on_shed = on_shed
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        # Heap of (req_time, sequence, key). Entries whose sequence no longer
+        # matches the pending status of their key are stale and skipped.
+        self._heap = []
+        # key -> (sequence, QueuedCommitStatus)
+        self._pending = {}
+        self._sequence = itertools.count()
+        self._closed = False
+
+        # Pending keys per shed class, oldest first
+        self._keys_by_class = [OrderedDict() for _ in range(SHED_TERMINAL + 1)]
+        self._high_watermark = high_watermark
+        if low_watermark is None:
+            low_watermark = high_watermark * 8 // 10
+        self._low_watermark = min(low_watermark, high_watermark)
+        self._saturated = False
+
+        self.enqueued_count = 0
+        self.elided_count = 0
+        self.dequeued_count = 0
+        self.shed_counts = [0] * len(SHED_CLASS_NAMES)
+
+    def put(self, req_time, commit_status: GitCommitStatus):
+        key = commit_status_key(commit_status)
+        status_class = shed_class(commit_status)
+        queued_status = QueuedCommitStatus(req_time, commit_status)
+        shed_status = None
+        with self._lock:
+            self.enqueued_count += 1
+            current = self._pending.get(key)
+            if current is not None:
+                self.elided_count += 1
+                if current[1].req_time > req_time:
+                    # A newer status for this context is already pending
+                    return
+                self._forget_key(key, current[1])
+            elif self._high_watermark and len(self._pending) >= self._high_watermark:
+                shed_status = self._make_room(queued_status, status_class)
+
+            if shed_status is not queued_status:
+                sequence = next(self._sequence)
+                self._pending[key] = (sequence, queued_status)
+                self._keys_by_class[status_class][key] = None
+                heapq.heappush(self._heap, (req_time, sequence, key))
+                self._update_saturation()
+                self._not_empty.notify()
+
+        if shed_status is not None and self._on_shed is not None:
+            self._on_shed(shed_status)
+
+    def get(self):
+        """Blocks until a status is available. Returns None once the queue is closed and empty."""
+        with self._lock:
+            while True:
+                entry = self._pop()
+                if entry is not None or self._closed:
+                    return entry
+                self._not_empty.wait()
+
+    def get_nowait(self):
+        """Returns the next status, None once the queue is closed and empty,
+        or raises queue.Empty if the queue is open and empty."""
+        with self._lock:
+            entry = self._pop()
+            if entry is None and not self._closed:
+                raise Empty
+            return entry
+
+    def close(self):
+        """Consumers drain the remaining statuses and then receive None."""
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify_all()
+
+    def qsize(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def is_saturated(self) -> bool:
+        """True from reaching the high watermark until draining below the low watermark."""
+        return self._saturated
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            metrics = {
+                'commit_status_queue_depth': len(self._pending),
+                'commit_status_queue_saturated': int(self._saturated),
+                'commit_status_enqueued_total': self.enqueued_count,
+                'commit_status_elided_total': self.elided_count,
+                'commit_status_dequeued_total': self.dequeued_count,
+            }
+            for class_name, shed_count in zip(SHED_CLASS_NAMES, self.shed_counts):
+                metrics[f'commit_status_shed_{class_name}_total'] = shed_count
+            return metrics
+
+    def _pop(self):
+        while self._heap:
+            _, sequence, key = heapq.heappop(self._heap)
+            current = self._pending.get(key)
+            if current is not None and current[0] == sequence:
+                del self._pending[key]
+                self._forget_key(key, current[1])
+                self.dequeued_count += 1
+                self._update_saturation()
+                return current[1]
+        return None
+
+    # Sheds the oldest pending status of a lower class than status_class, or
+    # the incoming queued_status if there is none. Returns the shed status,
+    # None if nothing was shed.
+    def _make_room(self, queued_status, status_class):
+        for victim_class in range(min(status_class, SHED_TERMINAL)):
+            keys = self._keys_by_class[victim_class]
+            if keys:
+                victim_key, _ = keys.popitem(last=False)
+                _, victim = self._pending.pop(victim_key)
+                self.shed_counts[victim_class] += 1
+                return victim
+
+        if status_class < SHED_TERMINAL:
+            self.shed_counts[status_class] += 1
+            return queued_status
+        return None
+
+    def _forget_key(self, key, queued_status):
+        del self._keys_by_class[shed_class(queued_status.commit_status)][key]
+
+    def _update_saturation(self):
+        if not self._high_watermark:
+            return
+        depth = len(self._pending)
+        if depth >= self._high_watermark:
+            self._saturated = True
+        elif depth <= self._low_watermark:
+            self._saturated = False
@@ -0,0 +1,333 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import utils
+from configuration.commit_status_queue import commit_status_key
+from operators.git_commit_status import GitCommitStatus
+
+# Attempts to post a status, including the first one, before it is dead-lettered.
+STATUS_RETRY_MAX_ATTEMPTS = utils.getenv_int('STATUS_RETRY_MAX_ATTEMPTS', 5)
+# Seconds before the first retry. The delay doubles on every further attempt.
+STATUS_RETRY_BASE_DELAY = float(os.getenv('STATUS_RETRY_BASE_DELAY', '1'))
+# Upper bound in seconds of the delay between two attempts.
+STATUS_RETRY_MAX_DELAY = float(os.getenv('STATUS_RETRY_MAX_DELAY', '60'))
+# Seconds between probes of a target that has dead letters but no other traffic.
+DEAD_LETTER_PROBE_INTERVAL = utils.getenv_int('DEAD_LETTER_PROBE_INTERVAL', 60)
+
+
+def is_retryable_error(error) -> bool:
+    """Transport errors, server errors and throttling are transient, other client errors are not."""
+    response = getattr(error, 'response', None)
+    status_code = getattr(response, 'status_code', None)
+    if status_code is None:
+        return True
+    return status_code >= 500 or status_code in (408, 429)
+
+
+# Retries failed commit status posts on its own thread with exponential backoff
+# and jitter, so the drain workers move on to the next status. Statuses that
+# run out of attempts go to the dead-letter store and are replayed as soon as
+# a post to the same target succeeds again, or a periodic probe does.
+#
+# A successful post of a newer status for the same target and context
+# supersedes pending retries and dead letters of that context.
+#
+# Posts of the drain workers hold posting() around the post and its
+# on_success/on_failure call. The retrier never posts a context while a drain
+# worker does, and a drain worker waits for a retry of its context already in
+# flight, so an older status never lands after a newer one. Recovered posts
+# are reported to on_recovered(target, commit_status), on_success by default.
+# Instance is shared across threads.
+class CommitStatusRetrier:
+
+    def __init__(self, targets, dead_letter_store=None, max_attempts=STATUS_RETRY_MAX_ATTEMPTS,
+                 base_delay=STATUS_RETRY_BASE_DELAY, max_delay=STATUS_RETRY_MAX_DELAY,
+                 probe_interval=DEAD_LETTER_PROBE_INTERVAL, on_recovered=None):
+        # Target name -> object with post_commit_status(commit_status)
+        self._targets = targets
+        self._on_recovered = on_recovered or self.on_success
+        self._dead_letters = dead_letter_store
+        self._max_attempts = max_attempts
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._probe_interval = probe_interval
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        # Heap of (due, sequence, retry_key). Entries whose sequence no longer
+        # matches the pending retry of their key are stale and skipped.
+        self._heap = []
+        # retry_key -> (sequence, attempt, target, commit_status)
+        self._pending = {}
+        self._sequence = itertools.count()
+        # Targets whose dead letters are scheduled for replay
+        self._replayed_targets = set()
+        self._replay_requests = set()
+        # retry_key -> event set when the retrier's post of it finished
+        self._in_flight = {}
+        # retry_keys a drain worker is posting
+        self._posting = set()
+        self._running = False
+        self._thread = None
+
+        self.retried_count = 0
+        self.recovered_count = 0
+        self.dropped_count = 0
+        self.dead_lettered_count = 0
+        self.probe_count = 0
+        self.probe_failed_count = 0
+
+    def start(self):
+        if not self._running:
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name='commit-status-retry', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stops retrying and keeps the statuses still waiting for a retry in the dead-letter store."""
+        with self._lock:
+            self._running = False
+            self._wakeup.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        with self._lock:
+            pending = list(self._pending.values())
+            self._pending = {}
+            self._heap = []
+        for _, _, target, commit_status in pending:
+            self._dead_letter(target, commit_status)
+
+    def on_failure(self, target, commit_status: GitCommitStatus, error):
+        """Called by a drain worker after the first attempt to post a status failed."""
+        if not is_retryable_error(error):
+            logging.error(f'Dropping commit status for {target} after a permanent error: {error}')
+            self.dropped_count += 1
+            return
+        with self._lock:
+            self._schedule(1, target, commit_status)
+
+    @contextmanager
+    def posting(self, target, commit_status: GitCommitStatus):
+        """Held by a drain worker while it posts a status and reports the result."""
+        retry_key = (target, commit_status_key(commit_status))
+        while True:
+            in_flight = self._begin_posting(retry_key)
+            if in_flight is None:
+                break
+            in_flight.wait()
+        try:
+            yield
+        finally:
+            self._end_posting(retry_key)
+
+    @asynccontextmanager
+    async def posting_async(self, target, commit_status: GitCommitStatus):
+        retry_key = (target, commit_status_key(commit_status))
+        while True:
+            in_flight = self._begin_posting(retry_key)
+            if in_flight is None:
+                break
+            await asyncio.to_thread(in_flight.wait)
+        try:
+            yield
+        finally:
+            self._end_posting(retry_key)
+
+    def on_success(self, target, commit_status: GitCommitStatus):
+        """Called after a status was posted to target, replays its dead letters if it recovered."""
+        retry_key = (target, commit_status_key(commit_status))
+        if self._pending and retry_key in self._pending:
+            with self._lock:
+                if self._pending.pop(retry_key, None) is not None:
+                    logging.debug('Pending retry superseded by a newer commit status')
+
+        if self._dead_letters is not None and self._dead_letters.has_target(target):
+            self._dead_letters.discard(target, commit_status)
+            with self._lock:
+                if target not in self._replayed_targets and self._dead_letters.has_target(target):
+                    self._replay_requests.add(target)
+                    self._wakeup.notify()
+
+    def get_metrics(self) -> dict:
+        return {
+            'commit_status_retry_pending': len(self._pending),
+            'commit_status_retried_total': self.retried_count,
+            'commit_status_retry_recovered_total': self.recovered_count,
+            'commit_status_dropped_total': self.dropped_count,
+            'commit_status_dead_lettered_total': self.dead_lettered_count,
+            'dead_letter_probes_total': self.probe_count,
+            'dead_letter_probe_failures_total': self.probe_failed_count,
+            'dead_letter_depth': self._dead_letters.size() if self._dead_letters is not None else 0,
+            'dead_letter_evicted_total': self._dead_letters.evicted_count if self._dead_letters is not None else 0,
+        }
+
+    # Returns the event of the retrier's post of retry_key in flight, or None
+    # once the drain worker may post
+    def _begin_posting(self, retry_key):
+        with self._lock:
+            in_flight = self._in_flight.get(retry_key)
+            if in_flight is None:
+                self._posting.add(retry_key)
+            return in_flight
+
+    def _end_posting(self, retry_key):
+        with self._lock:
+            self._posting.discard(retry_key)
+
+    # Returns False if a drain worker is posting retry_key, its result
+    # supersedes the retrier's older status
+    def _begin_post(self, retry_key) -> bool:
+        with self._lock:
+            if retry_key in self._posting:
+                return False
+            self._in_flight[retry_key] = threading.Event()
+            return True
+
+    def _end_post(self, retry_key):
+        with self._lock:
+            in_flight = self._in_flight.pop(retry_key, None)
+        if in_flight is not None:
+            in_flight.set()
+
+    def _schedule(self, attempt, target, commit_status, delay=None):
+        if delay is None:
+            # Exponential backoff with jitter over the upper half of the delay
+            backoff = min(self._max_delay, self._base_delay * 2 ** (attempt - 1))
+            delay = random.uniform(backoff / 2, backoff)
+        sequence = next(self._sequence)
+        retry_key = (target, commit_status_key(commit_status))
+        self._pending[retry_key] = (sequence, attempt, target, commit_status)
+        heapq.heappush(self._heap, (time.monotonic() + delay, sequence, retry_key))
+        self._wakeup.notify()
+
+    def _run(self):
+        next_probe = time.monotonic() + self._probe_interval
+        while True:
+            with self._lock:
+                while self._running and not self._replay_requests and not self._is_due() \
+                        and time.monotonic() < next_probe:
+                    timeout = next_probe - time.monotonic()
+                    if self._heap:
+                        timeout = min(timeout, self._heap[0][0] - time.monotonic())
+                    self._wakeup.wait(max(timeout, 0))
+                if not self._running:
+                    return
+                replay_requests = self._replay_requests
+                self._replay_requests = set()
+                retry = self._pop_due()
+
+            try:
+                for target in replay_requests:
+                    self._replay(target)
+                if retry is not None:
+                    self._retry(*retry)
+                elif time.monotonic() >= next_probe:
+                    next_probe = time.monotonic() + self._probe_interval
+                    self._probe()
+            except Exception as e:
+                logging.error(f'Unexpected exception in the commit status retry thread: {e}')
+
+    def _is_due(self) -> bool:
+        return bool(self._heap) and self._heap[0][0] <= time.monotonic()
+
+    def _pop_due(self):
+        while self._is_due():
+            _, sequence, retry_key = heapq.heappop(self._heap)
+            current = self._pending.get(retry_key)
+            if current is not None and current[0] == sequence:
+                del self._pending[retry_key]
+                return current[1:]
+        return None
+
+    def _retry(self, attempt, target, commit_status):
+        subscriber = self._targets.get(target)
+        if subscriber is None:
+            # The target was removed from the configuration
+            return
+
+        retry_key = (target, commit_status_key(commit_status))
+        if not self._begin_post(retry_key):
+            logging.debug('Retry superseded by a commit status being posted')
+            return
+        try:
+            self.retried_count += 1
+            try:
+                subscriber.post_commit_status(commit_status)
+            except Exception as e:
+                if attempt + 1 < self._max_attempts and is_retryable_error(e):
+                    logging.warning(f'Retry {attempt} of commit status for {target} failed: {e}')
+                    with self._lock:
+                        self._schedule(attempt + 1, target, commit_status)
+                else:
+                    logging.error(f'Giving up on commit status for {target}: {e}')
+                    self._dead_letter(target, commit_status)
+                return
+
+            self.recovered_count += 1
+            self._on_recovered(target, commit_status)
+        finally:
+            self._end_post(retry_key)
+
+    def _dead_letter(self, target, commit_status):
+        self.dead_lettered_count += 1
+        if self._dead_letters is None:
+            return
+        try:
+            self._dead_letters.add(target, commit_status)
+            with self._lock:
+                self._replayed_targets.discard(target)
+        except OSError as e:
+            logging.error(f'Failed to store dead-lettered commit status for {target}: {e}')
+
+    def _replay(self, target):
+        commit_statuses = self._dead_letters.get_entries(target)
+        logging.info(f'Replaying {len(commit_statuses)} dead-lettered commit statuses for {target}')
+        with self._lock:
+            self._replayed_targets.add(target)
+            for commit_status in commit_statuses:
+                if (target, commit_status_key(commit_status)) not in self._pending:
+                    self._schedule(1, target, commit_status, delay=0)
+
+    # Posts the oldest dead letter of every target without other traffic once.
+    # A success replays the rest through on_success, a failure leaves the dead
+    # letter where it is until the next probe.
+    def _probe(self):
+        if self._dead_letters is None:
+            return
+        for target, subscriber in list(self._targets.items()):
+            with self._lock:
+                if target in self._replayed_targets:
+                    continue
+            if not self._dead_letters.has_target(target):
+                continue
+            commit_statuses = self._dead_letters.get_entries(target)
+            if not commit_statuses:
+                continue
+
+            retry_key = (target, commit_status_key(commit_statuses[0]))
+            if not self._begin_post(retry_key):
+                continue
+            try:
+                self.probe_count += 1
+                try:
+                    subscriber.post_commit_status(commit_statuses[0])
+                except Exception as e:
+                    self.probe_failed_count += 1
+                    logging.warning(f'Probe of {target} with a dead-lettered commit status failed: {e}')
+                    continue
+                self.recovered_count += 1
+                self._on_recovered(target, commit_statuses[0])
+            finally:
+                self._end_post(retry_key)
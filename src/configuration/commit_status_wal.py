@@ -0,0 +1,179 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import dataclasses
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import utils
+from configuration.commit_status_queue import commit_status_key
+from operators.git_commit_status import GitCommitStatus
+
+# Directory of the commit status write-ahead logs, one SQLite database per
+# connector. Empty keeps pending statuses in memory only.
+STATUS_WAL_DIR = os.getenv('STATUS_WAL_DIR', '')
+# Milliseconds the WAL collects appends and acknowledgements before committing
+# them in one transaction with a single fsync.
+STATUS_WAL_COMMIT_INTERVAL = utils.getenv_int('STATUS_WAL_COMMIT_INTERVAL', 10)
+# Seconds between compactions of the database files.
+STATUS_WAL_COMPACT_INTERVAL = utils.getenv_int('STATUS_WAL_COMPACT_INTERVAL', 300)
+
+_wals = {}
+_wals_lock = threading.Lock()
+
+
+def get_commit_status_wal(connector_name):
+    """Returns the write-ahead log of a connector, None if the WAL is disabled.
+
+    Logs are shared by the connectors built for the same configuration, so a
+    rebuilt connector replays what its predecessor left unacknowledged."""
+    if not STATUS_WAL_DIR:
+        return None
+    path = os.path.join(STATUS_WAL_DIR, f'{connector_name}.db')
+    with _wals_lock:
+        wal = _wals.get(path)
+        if wal is None:
+            try:
+                os.makedirs(STATUS_WAL_DIR, exist_ok=True)
+                wal = CommitStatusWal(path)
+            except (OSError, sqlite3.Error) as e:
+                logging.error(f'Failed to open commit status WAL {path}: {e}')
+                return None
+            wal.start()
+            _wals[path] = wal
+        return wal
+
+
+# Write-ahead log of the statuses waiting in a connector's commit status queues.
+# Like the queue it keeps only the newest status per (commit_id, status_name,
+# genre), so its size is bounded by the pending contexts rather than traffic.
+#
+# Appends and acknowledgements are buffered and committed together every
+# commit_interval milliseconds (group commit), which keeps the fsync cost per
+# status low. A crash loses at most the last commit interval.
+# Instance is shared across threads.
+class CommitStatusWal:
+
+    def __init__(self, path, commit_interval=STATUS_WAL_COMMIT_INTERVAL, compact_interval=STATUS_WAL_COMPACT_INTERVAL):
+        self._path = path
+        self._commit_interval = commit_interval / 1000
+        self._compact_interval = compact_interval
+
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=FULL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS commit_statuses ('
+            'commit_id TEXT NOT NULL, status_name TEXT NOT NULL, genre TEXT NOT NULL, '
+            'req_time INTEGER NOT NULL, commit_status TEXT NOT NULL, '
+            'PRIMARY KEY (commit_id, status_name, genre))')
+        # Serializes access to the connection
+        self._db_lock = threading.Lock()
+
+        self._lock = threading.Lock()
+        # Buffered operations of the next group commit, in order
+        self._operations = []
+        self._stopped = threading.Event()
+        self._thread = None
+
+        self.appended_count = 0
+        self.acked_count = 0
+        self.commit_count = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='commit-status-wal', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        with self._db_lock:
+            self._connection.close()
+
+    def append(self, req_time, commit_status: GitCommitStatus):
+        operation = (*commit_status_key(commit_status), req_time, json.dumps(dataclasses.asdict(commit_status)))
+        with self._lock:
+            self._operations.append(('append', operation))
+            self.appended_count += 1
+
+    def ack(self, req_time, commit_status: GitCommitStatus):
+        """Marks a status as handled. A newer status of the same context stays in the log."""
+        operation = (*commit_status_key(commit_status), req_time)
+        with self._lock:
+            self._operations.append(('ack', operation))
+            self.acked_count += 1
+
+    def flush(self):
+        """Commits the buffered operations now."""
+        with self._lock:
+            operations = self._operations
+            self._operations = []
+        if not operations:
+            return
+
+        with self._db_lock:
+            with self._connection:
+                self._connection.execute('BEGIN')
+                for operation_type, operation in operations:
+                    if operation_type == 'append':
+                        # Statuses older than the logged one of their context
+                        # were not queued either
+                        self._connection.execute(
+                            'INSERT INTO commit_statuses VALUES (?, ?, ?, ?, ?) '
+                            'ON CONFLICT (commit_id, status_name, genre) DO UPDATE SET '
+                            'req_time = excluded.req_time, commit_status = excluded.commit_status '
+                            'WHERE excluded.req_time >= commit_statuses.req_time', operation)
+                    else:
+                        self._connection.execute(
+                            'DELETE FROM commit_statuses '
+                            'WHERE commit_id = ? AND status_name = ? AND genre = ? AND req_time = ?', operation)
+            self.commit_count += 1
+
+    def requeue_pending(self, req_time):
+        """Returns the unacknowledged statuses as (req_time, commit_status) in request order.
+
+        Request times do not survive a restart, so the statuses are moved to
+        consecutive request times from req_time on. They stay in the log until
+        the caller queues and acknowledges them under these request times."""
+        self.flush()
+        with self._db_lock:
+            with self._connection:
+                self._connection.execute('BEGIN')
+                rows = self._connection.execute(
+                    'SELECT commit_id, status_name, genre, commit_status FROM commit_statuses '
+                    'ORDER BY req_time').fetchall()
+                self._connection.executemany(
+                    'UPDATE commit_statuses SET req_time = ? WHERE commit_id = ? AND status_name = ? AND genre = ?',
+                    [(req_time + index, *row[:3]) for index, row in enumerate(rows)])
+        return [(req_time + index, GitCommitStatus(**json.loads(row[3]))) for index, row in enumerate(rows)]
+
+    def compact(self):
+        with self._db_lock:
+            self._connection.execute('PRAGMA incremental_vacuum')
+            self._connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def get_metrics(self) -> dict:
+        return {
+            'commit_status_wal_appended_total': self.appended_count,
+            'commit_status_wal_acked_total': self.acked_count,
+            'commit_status_wal_commits_total': self.commit_count,
+        }
+
+    def _run(self):
+        next_compaction = time.monotonic() + self._compact_interval
+        while not self._stopped.wait(self._commit_interval):
+            try:
+                self.flush()
+                if time.monotonic() >= next_compaction:
+                    next_compaction = time.monotonic() + self._compact_interval
+                    self.compact()
+            except sqlite3.Error as e:
+                logging.error(f'Failed to commit the commit status WAL {self._path}: {e}')
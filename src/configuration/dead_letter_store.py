@@ -0,0 +1,146 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import Counter
+
+import utils
+from configuration.commit_status_queue import commit_status_key
+from operators.git_commit_status import GitCommitStatus
+
+# Directory of the dead-letter stores, one subdirectory per connector. Empty
+# disables dead-lettering.
+DEAD_LETTER_DIR = os.getenv('DEAD_LETTER_DIR', '/tmp/gitops-connector-dead-letters')
+# Dead-lettered statuses kept per connector before the oldest are evicted.
+DEAD_LETTER_MAX_ENTRIES = utils.getenv_int('DEAD_LETTER_MAX_ENTRIES', 1000)
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_dead_letter_store(connector_name):
+    """Returns the dead-letter store of a connector, None if dead-lettering is disabled.
+
+    Stores are shared by the connectors built for the same configuration, so a
+    rebuilt connector sees the statuses its predecessor dead-lettered on stop."""
+    if not DEAD_LETTER_DIR:
+        return None
+    directory = os.path.join(DEAD_LETTER_DIR, connector_name)
+    with _stores_lock:
+        store = _stores.get(directory)
+        if store is None:
+            try:
+                store = DeadLetterStore(directory, DEAD_LETTER_MAX_ENTRIES)
+            except OSError as e:
+                logging.error(f'Failed to open dead-letter store {directory}: {e}')
+                return None
+            _stores[directory] = store
+        return store
+
+
+# Bounded on-disk store of commit statuses that could not be posted to a target
+# (the git repository or a raw subscriber). There is one file per target and
+# status context, so a newer failure for a context replaces the older one.
+# Beyond max_entries the oldest files are evicted.
+# Instance is shared across threads.
+class DeadLetterStore:
+
+    def __init__(self, directory, max_entries):
+        self._directory = directory
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        # path -> target, oldest first
+        self._paths = {}
+        self._target_counts = Counter()
+
+        self.evicted_count = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def add(self, target, commit_status: GitCommitStatus):
+        path = self._get_path(target, commit_status)
+        entry = {'target': target, 'commit_status': dataclasses.asdict(commit_status)}
+        with self._lock:
+            temp_path = path + '.tmp'
+            with open(temp_path, 'w') as entry_fh:
+                json.dump(entry, entry_fh)
+            os.replace(temp_path, path)
+
+            # Re-adding moves the entry to the end of the eviction order
+            self._forget(path)
+            self._paths[path] = target
+            self._target_counts[target] += 1
+            while len(self._paths) > self._max_entries:
+                self._remove(next(iter(self._paths)))
+                self.evicted_count += 1
+
+    def discard(self, target, commit_status: GitCommitStatus):
+        """Removes the stored status of the same target and context, if any."""
+        if not self._target_counts.get(target):
+            return
+        path = self._get_path(target, commit_status)
+        with self._lock:
+            if path in self._paths:
+                self._remove(path)
+
+    def has_target(self, target) -> bool:
+        return self._target_counts.get(target, 0) > 0
+
+    def get_entries(self, target):
+        """Returns the stored statuses of a target, oldest first."""
+        with self._lock:
+            paths = [path for path, path_target in self._paths.items() if path_target == target]
+
+        commit_statuses = []
+        for path in paths:
+            entry = self._read(path)
+            if entry is not None:
+                commit_statuses.append(GitCommitStatus(**entry['commit_status']))
+        return commit_statuses
+
+    def size(self) -> int:
+        return len(self._paths)
+
+    def _load(self):
+        paths = [os.path.join(self._directory, name) for name in os.listdir(self._directory) if name.endswith('.json')]
+        for path in sorted(paths, key=os.path.getmtime):
+            entry = self._read(path)
+            if entry is None:
+                os.remove(path)
+                continue
+            self._paths[path] = entry['target']
+            self._target_counts[entry['target']] += 1
+        if self._paths:
+            logging.info(f'Loaded {len(self._paths)} dead-lettered commit statuses from {self._directory}')
+
+    def _read(self, path):
+        try:
+            with open(path, 'r') as entry_fh:
+                return json.load(entry_fh)
+        except (OSError, ValueError) as e:
+            logging.error(f'Failed to read dead-lettered commit status {path}: {e}')
+            return None
+
+    def _remove(self, path):
+        self._forget(path)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _forget(self, path):
+        target = self._paths.pop(path, None)
+        if target is not None:
+            self._target_counts[target] -= 1
+            if not self._target_counts[target]:
+                del self._target_counts[target]
+
+    def _get_path(self, target, commit_status):
+        key = json.dumps([target, *commit_status_key(commit_status)])
+        return os.path.join(self._directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
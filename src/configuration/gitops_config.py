@@ -10,7 +10,8 @@ class GitOpsConfig:
                  azdo_org_url=None,
                  github_gitops_repo_name=None,
                  github_gitops_manifests_repo_name=None,
-                 github_org_url=None):
+                 github_org_url=None,
+                 status_dispatch_workers=1):
         self.name = name
         self.git_repository_type = git_repository_type
         self.cicd_orchestrator_type = cicd_orchestrator_type
@@ -22,6 +23,7 @@ class GitOpsConfig:
         self.github_gitops_repo_name = github_gitops_repo_name
         self.github_gitops_manifests_repo_name = github_gitops_manifests_repo_name
         self.github_org_url = github_org_url
+        self.status_dispatch_workers = status_dispatch_workers
 
     def __repr__(self):
         return f"<GitOpsConfig(name={self.name}, " \
@@ -34,4 +36,5 @@ class GitOpsConfig:
                f"azdo_org_url={self.azdo_org_url}, " \
                f"github_gitops_repo_name={self.github_gitops_repo_name}, " \
                f"github_gitops_manifests_repo_name={self.github_gitops_manifests_repo_name}, " \
-               f"github_org_url={self.github_org_url})>"
+               f"github_org_url={self.github_org_url}, " \
+               f"status_dispatch_workers={self.status_dispatch_workers})>"
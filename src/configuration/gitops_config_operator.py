@@ -56,6 +56,7 @@ class GitOpsConfigOperator:
             github_gitops_repo_name=spec.get("gitHubGitOpsRepoName"),
             github_gitops_manifests_repo_name=spec.get("gitHubGitOpsManifestsRepoName"),
             github_org_url=spec.get("gitHubOrgUrl"),
+            status_dispatch_workers=int(spec.get("statusDispatchWorkers", 1)),
         )
 
     def get_configuration(self, name):
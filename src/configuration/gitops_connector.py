@@ -1,21 +1,49 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
+import asyncio
 import threading
+import time
+import zlib
 from timeloop import Timeloop
 from datetime import timedelta
 import logging
-from queue import PriorityQueue
+from queue import Empty
 
+import utils
+from caching.commit_finality_cache import CommitFinalityCache
+from caching.lru_cache import LruCache
 from operators.gitops_operator_factory import GitopsOperatorFactory
 from repositories.git_repository_factory import GitRepositoryFactory
-from repositories.raw_subscriber import RawSubscriberFactory
+from repositories.raw_subscriber import serialize_commit_status
+from repositories.subscriber_registry import get_subscriber_registry
 from orchestrators.cicd_orchestrator_factory import CicdOrchestratorFactory
 from configuration.gitops_config import GitOpsConfig
+from configuration.commit_status_queue import CoalescingCommitStatusQueue, commit_status_key, is_terminal
+from configuration.commit_status_retrier import CommitStatusRetrier
+from configuration.commit_status_wal import get_commit_status_wal
+from configuration.dead_letter_store import get_dead_letter_store
+from configuration.subscriber_delivery import SubscriberDelivery
 
 # Time in seconds between background PR cleanup jobs
 PR_CLEANUP_INTERVAL = 1 * 30
 DISABLE_POLLING_PR_TASK = False
+# Pending statuses per status queue at which it starts shedding low value
+# statuses and ingest answers 429. 0 keeps the queues unbounded.
+STATUS_QUEUE_HIGH_WATERMARK = utils.getenv_int('STATUS_QUEUE_HIGH_WATERMARK', 0)
+# Pending statuses per status queue below which ingest accepts notifications
+# again. Defaults to 80% of the high watermark.
+STATUS_QUEUE_LOW_WATERMARK = utils.getenv_int('STATUS_QUEUE_LOW_WATERMARK', None)
+# Name of the git repository among the targets commit statuses are posted to.
+# Raw subscribers are named by their endpoint.
+GIT_REPOSITORY_TARGET = 'git'
+# Statuses of a shard posted concurrently by its task in ASGI server mode.
+STATUS_POST_CONCURRENCY = utils.getenv_int('STATUS_POST_CONCURRENCY', 16)
+# Commit status contexts whose last posted state is remembered to skip
+# posting the same state again. 0 disables the cache.
+POSTED_STATUS_CACHE_SIZE = utils.getenv_int('POSTED_STATUS_CACHE_SIZE', 10000)
+# Seconds a posted state is remembered.
+POSTED_STATUS_CACHE_TTL = utils.getenv_int('POSTED_STATUS_CACHE_TTL', 600)
 
 # Instance is shared across threads.
 class GitopsConnector:
@@ -27,8 +55,14 @@ class GitopsConnector:
         self._git_repository = GitRepositoryFactory.new_git_repository(gitops_config)
         self._cicd_orchestrator = CicdOrchestratorFactory.new_cicd_orchestrator(self._git_repository, gitops_config)
 
-        self.status_thread = None
+        self.status_threads = []
         self.status_thread_running = False
+
+        # Set when the commit status queues are drained on an asyncio event loop
+        # (ASGI server mode) instead of dedicated threads.
+        self._event_loop = None
+        self._status_tasks = []
+        self._status_events = {}
         
         self.cleanup_task = Timeloop()
         self.cleanup_task_running = False
@@ -39,38 +73,237 @@ class GitopsConnector:
             self.notify_abandoned_pr_tasks()
             logging.info(f'Finished PR cleanup, sleeping for {PR_CLEANUP_INTERVAL} seconds...')
 
-        # Subscribers that take unprocessed JSON, forwarded from the notifications
-        self._raw_subscribers = RawSubscriberFactory.new_raw_subscribers()
+        # Subscribers that take unprocessed JSON, forwarded from the notifications.
+        # They are shared by all connectors and reloaded when their
+        # configuration changes.
+        self._subscriber_registry = get_subscriber_registry()
+        raw_subscribers = self._subscriber_registry.get_subscribers()
+
+        # Commit status notification queues, coalescing superseded statuses.
+        # Statuses are sharded by commit id, so each commit's statuses are
+        # posted in request order by one worker while different commits are
+        # posted concurrently.
+        self._status_dispatch_workers = max(1, gitops_config.status_dispatch_workers)
+        # Shed statuses are acknowledged, they will never be posted
+        self._status_queues = [CoalescingCommitStatusQueue(STATUS_QUEUE_HIGH_WATERMARK, STATUS_QUEUE_LOW_WATERMARK,
+                                                           on_shed=self._ack_commit_status)
+                               for _ in range(self._status_dispatch_workers)]
+        # Payloads rejected because their status queue is saturated, counted
+        # from the handler threads
+        self.throttled_count = 0
+        self._throttled_lock = threading.Lock()
+
+        # Failed posts are retried in the background and dead-lettered when
+        # they run out of attempts, per target
+        self._status_targets = {GIT_REPOSITORY_TARGET: self._git_repository}
+        self._status_targets.update((subscriber.url_endpoint, subscriber) for subscriber in raw_subscribers)
+        self._status_retrier = CommitStatusRetrier(self._status_targets, get_dead_letter_store(gitops_config.name),
+                                                   on_recovered=self._on_post_success)
+
+        # Each subscriber gets its statuses from its own queue and thread, off
+        # the path of the git repository posts. The list is swapped, never
+        # mutated, when the subscribers are reloaded.
+        self._subscriber_deliveries = [SubscriberDelivery(subscriber, self._on_post_success, self._on_post_failure)
+                                       for subscriber in raw_subscribers]
+        # Deliveries of removed subscribers finishing their queues
+        self._closed_deliveries = []
+        self._subscribers_lock = threading.Lock()
+        self._subscribers_running = False
+
+        # (commit_id, status_name, genre) -> (state, message) last posted to
+        # the git repository. Operators re-send the same state repeatedly.
+        self._posted_status_cache = LruCache(POSTED_STATUS_CACHE_SIZE, POSTED_STATUS_CACHE_TTL)
+
+        # Keeps is_commit_finished lookups off the ingest path for commits
+        # seen recently
+        self._commit_finality = CommitFinalityCache(self._git_repository.is_commit_finished,
+                                                    self._git_repository.is_commit_finished_async)
+
+        # Optional write-ahead log of the queued statuses, replayed when the
+        # background work starts
+        self._status_wal = get_commit_status_wal(gitops_config.name)
 
-        # Commit status notification queue
-        self._global_message_queue = PriorityQueue()
+    def get_metrics(self) -> dict:
+        metrics = {
+            'commit_status_dispatch_workers': self._status_dispatch_workers,
+            'ingest_throttled_total': self.throttled_count,
+        }
+        for status_queue in self._status_queues:
+            for name, value in status_queue.get_metrics().items():
+                metrics[name] = metrics.get(name, 0) + value
+        metrics.update(self._status_retrier.get_metrics())
+        metrics.update(self._posted_status_cache.get_metrics('posted_status'))
+        metrics.update(self._commit_finality.get_metrics())
+        metrics.update(self._git_repository.get_metrics())
+        metrics.update(self._cicd_orchestrator.get_metrics())
+        if self._status_wal is not None:
+            metrics.update(self._status_wal.get_metrics())
+        metrics.update(self._subscriber_registry.get_metrics())
+        for delivery in self._subscriber_deliveries:
+            for name, value in delivery.get_metrics().items():
+                metrics.setdefault(name, {})[delivery.url_endpoint] = value
+        return metrics
 
     def is_supported_message(self, payload):
         return self._gitops_operator.is_supported_message(payload)
+
+    def is_saturated(self, payload) -> bool:
+        """True if the status queue the payload's statuses would go to is saturated."""
+        commit_id = self._gitops_operator.get_commit_id(payload)
+        if self._status_queues[self._get_shard(commit_id)].is_saturated():
+            with self._throttled_lock:
+                self.throttled_count += 1
+            return True
+        return False
     
-    def start_background_work(self):
-        self._start_status_thread()
+    def start_background_work(self, event_loop=None):
+        self._prewarm_connections()
+        self._replay_status_wal()
+        if event_loop is None:
+            self._start_status_thread()
+        else:
+            self._start_status_task(event_loop)
+        self._start_subscriber_deliveries()
+        self._status_retrier.start()
         self._start_cleanup_task()
 
     def stop_background_work(self):
         self._stop_status_thread()
+        # Undelivered statuses go to the retrier, which dead-letters them
+        self._stop_subscriber_deliveries()
+        self._status_retrier.stop()
         self._stop_cleanup_task()
+        self._flush_status_wal()
+
+    async def stop_background_work_async(self):
+        status_tasks = self._status_tasks
+        self.stop_background_work()
+        for status_task in status_tasks:
+            await asyncio.wrap_future(status_task)
+        self._flush_status_wal()
+
+    # Each dispatch worker gets a keep-alive connection to the git repository,
+    # each subscriber delivery thread one to its subscriber
+    def _prewarm_connections(self):
+        self._git_repository.prewarm_connections(self._status_dispatch_workers)
+        for delivery in self._subscriber_deliveries:
+            delivery.subscriber.prewarm_connections()
+
+    def _start_subscriber_deliveries(self):
+        with self._subscribers_lock:
+            self._subscribers_running = True
+            for delivery in self._subscriber_deliveries:
+                delivery.start()
+        # Catches up with reloads since the connector was created
+        self._subscriber_registry.add_listener(self._update_subscribers)
+        self._update_subscribers(self._subscriber_registry.get_subscribers())
+
+    def _stop_subscriber_deliveries(self):
+        self._subscriber_registry.remove_listener(self._update_subscribers)
+        with self._subscribers_lock:
+            self._subscribers_running = False
+            deliveries = self._subscriber_deliveries + self._closed_deliveries
+            self._closed_deliveries = []
+        for delivery in deliveries:
+            delivery.stop()
+
+    # Called by the subscriber registry when the subscribers were reloaded.
+    # Deliveries of unchanged subscribers are kept, changed subscribers keep
+    # their queue, and removed ones deliver what they have queued before
+    # their thread ends. Removed subscribers stay retry targets, so statuses
+    # that failed before the removal are not dropped either.
+    def _update_subscribers(self, subscribers):
+        with self._subscribers_lock:
+            if not self._subscribers_running:
+                return
+            deliveries = {delivery.url_endpoint: delivery for delivery in self._subscriber_deliveries}
+            updated_deliveries = []
+            for subscriber in subscribers:
+                delivery = deliveries.pop(subscriber.url_endpoint, None)
+                if delivery is None:
+                    logging.info(f'Adding subscriber {subscriber.url_endpoint}')
+                    delivery = SubscriberDelivery(subscriber, self._on_post_success, self._on_post_failure)
+                    subscriber.prewarm_connections()
+                    delivery.start()
+                elif delivery.subscriber is not subscriber:
+                    logging.info(f'Updating the options of subscriber {subscriber.url_endpoint}')
+                    delivery.update(subscriber)
+                self._status_targets[subscriber.url_endpoint] = subscriber
+                updated_deliveries.append(delivery)
+            self._subscriber_deliveries = updated_deliveries
+
+            for delivery in deliveries.values():
+                logging.info(f'Removing subscriber {delivery.url_endpoint}')
+                delivery.close()
+            self._closed_deliveries = [delivery for delivery in self._closed_deliveries if delivery.is_running]
+            self._closed_deliveries.extend(deliveries.values())
+
+    def _replay_status_wal(self):
+        if self._status_wal is None or self.status_thread_running:
+            return
+        pending = self._status_wal.requeue_pending(time.monotonic_ns())
+        if pending:
+            logging.info(f'Replaying {len(pending)} unacknowledged commit statuses from the WAL')
+            # Already logged under these request times
+            self._enqueue_commit_statuses(pending)
+
+    def _flush_status_wal(self):
+        if self._status_wal is not None:
+            self._status_wal.flush()
 
     def _start_status_thread(self):
         if not self.status_thread_running:
             self.status_thread_running = True
-            self.status_thread = threading.Thread(target=self.drain_commit_status_queue)
-            self.status_thread.start()
-            logging.debug('Started status thread')
+            for shard in range(self._status_dispatch_workers):
+                status_thread = threading.Thread(target=self.drain_commit_status_queue, args=(shard,))
+                status_thread.start()
+                self.status_threads.append(status_thread)
+            logging.debug(f'Started {self._status_dispatch_workers} status threads')
+
+    def _start_status_task(self, event_loop):
+        if not self.status_thread_running:
+            self.status_thread_running = True
+            self._event_loop = event_loop
+            for shard in range(self._status_dispatch_workers):
+                self._status_tasks.append(
+                    asyncio.run_coroutine_threadsafe(self.drain_commit_status_queue_async(shard), event_loop))
+            logging.debug(f'Started {self._status_dispatch_workers} status tasks')
 
     def _stop_status_thread(self):
         if self.status_thread_running:
             self.status_thread_running = False
-            if self.status_thread:
-                # Force the queue loop to break once it's processed remaining messages
-                self._global_message_queue.put(None)
-                self.status_thread.join()
-                logging.debug('Stopped status thread')
+            # Force the queue loops to break once they've processed remaining messages
+            for shard, status_queue in enumerate(self._status_queues):
+                status_queue.close()
+                self._wake_status_task(shard)
+            if self.status_threads:
+                for status_thread in self.status_threads:
+                    status_thread.join()
+                self.status_threads = []
+                logging.debug('Stopped status threads')
+            elif self._status_tasks:
+                # The tasks finish the remaining messages on their own loop. Only
+                # wait for them if we are not running on that loop ourselves.
+                if not self._is_on_event_loop():
+                    for status_task in self._status_tasks:
+                        status_task.result()
+                self._status_tasks = []
+                logging.debug('Stopped status tasks')
+
+    def _is_on_event_loop(self):
+        try:
+            return asyncio.get_running_loop() is self._event_loop
+        except RuntimeError:
+            return False
+
+    def _wake_status_task(self, shard):
+        status_event = self._status_events.get(shard)
+        if self._event_loop is not None and status_event is not None:
+            self._event_loop.call_soon_threadsafe(status_event.set)
+
+    def _get_shard(self, commit_id) -> int:
+        # crc32 is stable across processes and restarts, unlike hash()
+        return zlib.crc32(commit_id.encode('utf-8')) % self._status_dispatch_workers
 
     def _start_cleanup_task(self):
         if not self.cleanup_task_running:
@@ -84,21 +317,46 @@ class GitopsConnector:
             if self.cleanup_task:
                 self.cleanup_task.stop()
                 logging.debug('Stopped cleanup task')
+            self._cicd_orchestrator.stop()
 
     def process_gitops_phase(self, phase_data, req_time):
         if self._gitops_operator.is_supported_message(phase_data):
             commit_id = self._gitops_operator.get_commit_id(phase_data)
-            if not self._git_repository.is_commit_finished(commit_id):
+            if not self._commit_finality.is_commit_finished(commit_id):
                 self._queue_commit_statuses(phase_data, req_time)
                 self._notify_orchestrator(phase_data, commit_id)
         else:
             logging.debug(f'Message is not supported: {phase_data}')
 
+    async def process_gitops_phase_async(self, phase_data, req_time):
+        if self._gitops_operator.is_supported_message(phase_data):
+            commit_id = self._gitops_operator.get_commit_id(phase_data)
+            if not await self._commit_finality.is_commit_finished_async(commit_id):
+                self._queue_commit_statuses(phase_data, req_time)
+                await self._notify_orchestrator_async(phase_data, commit_id)
+        else:
+            logging.debug('Message is not supported: %s', phase_data)
+
     def _queue_commit_statuses(self, phase_data, req_time):
         logging.debug('_queue_commit_statuses called')
         commit_statuses = self._gitops_operator.extract_commit_statuses(phase_data)
-        for commit_status in commit_statuses:
-            self._global_message_queue.put(item=(req_time, commit_status))
+        self._put_commit_statuses(req_time, commit_statuses)
+
+    def _put_commit_statuses(self, req_time, commit_statuses):
+        # Logged before queueing so that the acknowledgement comes after it
+        if self._status_wal is not None:
+            for commit_status in commit_statuses:
+                self._status_wal.append(req_time, commit_status)
+        self._enqueue_commit_statuses([(req_time, commit_status) for commit_status in commit_statuses])
+
+    def _enqueue_commit_statuses(self, entries):
+        shards = set()
+        for req_time, commit_status in entries:
+            shard = self._get_shard(commit_status.commit_id)
+            self._status_queues[shard].put(req_time, commit_status)
+            shards.add(shard)
+        for shard in shards:
+            self._wake_status_task(shard)
 
     def _notify_orchestrator(self, phase_data, commit_id):
         logging.debug('_notify_orchestrator called')
@@ -108,6 +366,11 @@ class GitopsConnector:
         if is_finished:
             self._cicd_orchestrator.notify_on_deployment_completion(commit_id, is_successful)
 
+    async def _notify_orchestrator_async(self, phase_data, commit_id):
+        is_finished, is_successful = self._gitops_operator.is_finished(phase_data)
+        if is_finished:
+            await self._cicd_orchestrator.notify_on_deployment_completion_async(commit_id, is_successful)
+
     # Entrypoint for the periodic task to search for abandoned PRs linked to
     # agentless tasks.
     def notify_abandoned_pr_tasks(self):
@@ -116,30 +379,153 @@ class GitopsConnector:
         except Exception as e:
             logging.error(f'Failed to notify abandoned PRs: {e}')
 
-    # Entrypoint for the commit status thread.
-    # The thread waits for items in the priority queue and sends the messages
-    # in the order of the request received time.
-    def drain_commit_status_queue(self):
+    # Entrypoint for the commit status threads, one per shard.
+    # The thread waits for items in the shard's coalescing queue and sends the
+    # messages in the order of the request received time.
+    def drain_commit_status_queue(self, shard=0):
+        status_queue = self._status_queues[shard]
         while (True):
             try:
                 # Blocking get
-                commit_status = self._global_message_queue.get()
+                queued_status = status_queue.get()
 
-                if not commit_status:
+                if not queued_status:
                     break
 
-                # Queue entry is (received time, commit_status)
-                commit_status = commit_status[1]
+                commit_status = queued_status.commit_status
 
                 # Handling an exception as it crashes the draining thread
+                with self._status_retrier.posting(GIT_REPOSITORY_TARGET, commit_status):
+                    if not self._is_already_posted(GIT_REPOSITORY_TARGET, commit_status):
+                        try:
+                            self._git_repository.post_commit_status(commit_status)
+                        except Exception as e:
+                            self._on_post_failure(GIT_REPOSITORY_TARGET, commit_status, e)
+                        else:
+                            self._on_post_success(GIT_REPOSITORY_TARGET, commit_status)
+                deliveries = self._subscriber_deliveries
+                payload = self._serialize_for_subscribers(commit_status)
+                on_delivered = self._ack_when_delivered(queued_status, len(deliveries))
+                for delivery in deliveries:
+                    delivery.put(commit_status, payload, on_delivered)
+
+            except Exception as e:
+                logging.error(f'Unexpected exception in the message queue draining thread: {e}')
+
+    # Entrypoint for the commit status task in ASGI server mode.
+    # Upstream calls are awaited on the event loop instead of blocking a thread.
+    # The task takes up to STATUS_POST_CONCURRENCY pending statuses at once and
+    # posts them concurrently, which HTTP/2 multiplexes over one connection.
+    # The queue holds at most one status per context, so a batch never
+    # reorders statuses of the same context. The overall Status of a commit
+    # is posted after the per-resource statuses of the batch.
+    async def drain_commit_status_queue_async(self, shard=0):
+        status_queue = self._status_queues[shard]
+        status_event = asyncio.Event()
+        self._status_events[shard] = status_event
+        while (True):
+            try:
                 try:
-                    self._git_repository.post_commit_status(commit_status)
+                    queued_status = status_queue.get_nowait()
+                except Empty:
+                    # Producers set the event through call_soon_threadsafe after
+                    # every put, so clearing before waiting cannot lose a wakeup.
+                    status_event.clear()
+                    await status_event.wait()
+                    continue
 
-                    for subscriber in self._raw_subscribers:
-                        subscriber.post_commit_status(commit_status)
-                except Exception as e:
-                    logging.error(f'Failed to update GitCommit Status: {e}')
+                if not queued_status:
+                    break
+
+                batch = [queued_status]
+                while len(batch) < STATUS_POST_CONCURRENCY:
+                    try:
+                        queued_status = status_queue.get_nowait()
+                    except Empty:
+                        break
+                    if not queued_status:
+                        break
+                    batch.append(queued_status)
+
+                resource_statuses = [entry for entry in batch if entry.commit_status.status_name != 'Status']
+                overall_statuses = [entry for entry in batch if entry.commit_status.status_name == 'Status']
+                for wave in (resource_statuses, overall_statuses):
+                    if wave:
+                        await asyncio.gather(*(self._post_commit_status_async(entry) for entry in wave))
 
             except Exception as e:
-                logging.error(f'Unexpected exception in the message queue draining thread: {e}')
+                logging.error(f'Unexpected exception in the message queue draining task: {e}')
+
+    async def _post_commit_status_async(self, queued_status):
+        commit_status = queued_status.commit_status
+        async with self._status_retrier.posting_async(GIT_REPOSITORY_TARGET, commit_status):
+            if not self._is_already_posted(GIT_REPOSITORY_TARGET, commit_status):
+                try:
+                    await self._git_repository.post_commit_status_async(commit_status)
+                except Exception as e:
+                    self._on_post_failure(GIT_REPOSITORY_TARGET, commit_status, e)
+                else:
+                    self._on_post_success(GIT_REPOSITORY_TARGET, commit_status)
+        deliveries = self._subscriber_deliveries
+        payload = self._serialize_for_subscribers(commit_status)
+        on_delivered = self._ack_when_delivered(queued_status, len(deliveries))
+        for delivery in deliveries:
+            await delivery.put_async(commit_status, payload, on_delivered)
+
+    # A status is serialized once, however many subscribers it is delivered to
+    def _serialize_for_subscribers(self, commit_status):
+        if not self._subscriber_deliveries:
+            return None
+        return serialize_commit_status(commit_status)
 
+    # Returns the callback acknowledging a status once each of the deliveries
+    # reported its result, or acknowledges it now if there are none. A crash
+    # before then replays the status to the git repository and subscribers.
+    def _ack_when_delivered(self, queued_status, delivery_count):
+        if delivery_count == 0:
+            self._ack_commit_status(queued_status)
+            return None
+        remaining = [delivery_count]
+        lock = threading.Lock()
+
+        def on_delivered():
+            with lock:
+                remaining[0] -= 1
+                is_delivered = remaining[0] == 0
+            if is_delivered:
+                self._ack_commit_status(queued_status)
+        return on_delivered
+
+    # Failed posts are owned by the retrier from here on
+    def _ack_commit_status(self, queued_status):
+        if self._status_wal is not None:
+            self._status_wal.ack(queued_status.req_time, queued_status.commit_status)
+
+    # The git repository already shows this state for the context, posting it
+    # again would only re-trigger PR checks
+    def _is_already_posted(self, target, commit_status):
+        if target != GIT_REPOSITORY_TARGET:
+            return False
+        posted = self._posted_status_cache.get(commit_status_key(commit_status))
+        if posted != (commit_status.state, commit_status.message):
+            return False
+        logging.debug('Skipping already posted commit status: %s', commit_status)
+        self._status_retrier.on_success(target, commit_status)
+        return True
+
+    def _on_post_success(self, target, commit_status):
+        if target == GIT_REPOSITORY_TARGET:
+            self._posted_status_cache.put(commit_status_key(commit_status), (commit_status.state, commit_status.message))
+            # Our own terminal status may have finished the commit
+            if is_terminal(commit_status):
+                self._commit_finality.invalidate(commit_status.commit_id)
+        self._status_retrier.on_success(target, commit_status)
+
+    def _on_post_failure(self, target, commit_status, error):
+        if target == GIT_REPOSITORY_TARGET:
+            # The state shown by the git repository is unknown now
+            self._posted_status_cache.pop(commit_status_key(commit_status))
+            logging.error(f'Failed to update GitCommit Status: {error}')
+        else:
+            logging.error(f'Failed to post commit status to subscriber {target}: {error}')
+        self._status_retrier.on_failure(target, commit_status, error)
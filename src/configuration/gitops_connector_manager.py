@@ -1,34 +1,62 @@
 import logging
+import threading
+from types import MappingProxyType
 from configuration.gitops_connector import GitopsConnector
 from configuration.gitops_config import GitOpsConfig
 
+SINGLE_INSTANCE_CONFIG_NAME = 'singleInstance'
+# Notification attribute naming the gitopsconfig a message is routed to.
+# Argo puts it at the top level of the payload, Flux in the event metadata.
+CONFIG_NAME_KEY = 'gitops_connector_config_name'
+
+
 class GitOpsConnectorManager:
     """Manages configurations and the lifecycle of GitOpsConnector instances."""
-    def __init__(self):
-        self.connectors: dict[str, GitopsConnector] = {}
+    def __init__(self, use_event_loop=False):
+        # Routing table keyed by gitopsconfig name. It is never mutated in place:
+        # writers build a new table and swap the reference, so request threads
+        # can read it without locking while the kopf thread updates it.
+        self.connectors: MappingProxyType[str, GitopsConnector] = MappingProxyType({})
+        self._update_lock = threading.Lock()
+
+        # In ASGI server mode connectors drain their queues on the server's
+        # event loop. Connectors added before the loop is attached are started
+        # by attach_event_loop.
+        self._use_event_loop = use_event_loop
+        self._event_loop = None
 
     def add_or_update_configuration(self, config: GitOpsConfig):
         """Add a new configuration or update an existing one."""
-        existing_connector = self.connectors.get(config.name)
-
-        if existing_connector:
-            # Stop the background work if the configuration is being updated
-            existing_connector.start_background_work()
-
         # Create a new connector for the updated configuration
         new_connector = GitopsConnector(config)
-        self.connectors[config.name] = new_connector
+
+        with self._update_lock:
+            connectors = dict(self.connectors)
+            existing_connector = connectors.get(config.name)
+            connectors[config.name] = new_connector
+            self.connectors = MappingProxyType(connectors)
+            event_loop = self._event_loop
+
+        if existing_connector:
+            # Stop the background work of the replaced connector
+            existing_connector.stop_background_work()
 
         # Start background work
-        new_connector.start_background_work()
+        if not self._use_event_loop:
+            new_connector.start_background_work()
+        elif event_loop is not None:
+            new_connector.start_background_work(event_loop)
         logging.debug(f"Configuration for {config.name} added/updated.")
 
     def remove_configuration(self, config: GitOpsConfig):
         """Remove a configuration and stop the associated connector."""
-        connector = self.connectors.get(config.name)
+        with self._update_lock:
+            connectors = dict(self.connectors)
+            connector = connectors.pop(config.name, None)
+            self.connectors = MappingProxyType(connectors)
+
         if connector:
             connector.stop_background_work()
-            del self.connectors[config.name]
             logging.debug(f"Configuration for {config.name} removed.")
 
     def stop_all(self):
@@ -37,9 +65,52 @@ class GitOpsConnectorManager:
             connector.stop_background_work()
         logging.debug("All background work stopped.")
 
+    def get_metrics(self) -> dict:
+        """Get the metrics of every connector keyed by configuration name."""
+        return {name: connector.get_metrics() for name, connector in self.connectors.items()}
+
+    def attach_event_loop(self, event_loop):
+        """Start the background work of all connectors on the given event loop."""
+        with self._update_lock:
+            self._event_loop = event_loop
+            connectors = list(self.connectors.values())
+        for connector in connectors:
+            connector.start_background_work(event_loop)
+        logging.debug("Background work attached to the event loop.")
+
+    async def stop_all_async(self):
+        """Stop all connectors from the event loop, waiting for their queues to drain."""
+        for connector in self.connectors.values():
+            await connector.stop_background_work_async()
+        logging.debug("All background work stopped.")
+
     def get_supported_gitops_connector(self, payload):
         """Get the gitops_connector object by payload."""
-        for connector in self.connectors.values():
-            if (connector.is_supported_message(payload)):
-                return connector
+        connectors = self.connectors
+
+        # Fast path: in single instance mode every message goes to one connector.
+        connector = connectors.get(SINGLE_INSTANCE_CONFIG_NAME)
+        if connector is None:
+            connector = connectors.get(self._get_config_name(payload))
+
+        if connector is not None and connector.is_supported_message(payload):
+            return connector
         return None
+
+    def is_saturated(self, payload) -> bool:
+        """Check whether the connector the payload is routed to has to push back on senders."""
+        try:
+            connector = self.get_supported_gitops_connector(payload)
+            return connector is not None and connector.is_saturated(payload)
+        except Exception:
+            # Malformed messages are rejected by the regular processing
+            return False
+
+    @staticmethod
+    def _get_config_name(payload):
+        config_name = payload.get(CONFIG_NAME_KEY)
+        if config_name is None:
+            metadata = payload.get('metadata')
+            if isinstance(metadata, dict):
+                config_name = metadata.get(CONFIG_NAME_KEY)
+        return config_name
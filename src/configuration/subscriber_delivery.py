@@ -0,0 +1,225 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import utils
+from repositories.raw_subscriber import BLOCK, DROP_OLDEST, RawSubscriber, serialize_commit_status
+
+# Statuses queued per raw subscriber before its backpressure policy applies.
+# Overridden per subscriber by its queue_size option.
+SUBSCRIBER_QUEUE_SIZE = utils.getenv_int('SUBSCRIBER_QUEUE_SIZE', 1000)
+# What a full subscriber queue does with a new status. Overridden per
+# subscriber by its backpressure option.
+SUBSCRIBER_BACKPRESSURE = os.getenv('SUBSCRIBER_BACKPRESSURE', 'drop-oldest')
+# Milliseconds a batched subscriber's first queued status waits for the batch
+# to fill up. Overridden per subscriber by its batch_linger_ms option.
+SUBSCRIBER_BATCH_LINGER = utils.getenv_int('SUBSCRIBER_BATCH_LINGER', 200)
+if SUBSCRIBER_BACKPRESSURE not in (DROP_OLDEST, BLOCK):
+    logging.error(f'Unknown SUBSCRIBER_BACKPRESSURE {SUBSCRIBER_BACKPRESSURE}, using {DROP_OLDEST}')
+    SUBSCRIBER_BACKPRESSURE = DROP_OLDEST
+
+
+class SubscriberStoppedError(Exception):
+    """The connector stopped before the status was delivered to the subscriber."""
+
+
+# Delivers commit statuses to one raw subscriber from its own bounded queue on
+# its own thread, so a slow or unreachable subscriber never delays the posts to
+# the git repository or to other subscribers. Delivery results are reported to
+# on_success(target, commit_status) and on_failure(target, commit_status, error)
+# like the drain workers do, failed deliveries are retried by the retrier.
+# A status may also carry on_delivered(), called once its result was reported
+# or it was dropped, so the caller knows when it is no longer queued.
+#
+# A batched subscriber is posted up to batch_size queued statuses at once, as
+# soon as that many are queued or the oldest has waited batch_linger_ms.
+#
+# The subscriber and its options can be swapped without losing queued
+# statuses, and a closed delivery finishes its queue before its thread ends.
+# Statuses put into a closed or stopped delivery fail right away.
+# Instance is shared across threads.
+class SubscriberDelivery:
+
+    def __init__(self, subscriber: RawSubscriber, on_success, on_failure):
+        self._on_success = on_success
+        self._on_failure = on_failure
+        self._configure(subscriber)
+
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        # (enqueued_at, commit_status, payload, on_delivered), oldest first
+        self._queue = deque()
+        self._running = False
+        self._closing = False
+        self._stopped = False
+        self._thread = None
+
+        self.delivered_count = 0
+        self.dropped_count = 0
+        self.blocked_count = 0
+        self.batch_count = 0
+        # Seconds between queueing and delivery of the last delivered status
+        self.last_lag = 0.0
+
+    @property
+    def url_endpoint(self):
+        return self.subscriber.url_endpoint
+
+    def start(self):
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name='subscriber-delivery', daemon=True)
+        self._thread.start()
+
+    def update(self, subscriber: RawSubscriber):
+        """Delivers the queued and future statuses with the options of subscriber."""
+        with self._lock:
+            self._configure(subscriber)
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+
+    def close(self):
+        """Stops delivering once the queued statuses are delivered."""
+        with self._lock:
+            self._closing = True
+            self._not_empty.notify_all()
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def stop(self):
+        """Stops delivering. Statuses still queued are reported as failed, so the
+        retrier keeps them in the dead-letter store."""
+        with self._lock:
+            self._running = False
+            self._stopped = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        with self._lock:
+            undelivered = list(self._queue)
+            self._queue.clear()
+        for _, commit_status, _, on_delivered in undelivered:
+            self._on_failure(self.url_endpoint, commit_status, SubscriberStoppedError('Connector stopped'))
+            self._report_delivered(on_delivered)
+
+    def put(self, commit_status, payload=None, on_delivered=None):
+        """Queues a status, payload is its serialization shared by all subscribers."""
+        dropped = None
+        with self._lock:
+            if len(self._queue) >= self._max_size and self._backpressure == BLOCK and not self._closing:
+                self.blocked_count += 1
+                while self._running and len(self._queue) >= self._max_size:
+                    self._not_full.wait()
+            # The thread ends once the queue is finished, nothing would deliver
+            # the status
+            is_closed = self._closing or self._stopped
+            if not is_closed:
+                if len(self._queue) >= self._max_size:
+                    dropped = self._queue.popleft()
+                    self.dropped_count += 1
+                    logging.warning('Subscriber %s queue is full, dropped its oldest commit status', self.url_endpoint)
+                self._queue.append((time.monotonic(), commit_status, payload, on_delivered))
+                self._not_empty.notify()
+        if dropped is not None:
+            self._report_delivered(dropped[3])
+        if is_closed:
+            self._on_failure(self.url_endpoint, commit_status, SubscriberStoppedError('Subscriber removed'))
+            self._report_delivered(on_delivered)
+
+    async def put_async(self, commit_status, payload=None, on_delivered=None):
+        # Only waiting for room blocks, and that must not block the event loop
+        if self._backpressure == BLOCK and len(self._queue) >= self._max_size:
+            await asyncio.to_thread(self.put, commit_status, payload, on_delivered)
+        else:
+            self.put(commit_status, payload, on_delivered)
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            oldest = self._queue[0][0] if self._queue else None
+            depth = len(self._queue)
+        return {
+            'subscriber_queue_depth': depth,
+            # Age of the oldest status waiting for delivery
+            'subscriber_lag_seconds': round(time.monotonic() - oldest, 3) if oldest is not None else 0,
+            'subscriber_last_delivery_lag_seconds': round(self.last_lag, 3),
+            'subscriber_delivered_total': self.delivered_count,
+            'subscriber_dropped_total': self.dropped_count,
+            'subscriber_blocked_total': self.blocked_count,
+            'subscriber_batches_total': self.batch_count,
+        }
+
+    # Called with the lock held, or before it exists. The options were
+    # validated when the subscriber was read, so a reload never fails here.
+    def _configure(self, subscriber):
+        self.subscriber = subscriber
+        queue_size = subscriber.queue_size if subscriber.queue_size is not None else SUBSCRIBER_QUEUE_SIZE
+        self._max_size = max(1, queue_size)
+        self._backpressure = subscriber.backpressure or SUBSCRIBER_BACKPRESSURE
+        batch_linger = subscriber.batch_linger_ms if subscriber.batch_linger_ms is not None else SUBSCRIBER_BATCH_LINGER
+        self._batch_linger = max(0, batch_linger) / 1000
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while self._running and not self._closing and not self._queue:
+                    self._not_empty.wait()
+                subscriber = self.subscriber
+                batch_size = subscriber.batch_size if subscriber.is_batched else 1
+                # The batch stays queued while it lingers, so stop reports it
+                deadline = self._queue[0][0] + self._batch_linger if self._queue else 0
+                while self._running and not self._closing and len(self._queue) < batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._not_empty.wait(remaining)
+                # Stopped, or closed with nothing left to deliver
+                if not self._running or not self._queue:
+                    return
+                batch = [self._queue.popleft() for _ in range(min(batch_size, len(self._queue)))]
+                self._not_full.notify_all()
+
+            try:
+                if subscriber.is_batched:
+                    subscriber.post_batch([self._serialize(commit_status, payload)
+                                           for _, commit_status, payload, _ in batch])
+                    self.batch_count += 1
+                else:
+                    _, commit_status, payload, _ = batch[0]
+                    subscriber.post_commit_status(commit_status, payload)
+            except Exception as e:
+                for _, commit_status, _, on_delivered in batch:
+                    self._on_failure(self.url_endpoint, commit_status, e)
+                    self._report_delivered(on_delivered)
+            else:
+                self.delivered_count += len(batch)
+                self.last_lag = time.monotonic() - batch[0][0]
+                for _, commit_status, _, on_delivered in batch:
+                    self._on_success(self.url_endpoint, commit_status)
+                    self._report_delivered(on_delivered)
+
+    @staticmethod
+    def _report_delivered(on_delivered):
+        if on_delivered is None:
+            return
+        try:
+            on_delivered()
+        except Exception as e:
+            logging.error(f'Failed to report a delivered commit status: {e}')
+
+    @staticmethod
+    def _serialize(commit_status, payload):
+        return payload if payload is not None else serialize_commit_status(commit_status)
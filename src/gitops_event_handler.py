@@ -1,7 +1,7 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
-from flask import Flask, request
+from flask import Flask, request, jsonify
 import logging
 import kopf
 from kubernetes import client, config
@@ -9,53 +9,91 @@ from kubernetes.client.rest import ApiException
 import atexit
 import time
 import utils
+import metrics
+import structured_logging
+from structured_logging import LazyCall, debug_event, RAW_REQUEST_EVENT
 import os
 from threading import Thread
 from configuration.gitops_connector_manager import GitOpsConnectorManager
 from configuration.gitops_config_operator import GitOpsConfigOperator
 from configuration.gitops_config import GitOpsConfig
+from ingestion.phase_ingestor import PhaseIngestor
+from ingestion.phase_batch import parse_phase_batch
+from ingestion.asgi_application import GitOpsPhaseAsgiApplication
+from ingestion.leader_election import LeaderElector
+from ingestion.leader_relay import LeaderRelayServer, LeaderRelayClient
+from ingestion.backpressure import INGEST_QUEUE_FULL, NO_SUPPORTING_CONNECTOR, STATUS_QUEUE_FULL, get_retry_response, get_rejection_status, get_batch_retry_after
 
-logging.basicConfig(level=logging.DEBUG)
+structured_logging.configure_logging()
+
+# 'wsgi' serves the Flask application with gunicorn, 'asgi' serves
+# asgi_application with uvicorn on a single event loop.
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi')
 
 application = Flask(__name__)
 
-connector_manager = GitOpsConnectorManager()
+connector_manager = GitOpsConnectorManager(use_event_loop=SERVER_MODE == 'asgi')
 gitops_config_operator = GitOpsConfigOperator(connector_manager)
 
+# When enabled, /gitopsphase only validates and enqueues the notification and
+# returns 202. Routing, status extraction and orchestrator notification happen
+# on the ingestor's background workers.
+phase_ingestor = None
+if utils.getenv_bool('ASYNC_INGESTION') and SERVER_MODE != 'asgi':
+    phase_ingestor = PhaseIngestor(connector_manager)
+    phase_ingestor.start()
+
+asgi_application = GitOpsPhaseAsgiApplication(connector_manager, async_ingestion=utils.getenv_bool('ASYNC_INGESTION'))
+
 git_repository_type = os.getenv('GIT_REPOSITORY_TYPE')
-if git_repository_type:
-    logging.debug('Detected ENV configuration data.  Running in single instance configuration mode.')
-    singleInstanceConfig = GitOpsConfig(
-        name='singleInstance',
-        git_repository_type=utils.getenv('GIT_REPOSITORY_TYPE'),
-        cicd_orchestrator_type=utils.getenv('CICD_ORCHESTRATOR_TYPE'),
-        gitops_operator_type=utils.getenv('GITOPS_OPERATOR_TYPE'),
-        gitops_app_url=utils.getenv('GITOPS_APP_URL'),
-        azdo_gitops_repo_name=os.getenv('AZDO_GITOPS_REPO_NAME'),
-        azdo_pr_repo_name=os.getenv('AZDO_PR_REPO_NAME'),
-        azdo_org_url=os.getenv('AZDO_ORG_URL'),
-        github_gitops_repo_name=os.getenv('GITHUB_GITOPS_REPO_NAME'),
-        github_gitops_manifests_repo_name=os.getenv('GITHUB_GITOPS_MANIFEST_REPO_NAME'),
-        github_org_url=os.getenv('GITHUB_ORG_URL')
-    )
-    connector_manager.add_or_update_configuration(singleInstanceConfig)
-else:
-    logging.debug('Detected no ENV configuration data.  Running in multiple instance configuration mode via gitopsconfig resources.')
-    try:
-        cluster_domain=utils.getenv('CLUSTER_DOMAIN')
-        logging.debug(f"cluster domain: '{cluster_domain}'")
-        config.load_incluster_config()  # In-cluster Kubernetes config
-        api_instance = client.CustomObjectsApi()
-        instances  = api_instance.list_cluster_custom_object(cluster_domain, "v1", "gitopsconfigs")
-        for instance in instances.get("items"):
-            config_name = instance.get("metadata").get("name")
-            config_namespace = instance.get("metadata").get("namespace")
-            config_spec = instance.get("spec")
-            gitops_config_operator.create(config_spec, config_name)
-            logging.debug(f"Processing config: '{config_name}' in Namespace: '{config_namespace}'")
-    except Exception as e:
-        logging.error(f'Failed to load gitopsconfigs: {e}')
 
+# With more than one gunicorn worker every process serves HTTP ingest, but
+# the singleton duties (loading configurations, the kopf watch, the commit
+# status queues and the abandoned PR polling of every connector) run only in
+# the process elected as leader. Followers forward notifications to it.
+MULTI_WORKER_MODE = SERVER_MODE == 'wsgi' and utils.getenv_int('WORKERS', 1) > 1
+
+
+def start_singleton_duties():
+    if git_repository_type:
+        logging.debug('Detected ENV configuration data.  Running in single instance configuration mode.')
+        singleInstanceConfig = GitOpsConfig(
+            name='singleInstance',
+            git_repository_type=utils.getenv('GIT_REPOSITORY_TYPE'),
+            cicd_orchestrator_type=utils.getenv('CICD_ORCHESTRATOR_TYPE'),
+            gitops_operator_type=utils.getenv('GITOPS_OPERATOR_TYPE'),
+            gitops_app_url=utils.getenv('GITOPS_APP_URL'),
+            azdo_gitops_repo_name=os.getenv('AZDO_GITOPS_REPO_NAME'),
+            azdo_pr_repo_name=os.getenv('AZDO_PR_REPO_NAME'),
+            azdo_org_url=os.getenv('AZDO_ORG_URL'),
+            github_gitops_repo_name=os.getenv('GITHUB_GITOPS_REPO_NAME'),
+            github_gitops_manifests_repo_name=os.getenv('GITHUB_GITOPS_MANIFEST_REPO_NAME'),
+            github_org_url=os.getenv('GITHUB_ORG_URL'),
+            status_dispatch_workers=utils.getenv_int('STATUS_DISPATCH_WORKERS', 1)
+        )
+        connector_manager.add_or_update_configuration(singleInstanceConfig)
+    else:
+        logging.debug('Detected no ENV configuration data.  Running in multiple instance configuration mode via gitopsconfig resources.')
+        try:
+            cluster_domain=utils.getenv('CLUSTER_DOMAIN')
+            logging.debug(f"cluster domain: '{cluster_domain}'")
+            config.load_incluster_config()  # In-cluster Kubernetes config
+            api_instance = client.CustomObjectsApi()
+            instances  = api_instance.list_cluster_custom_object(cluster_domain, "v1", "gitopsconfigs")
+            for instance in instances.get("items"):
+                config_name = instance.get("metadata").get("name")
+                config_namespace = instance.get("metadata").get("namespace")
+                config_spec = instance.get("spec")
+                gitops_config_operator.create(config_spec, config_name)
+                logging.debug(f"Processing config: '{config_name}' in Namespace: '{config_namespace}'")
+        except Exception as e:
+            logging.error(f'Failed to load gitopsconfigs: {e}')
+
+        kopf_thread = Thread(target=run_kopf_operator)
+        kopf_thread.start()
+
+
+if not git_repository_type:
     @kopf.on.create('gitopsconfigs')
     def on_create(spec, name, **kwargs):
         gitops_config_operator.create(spec, name)
@@ -73,9 +111,26 @@ else:
         logging.info("Starting Kopf operator thread")
         gitops_config_operator.run()  # Start the operator
 
-    kopf_thread = Thread(target=run_kopf_operator)
-    kopf_thread.start()
 
+leader_elector = None
+leader_relay_client = None
+leader_relay_server = None
+if MULTI_WORKER_MODE:
+    def on_elected_leader():
+        global leader_relay_server
+        start_singleton_duties()
+        leader_relay_server = LeaderRelayServer(lambda payload, req_time: _ingest_phase(payload, req_time))
+        leader_relay_server.start()
+
+    leader_relay_client = LeaderRelayClient()
+    leader_elector = LeaderElector()
+    leader_elector.start(on_elected=on_elected_leader)
+else:
+    start_singleton_duties()
+
+
+def _is_follower():
+    return leader_elector is not None and not leader_elector.is_leader()
 
 
 @application.route("/gitopsphase", methods=['POST'])
@@ -83,8 +138,8 @@ def gitopsphase():
     # Use per process timer to stash the time we got the request
     req_time = time.monotonic_ns()
 
-    raw_data = request.data.decode('utf-8')  # Decode byte data to string
-    logging.debug(f'Raw request data: {raw_data}')
+    # Decoding the body is deferred until the record is actually emitted
+    debug_event(RAW_REQUEST_EVENT, 'Raw request data: %s', LazyCall(request.data.decode, 'utf-8'))
 
     # Ensure the request is JSON
     if not request.is_json:
@@ -96,7 +151,27 @@ def gitopsphase():
         logging.error(f'Failed to parse JSON. Error: {e}')
         return "Malformed JSON data", 400
 
-    logging.debug(f'GitOps phase: {payload}')
+    if _is_follower():
+        error = leader_relay_client.forward(payload, req_time)
+        if error is None:
+            return "Accepted", 202
+        if get_retry_response(error) is not None:
+            return _retry_later(error)
+        # The leader rejected the notification, the sender must not take it
+        # for accepted
+        return error, get_rejection_status(error)
+
+    # Push back on the sender while the status queue of the target connector
+    # is above its high watermark
+    if connector_manager.is_saturated(payload):
+        return _retry_later(STATUS_QUEUE_FULL)
+
+    if phase_ingestor is not None:
+        if not phase_ingestor.submit(payload, req_time):
+            return _retry_later(INGEST_QUEUE_FULL)
+        return "Accepted", 202
+
+    logging.debug('GitOps phase: %s', payload)
 
     gitops_connector = connector_manager.get_supported_gitops_connector(payload)
     if gitops_connector != None:
@@ -105,7 +180,81 @@ def gitopsphase():
     return f'GitOps phase: {payload}', 200
 
 
+def _retry_later(error):
+    status_code, retry_after = get_retry_response(error)
+    return f"{error}. Retry later.", status_code, {'Retry-After': str(retry_after)}
+
+
+# Accepts many phase payloads in one request, either as a JSON array or as
+# newline-delimited JSON, and reports an accept/reject result per item.
+@application.route("/gitopsphase/batch", methods=['POST'])
+def gitopsphase_batch():
+    req_time = time.monotonic_ns()
+
+    try:
+        entries = parse_phase_batch(request.get_data(as_text=True))
+    except ValueError as e:
+        logging.error(f'Failed to parse batch. Error: {e}')
+        return "Malformed JSON data", 400
+
+    results = []
+    accepted = 0
+    errors = []
+    for index, (payload, error) in enumerate(entries):
+        if payload is not None:
+            # Preserve the order of items within the batch for the status queue.
+            error = _ingest_phase(payload, req_time + index)
+        if error is None:
+            accepted += 1
+            results.append({'index': index, 'status': 'accepted'})
+        else:
+            errors.append(error)
+            results.append({'index': index, 'status': 'rejected', 'reason': error})
+
+    response = jsonify(accepted=accepted, rejected=len(results) - accepted, results=results)
+    retry_after = get_batch_retry_after(errors)
+    if retry_after is not None:
+        response.headers['Retry-After'] = str(retry_after)
+    return response, 200
+
+
+# Routes a single payload from a batch. Returns None if it was accepted,
+# otherwise the reason it was rejected.
+def _ingest_phase(payload, req_time):
+    if _is_follower():
+        return leader_relay_client.forward(payload, req_time)
+
+    if connector_manager.is_saturated(payload):
+        return STATUS_QUEUE_FULL
+
+    if phase_ingestor is not None:
+        if not phase_ingestor.submit(payload, req_time):
+            return INGEST_QUEUE_FULL
+        return None
+
+    try:
+        gitops_connector = connector_manager.get_supported_gitops_connector(payload)
+        if gitops_connector is None:
+            return NO_SUPPORTING_CONNECTOR
+        gitops_connector.process_gitops_phase(payload, req_time)
+    except Exception as e:
+        logging.error(f'Failed to process GitOps phase from batch: {e}')
+        return f'Failed to process message: {e}'
+    return None
+
+
+@application.route("/metrics", methods=['GET'])
+def get_metrics():
+    return metrics.render_prometheus(connector_manager.get_metrics()), 200, {'Content-Type': metrics.PROMETHEUS_CONTENT_TYPE}
+
+
 def interrupt():
+    if leader_relay_server is not None:
+        leader_relay_server.stop()
+    if leader_elector is not None:
+        leader_elector.stop()
+    if phase_ingestor is not None:
+        phase_ingestor.stop()
     connector_manager.stop_all()
 
 atexit.register(interrupt)
@@ -0,0 +1,200 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import asyncio
+import json
+import logging
+import time
+
+import metrics
+from clients.async_http_client import close_async_http_client
+from ingestion.backpressure import INGEST_QUEUE_FULL, NO_SUPPORTING_CONNECTOR, STATUS_QUEUE_FULL, get_retry_response, get_batch_retry_after
+from ingestion.phase_batch import parse_phase_batch
+from ingestion.phase_ingestor import INGEST_QUEUE_SIZE
+from structured_logging import LazyCall, debug_event, RAW_REQUEST_EVENT
+
+
+# ASGI counterpart of the Flask application in gitops_event_handler.py.
+# Ingest, the commit status drain loops and the upstream REST calls of the
+# git repositories and raw subscribers all run on the server's event loop.
+class GitOpsPhaseAsgiApplication:
+
+    def __init__(self, connector_manager, async_ingestion=False, max_pending=INGEST_QUEUE_SIZE):
+        self._connector_manager = connector_manager
+        self._async_ingestion = async_ingestion
+        self._max_pending = max_pending
+        # Strong references to notifications being processed in the background
+        self._pending = set()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._handle_http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self._connector_manager.attach_event_loop(asyncio.get_running_loop())
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self._pending:
+                    await asyncio.gather(*self._pending, return_exceptions=True)
+                await self._connector_manager.stop_all_async()
+                await close_async_http_client()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _handle_http(self, scope, receive, send):
+        # Use per process timer to stash the time we got the request
+        req_time = time.monotonic_ns()
+
+        path = scope['path']
+        if path == '/metrics' and scope['method'] == 'GET':
+            await self._respond(send, 200, metrics.render_prometheus(self._connector_manager.get_metrics()),
+                                content_type=metrics.PROMETHEUS_CONTENT_TYPE.encode())
+            return
+
+        if scope['method'] != 'POST':
+            await self._respond(send, 405, 'Method not allowed')
+            return
+
+        if path == '/gitopsphase':
+            body = await self._read_body(receive)
+            await self._gitopsphase(scope, body, req_time, send)
+        elif path == '/gitopsphase/batch':
+            body = await self._read_body(receive)
+            await self._gitopsphase_batch(body, req_time, send)
+        else:
+            await self._respond(send, 404, 'Not found')
+
+    async def _gitopsphase(self, scope, body, req_time, send):
+        debug_event(RAW_REQUEST_EVENT, 'Raw request data: %s', LazyCall(body.decode, 'utf-8'))
+
+        # Ensure the request is JSON
+        if not self._is_json(scope):
+            await self._respond(send, 400, 'Invalid content type. Expected application/json.')
+            return
+
+        try:
+            payload = json.loads(body)
+        except ValueError as e:
+            logging.error(f'Failed to parse JSON. Error: {e}')
+            await self._respond(send, 400, 'Malformed JSON data')
+            return
+
+        if self._connector_manager.is_saturated(payload):
+            await self._retry_later(send, STATUS_QUEUE_FULL)
+            return
+
+        if self._async_ingestion:
+            if self._submit(payload, req_time):
+                await self._respond(send, 202, 'Accepted')
+            else:
+                await self._retry_later(send, INGEST_QUEUE_FULL)
+            return
+
+        logging.debug('GitOps phase: %s', payload)
+
+        gitops_connector = self._connector_manager.get_supported_gitops_connector(payload)
+        if gitops_connector is not None:
+            await gitops_connector.process_gitops_phase_async(payload, req_time)
+
+        await self._respond(send, 200, f'GitOps phase: {payload}')
+
+    async def _gitopsphase_batch(self, body, req_time, send):
+        try:
+            entries = parse_phase_batch(body.decode('utf-8'))
+        except ValueError as e:
+            logging.error(f'Failed to parse batch. Error: {e}')
+            await self._respond(send, 400, 'Malformed JSON data')
+            return
+
+        results = []
+        accepted = 0
+        errors = []
+        for index, (payload, error) in enumerate(entries):
+            if payload is not None:
+                # Preserve the order of items within the batch for the status queue.
+                error = await self._ingest_phase(payload, req_time + index)
+            if error is None:
+                accepted += 1
+                results.append({'index': index, 'status': 'accepted'})
+            else:
+                errors.append(error)
+                results.append({'index': index, 'status': 'rejected', 'reason': error})
+
+        retry_after = get_batch_retry_after(errors)
+        headers = [(b'retry-after', str(retry_after).encode())] if retry_after is not None else []
+        response = json.dumps({'accepted': accepted, 'rejected': len(results) - accepted, 'results': results})
+        await self._respond(send, 200, response, headers, content_type=b'application/json')
+
+    # Routes a single payload from a batch. Returns None if it was accepted,
+    # otherwise the reason it was rejected.
+    async def _ingest_phase(self, payload, req_time):
+        if self._connector_manager.is_saturated(payload):
+            return STATUS_QUEUE_FULL
+
+        if self._async_ingestion:
+            if not self._submit(payload, req_time):
+                return INGEST_QUEUE_FULL
+            return None
+
+        try:
+            gitops_connector = self._connector_manager.get_supported_gitops_connector(payload)
+            if gitops_connector is None:
+                return NO_SUPPORTING_CONNECTOR
+            await gitops_connector.process_gitops_phase_async(payload, req_time)
+        except Exception as e:
+            logging.error(f'Failed to process GitOps phase from batch: {e}')
+            return f'Failed to process message: {e}'
+        return None
+
+    def _submit(self, payload, req_time) -> bool:
+        if len(self._pending) >= self._max_pending:
+            logging.warning('Ingest queue is full, rejecting GitOps phase notification')
+            return False
+        task = asyncio.ensure_future(self._process_in_background(payload, req_time))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+        return True
+
+    async def _process_in_background(self, payload, req_time):
+        try:
+            gitops_connector = self._connector_manager.get_supported_gitops_connector(payload)
+            if gitops_connector is not None:
+                await gitops_connector.process_gitops_phase_async(payload, req_time)
+        except Exception as e:
+            logging.error(f'Failed to process GitOps phase notification: {e}')
+
+    async def _retry_later(self, send, error):
+        status_code, retry_after = get_retry_response(error)
+        await self._respond(send, status_code, f'{error}. Retry later.', [(b'retry-after', str(retry_after).encode())])
+
+    @staticmethod
+    def _is_json(scope) -> bool:
+        for name, value in scope['headers']:
+            if name == b'content-type':
+                mimetype = value.split(b';', 1)[0].strip().lower()
+                return mimetype == b'application/json' or mimetype.endswith(b'+json')
+        return False
+
+    @staticmethod
+    async def _read_body(receive) -> bytes:
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            chunks.append(message.get('body', b''))
+            more_body = message.get('more_body', False)
+        return b''.join(chunks)
+
+    @staticmethod
+    async def _respond(send, status, text, headers=None, content_type=b'text/plain; charset=utf-8'):
+        body = text.encode('utf-8')
+        response_headers = [(b'content-type', content_type), (b'content-length', str(len(body)).encode())]
+        if headers:
+            response_headers.extend(headers)
+        await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+        await send({'type': 'http.response.body', 'body': body})
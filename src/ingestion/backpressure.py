@@ -0,0 +1,42 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import utils
+from ingestion.leader_relay import LEADER_UNAVAILABLE
+
+INGEST_QUEUE_FULL = 'Ingest queue is full'
+STATUS_QUEUE_FULL = 'Commit status queue is full'
+NO_SUPPORTING_CONNECTOR = 'No GitOps connector supports the message'
+# Seconds a sender is asked to wait when a commit status queue is saturated.
+BACKPRESSURE_RETRY_AFTER = utils.getenv_int('BACKPRESSURE_RETRY_AFTER', 5)
+
+# Rejections the sender should retry, with the HTTP status and Retry-After
+# seconds to answer them with. A saturated status queue needs the senders to
+# slow down (429), the others are short lived unavailability (503).
+RETRYABLE_INGEST_ERRORS = {
+    INGEST_QUEUE_FULL: (503, 1),
+    LEADER_UNAVAILABLE: (503, 1),
+    STATUS_QUEUE_FULL: (429, BACKPRESSURE_RETRY_AFTER),
+}
+
+
+def get_retry_response(error):
+    """Returns (status_code, retry_after) if the rejection is retryable, otherwise None."""
+    return RETRYABLE_INGEST_ERRORS.get(error)
+
+
+def get_rejection_status(error) -> int:
+    """Returns the HTTP status of a rejection that is not retryable."""
+    # A message no connector is configured for is the sender's problem, any
+    # other rejection is a failure to process it
+    return 400 if error == NO_SUPPORTING_CONNECTOR else 500
+
+
+def get_batch_retry_after(errors):
+    """Returns the Retry-After seconds for a batch response, None if no rejection is retryable."""
+    retry_after = None
+    for error in errors:
+        retry_response = get_retry_response(error)
+        if retry_response is not None:
+            retry_after = max(retry_after or 0, retry_response[1])
+    return retry_after
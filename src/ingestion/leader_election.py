@@ -0,0 +1,64 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import fcntl
+import logging
+import os
+import threading
+
+import utils
+
+# Lock file shared by all server worker processes in the pod.
+LEADER_LOCK_FILE = os.getenv('LEADER_LOCK_FILE', '/tmp/gitops-connector-leader.lock')
+# Time in seconds between attempts of a follower process to take over leadership.
+LEADER_POLL_INTERVAL = utils.getenv_int('LEADER_POLL_INTERVAL', 5)
+
+
+# Elects exactly one process of the pod as leader with an exclusive flock.
+# The kernel releases the lock when the leader process exits, so a follower
+# takes over within LEADER_POLL_INTERVAL seconds.
+class LeaderElector:
+
+    def __init__(self, lock_file=LEADER_LOCK_FILE, poll_interval=LEADER_POLL_INTERVAL):
+        self._lock_file = lock_file
+        self._poll_interval = poll_interval
+        self._lock_fd = None
+        self._stopped = threading.Event()
+        self._watch_thread = None
+
+    def is_leader(self) -> bool:
+        return self._lock_fd is not None
+
+    def start(self, on_elected):
+        """Try to become leader now, otherwise keep trying in the background.
+        on_elected is called once, in the process that wins the election."""
+        if self._try_acquire():
+            on_elected()
+            return
+
+        def watch():
+            while not self._stopped.wait(self._poll_interval):
+                if self._try_acquire():
+                    on_elected()
+                    return
+
+        self._watch_thread = threading.Thread(target=watch, name='leader-election', daemon=True)
+        self._watch_thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def _try_acquire(self) -> bool:
+        fd = os.open(self._lock_file, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+
+        self._lock_fd = fd
+        logging.info(f'Process {os.getpid()} elected as leader')
+        return True
@@ -0,0 +1,112 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+
+# Unix domain socket the leader process listens on for forwarded notifications.
+LEADER_SOCKET = os.getenv('LEADER_SOCKET', '/tmp/gitops-connector-leader.sock')
+# Timeout in seconds for a follower waiting on the leader.
+LEADER_RELAY_TIMEOUT = 10
+
+LEADER_UNAVAILABLE = 'Leader process is not available'
+
+# Wire protocol: one JSON document per line in each direction.
+# Request:  {"req_time": <monotonic ns>, "payload": {...}}
+# Response: {"error": null} or {"error": "<reason the payload was rejected>"}
+
+
+# Runs in the leader process and hands forwarded notifications to ingest_phase,
+# which returns None if the payload was accepted or the reason it was rejected.
+class LeaderRelayServer:
+
+    def __init__(self, ingest_phase, socket_path=LEADER_SOCKET):
+        self._socket_path = socket_path
+        self._server = None
+        self._thread = None
+
+        class RelayHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        message = json.loads(line)
+                        error = ingest_phase(message['payload'], message['req_time'])
+                    except Exception as e:
+                        logging.error(f'Failed to process relayed GitOps phase: {e}')
+                        error = f'Failed to process message: {e}'
+                    self.wfile.write(json.dumps({'error': error}).encode('utf-8') + b'\n')
+
+        self._handler_class = RelayHandler
+
+    def start(self):
+        # A previous leader that died leaves its socket file behind
+        if os.path.exists(self._socket_path):
+            os.unlink(self._socket_path)
+        self._server = socketserver.ThreadingUnixStreamServer(self._socket_path, self._handler_class)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='leader-relay', daemon=True)
+        self._thread.start()
+        logging.debug(f'Leader relay listening on {self._socket_path}')
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            if os.path.exists(self._socket_path):
+                os.unlink(self._socket_path)
+
+
+# Used by follower processes to forward notifications to the leader.
+# Keeps one connection per request thread.
+class LeaderRelayClient:
+
+    def __init__(self, socket_path=LEADER_SOCKET, timeout=LEADER_RELAY_TIMEOUT):
+        self._socket_path = socket_path
+        self._timeout = timeout
+        self._local = threading.local()
+
+    def forward(self, payload, req_time):
+        """Returns None if the leader accepted the payload, otherwise the reason it was not."""
+        message = json.dumps({'req_time': req_time, 'payload': payload}).encode('utf-8') + b'\n'
+        # Retry once on a fresh connection in case the leader changed
+        for attempt in range(2):
+            try:
+                stream = self._get_stream()
+                stream.write(message)
+                stream.flush()
+                response = stream.readline()
+                if not response:
+                    raise ConnectionError('Leader closed the connection')
+                return json.loads(response)['error']
+            except (OSError, ValueError) as e:
+                self._close_stream()
+                if attempt == 1:
+                    logging.error(f'Failed to forward GitOps phase to the leader: {e}')
+        return LEADER_UNAVAILABLE
+
+    def _get_stream(self):
+        stream = getattr(self._local, 'stream', None)
+        if stream is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self._timeout)
+            sock.connect(self._socket_path)
+            stream = sock.makefile('rwb')
+            self._local.sock = sock
+            self._local.stream = stream
+        return stream
+
+    def _close_stream(self):
+        stream = getattr(self._local, 'stream', None)
+        if stream is not None:
+            try:
+                stream.close()
+                self._local.sock.close()
+            except OSError:
+                pass
+        self._local.stream = None
+        self._local.sock = None
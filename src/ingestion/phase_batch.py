@@ -0,0 +1,39 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import json
+
+
+# Splits a batch request body into individual phase payloads.
+# The body is either a JSON array of payloads or newline-delimited JSON
+# (one payload per line). Returns a list of (payload, error) tuples in
+# request order, where exactly one of the two is set, so a malformed line
+# only rejects that item instead of the whole batch.
+def parse_phase_batch(body: str):
+    stripped = body.strip()
+    if not stripped:
+        return []
+
+    if stripped.startswith('['):
+        try:
+            items = json.loads(stripped)
+        except ValueError as e:
+            raise ValueError(f'Malformed JSON array: {e}')
+        return [_validate_payload(item) for item in items]
+
+    entries = []
+    for line in stripped.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            entries.append(_validate_payload(json.loads(line)))
+        except ValueError as e:
+            entries.append((None, f'Malformed JSON: {e}'))
+    return entries
+
+
+def _validate_payload(item):
+    if not isinstance(item, dict):
+        return None, 'Expected a JSON object'
+    return item, None
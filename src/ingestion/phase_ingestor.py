@@ -0,0 +1,75 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import logging
+import threading
+from queue import Queue, Full
+
+import utils
+
+# Number of background workers routing and processing accepted notifications.
+INGEST_WORKERS = utils.getenv_int('INGEST_WORKERS', 4)
+# Maximum number of accepted notifications waiting for a worker.
+INGEST_QUEUE_SIZE = utils.getenv_int('INGEST_QUEUE_SIZE', 1000)
+
+
+# Accepts GitOps phase notifications and processes them on a bounded pool of
+# background workers, so the HTTP handler never waits on upstream REST calls.
+# Instance is shared across threads.
+class PhaseIngestor:
+
+    def __init__(self, connector_manager, workers=INGEST_WORKERS, queue_size=INGEST_QUEUE_SIZE):
+        self._connector_manager = connector_manager
+        self._worker_count = workers
+        self._queue = Queue(maxsize=queue_size)
+        self._workers = []
+        self._running = False
+
+    def submit(self, payload, req_time) -> bool:
+        """Enqueue a parsed phase payload. Returns False if the ingest queue is full."""
+        try:
+            self._queue.put_nowait((req_time, payload))
+        except Full:
+            logging.warning('Ingest queue is full, rejecting GitOps phase notification')
+            return False
+        return True
+
+    def backlog(self) -> int:
+        return self._queue.qsize()
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        for i in range(self._worker_count):
+            worker = threading.Thread(target=self._process_queue, name=f'phase-ingestor-{i}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        logging.debug(f'Started {self._worker_count} phase ingest workers')
+
+    def stop(self):
+        if not self._running:
+            return
+        self._running = False
+        # One sentinel per worker, queued behind the pending notifications.
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+        logging.debug('Stopped phase ingest workers')
+
+    def _process_queue(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            req_time, payload = item
+            # Handling an exception as it crashes the worker thread
+            try:
+                gitops_connector = self._connector_manager.get_supported_gitops_connector(payload)
+                if gitops_connector is not None:
+                    gitops_connector.process_gitops_phase(payload, req_time)
+            except Exception as e:
+                logging.error(f'Failed to process GitOps phase notification: {e}')
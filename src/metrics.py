@@ -0,0 +1,34 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+METRIC_PREFIX = 'gitops_connector_'
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+# Renders {connector_name: {metric_name: value}} in the Prometheus text
+# exposition format. Metric names ending with _total are counters, all
+# others are gauges. Metrics of the subscribers have a value per subscriber,
+# {subscriber_endpoint: value}, rendered with a subscriber label.
+def render_prometheus(connector_metrics: dict) -> str:
+    samples = {}
+    for connector_name, metrics in connector_metrics.items():
+        labels = f'connector="{_escape(connector_name)}"'
+        for metric_name, value in metrics.items():
+            if isinstance(value, dict):
+                for subscriber, subscriber_value in value.items():
+                    samples.setdefault(metric_name, []).append(
+                        (f'{labels},subscriber="{_escape(subscriber)}"', subscriber_value))
+            else:
+                samples.setdefault(metric_name, []).append((labels, value))
+
+    lines = []
+    for metric_name in sorted(samples):
+        metric_type = 'counter' if metric_name.endswith('_total') else 'gauge'
+        lines.append(f'# TYPE {METRIC_PREFIX}{metric_name} {metric_type}')
+        for labels, value in samples[metric_name]:
+            lines.append(f'{METRIC_PREFIX}{metric_name}{{{labels}}} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def _escape(label_value) -> str:
+    return str(label_value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -2,7 +2,7 @@
 # Licensed under the MIT License.
 
 import logging
-import json
+from structured_logging import LazyJson, debug_event, PHASE_DATA_EVENT
 from operators.gitops_operator import GitopsOperatorInterface
 from operators.git_commit_status import GitCommitStatus
 from configuration.gitops_config import GitOpsConfig
@@ -13,7 +13,7 @@ class ArgoGitopsOperator(GitopsOperatorInterface):
         super().__init__(gitops_config)
 
     def extract_commit_statuses(self, phase_data):
-        logging.debug(f'extract_commit_statuses called.  phase_data: {json.dumps(phase_data, indent=2)}')
+        debug_event(PHASE_DATA_EVENT, 'extract_commit_statuses called.  phase_data: %s', LazyJson(phase_data))
         commit_statuses = []
 
         commit_id = self.get_commit_id(phase_data)
@@ -45,9 +45,9 @@ class ArgoGitopsOperator(GitopsOperatorInterface):
         return commit_statuses
 
     def is_finished(self, phase_data):
-        logging.debug(f'is_finished called.  phase_data: {json.dumps(phase_data, indent=2)}')
+        debug_event(PHASE_DATA_EVENT, 'is_finished called.  phase_data: %s', LazyJson(phase_data))
         phase_status, _, health_status = self._get_statuses(phase_data)
-        logging.debug(f'is_finished: phase_status: {phase_status}, health_status: {health_status}')
+        logging.debug('is_finished: phase_status: %s, health_status: %s', phase_status, health_status)
         
         is_finished = \
             phase_status != 'Inconclusive' \
@@ -56,7 +56,7 @@ class ArgoGitopsOperator(GitopsOperatorInterface):
 
         is_successful = phase_status == 'Succeeded' and health_status == 'Healthy'
 
-        logging.debug(f'is_finished: is_finished: {is_finished}, is_successful: {is_successful}')
+        logging.debug('is_finished: is_finished: %s, is_successful: %s', is_finished, is_successful)
         return is_finished, is_successful
 
     def get_commit_id(self, phase_data) -> str:
@@ -141,10 +141,10 @@ class FluxGitopsOperator(GitopsOperatorInterface):
 
     def is_supported_message(self, phase_data) -> bool:
         kind = self._get_message_kind(phase_data)
-        logging.debug(f'Kind: {kind}')
+        logging.debug('Kind: %s', kind)
 
         reason = phase_data['reason']
-        logging.debug(f'Reason: {reason}')
+        logging.debug('Reason: %s', reason)
 
         return self.is_supported_operator(phase_data) and (kind == 'Kustomization' or kind == 'GitRepository' and reason != 'NewArtifact')
 
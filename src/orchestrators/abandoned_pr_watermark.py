@@ -0,0 +1,100 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+import dateutil.parser
+
+# Directory of the abandoned PR sweep states, one file per PR repository.
+# Empty keeps the state in memory only, so a restarted connector sweeps the
+# whole task timeout window again.
+ABANDONED_PR_STATE_DIR = os.getenv('ABANDONED_PR_STATE_DIR', '')
+
+_watermarks = {}
+_watermarks_lock = threading.Lock()
+
+
+def get_abandoned_pr_watermark(repository_url) -> 'AbandonedPrWatermark':
+    """Returns the sweep state of a PR repository, shared by its connectors."""
+    path = None
+    if ABANDONED_PR_STATE_DIR:
+        name = hashlib.sha1(repository_url.encode('utf-8')).hexdigest()
+        path = os.path.join(ABANDONED_PR_STATE_DIR, f'{name}.json')
+    with _watermarks_lock:
+        watermark = _watermarks.get(repository_url)
+        if watermark is None:
+            watermark = AbandonedPrWatermark(path)
+            _watermarks[repository_url] = watermark
+        return watermark
+
+
+# Progress of the incremental abandoned PR sweep. Every abandoned PR closed
+# before the watermark has been settled, i.e. its callback task completed or
+# found to need nothing. PRs closed at or after it are settled if they are in
+# the settled set, keyed by PR id and closedDate so a PR that is reactivated
+# and abandoned again is swept again.
+# Instance is shared across threads.
+class AbandonedPrWatermark:
+
+    def __init__(self, path=None):
+        self._path = path
+        self._lock = threading.Lock()
+        self._watermark = None
+        # pr_num -> closedDate of the settled abandonment
+        self._settled = {}
+        self._load()
+
+    def get(self):
+        """Returns the closedDate watermark as a datetime, None before the first sweep."""
+        with self._lock:
+            return self._watermark
+
+    def is_settled(self, pr_num, closed_date) -> bool:
+        with self._lock:
+            return self._settled.get(str(pr_num)) == closed_date
+
+    def settle(self, pr_num, closed_date):
+        with self._lock:
+            self._settled[str(pr_num)] = closed_date
+
+    def advance(self, watermark):
+        """Moves the watermark forward to a completed sweep's oldest unsettled
+        closedDate, or its newest one if all were settled, and persists it."""
+        with self._lock:
+            if watermark is None or (self._watermark is not None and watermark <= self._watermark):
+                return
+            self._watermark = watermark
+            self._settled = {pr_num: closed_date for pr_num, closed_date in self._settled.items()
+                             if dateutil.parser.isoparse(closed_date) >= watermark}
+            self._save()
+
+    def _load(self):
+        if not self._path or not os.path.exists(self._path):
+            return
+        try:
+            with open(self._path, 'r') as state_fh:
+                state = json.load(state_fh)
+            self._watermark = dateutil.parser.isoparse(state['watermark'])
+            self._settled = state['settled']
+        except (OSError, ValueError, KeyError) as e:
+            logging.error(f'Failed to load abandoned PR sweep state {self._path}: {e}')
+            return
+        logging.info(f'Resuming abandoned PR sweep from closedDate {self._watermark.isoformat()}')
+
+    # Called with the lock held
+    def _save(self):
+        if not self._path:
+            return
+        state = {'watermark': self._watermark.isoformat(), 'settled': self._settled}
+        try:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            temp_path = self._path + '.tmp'
+            with open(temp_path, 'w') as state_fh:
+                json.dump(state, state_fh)
+            os.replace(temp_path, self._path)
+        except OSError as e:
+            logging.error(f'Failed to persist abandoned PR sweep state {self._path}: {e}')
@@ -2,10 +2,15 @@
 # Licensed under the MIT License.
 
 import logging
-import json
-import requests
-from datetime import datetime, timedelta
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
 import dateutil.parser
+import utils
+from caching.lru_cache import LruCache
+from orchestrators.abandoned_pr_watermark import get_abandoned_pr_watermark
+from structured_logging import LazyJson, debug_event, PR_DATA_EVENT
 from orchestrators.cicd_orchestrator import CicdOrchestratorInterface
 from repositories.git_repository import GitRepositoryInterface
 from clients.azdo_client import AzdoClient
@@ -15,6 +20,28 @@ from configuration.gitops_config import GitOpsConfig
 MAX_TASK_TIMEOUT = 72 * 60
 TASK_CUTOFF_DURATION = timedelta(minutes=MAX_TASK_TIMEOUT)
 
+# Plans and jobs whose state is remembered. Completed ones are remembered
+# until evicted, they never change state again.
+PLAN_STATE_CACHE_SIZE = utils.getenv_int('PLAN_STATE_CACHE_SIZE', 10000)
+# Build timelines whose record states are remembered.
+TIMELINE_CACHE_SIZE = utils.getenv_int('TIMELINE_CACHE_SIZE', 100)
+# Seconds a plan, job or timeline that has not completed is remembered.
+PLAN_STATE_PENDING_CACHE_TTL = utils.getenv_int('PLAN_STATE_PENDING_CACHE_TTL', 10)
+# Abandoned PRs fetched per request of the sweep.
+ABANDONED_PR_PAGE_SIZE = utils.getenv_int('ABANDONED_PR_PAGE_SIZE', 100)
+# Abandoned PRs settled concurrently by the sweep.
+ABANDONED_PR_SWEEP_WORKERS = utils.getenv_int('ABANDONED_PR_SWEEP_WORKERS', 8)
+# Seconds a sweep may run. PRs not settled by then are left to the next sweep.
+ABANDONED_PR_SWEEP_DEADLINE = utils.getenv_int('ABANDONED_PR_SWEEP_DEADLINE', 25)
+# Seconds before the start of a sweep that PRs must have been closed to be
+# swept, so PRs abandoned while it runs do not shift its pages. Also covers
+# the clock skew to Azure DevOps.
+ABANDONED_PR_SWEEP_SETTLE_TIME = utils.getenv_int('ABANDONED_PR_SWEEP_SETTLE_TIME', 60)
+
+
+class ListingChangedError(Exception):
+    """The abandoned PRs changed between two pages of a listing, PRs may have been skipped."""
+
 
 class AzdoCicdOrchestrator(CicdOrchestratorInterface):
 
@@ -22,6 +49,18 @@ class AzdoCicdOrchestrator(CicdOrchestratorInterface):
         super().__init__(git_repository)
         self.azdo_client = AzdoClient(gitops_config)
         self.headers = self.azdo_client.get_rest_api_headers()
+        # plan url -> (completed, timeline url); (timeline url, job id) -> completed
+        self._plan_states = LruCache(PLAN_STATE_CACHE_SIZE, float('inf'))
+        # timeline url -> {record id: state}
+        self._timelines = LruCache(TIMELINE_CACHE_SIZE, PLAN_STATE_PENDING_CACHE_TTL)
+        self._abandoned_pr_watermark = get_abandoned_pr_watermark(
+            f'{gitops_config.azdo_org_url}/{gitops_config.azdo_pr_repo_name}')
+        # Started with the first sweep
+        self._sweep_pool = None
+        # (pr_num, closedDate) -> future of a settlement still running when its
+        # sweep ended. The next sweep waits for it instead of starting another.
+        self._settlements = {}
+        self._settlements_lock = threading.Lock()
 
     def notify_on_deployment_completion(self, commit_id, is_successful):
         logging.debug(f'notify_on_deployment_completion called.  commit_id: {commit_id}, is_successful: {is_successful}')
@@ -32,9 +71,10 @@ class AzdoCicdOrchestrator(CicdOrchestratorInterface):
 
     # Update the Azure Pipeline task waiting for the PR to complete.
     # is_alive: If true, the PR is active and absence of task data is an error.
-    def _update_pr_task(self, is_successful, pr_num, is_alive=True):
+    # source_commit: lastMergeSourceCommit id of the PR, if known.
+    def _update_pr_task(self, is_successful, pr_num, is_alive=True, source_commit=None):
         logging.debug(f'_update_pr_task called. is_successful: {is_successful}, pr_num: {pr_num}')
-        pr_task = self._get_pr_task_data(pr_num, is_alive)
+        pr_task = self._get_pr_task_data(pr_num, is_alive, source_commit)
         if not pr_task:
             if is_alive:
                 logging.error(f'PR {pr_num} has no metadata! Cannot complete task callback.')
@@ -53,6 +93,7 @@ class AzdoCicdOrchestrator(CicdOrchestratorInterface):
         # Finish gracefully so ArgoCD doesn't keep calling us.
         if self._plan_already_completed(pr_task):
             logging.debug(f'_plan_already_completed for pr_task :{pr_task} if True so exit early')
+            self.git_repository.complete_pr_metadata(pr_num)
             return False
 
         planurl = pr_task['planurl']
@@ -65,18 +106,19 @@ class AzdoCicdOrchestrator(CicdOrchestratorInterface):
             'jobId': pr_task['jobid'],
             'result': state
         }
-        logging.debug(f'Update PR task request content: {url}, body: {json.dumps(data, indent=2)}')
-        response = requests.post(url=url, headers=self.headers, json=data)
+        logging.debug('Update PR task request content: %s, body: %s', url, LazyJson(data))
+        response = self.azdo_client.post(url, data)
         logging.debug(f'Update PR task response content: {response.content}')
         # Throw appropriate exception if request failed
         response.raise_for_status()
 
+        self.git_repository.complete_pr_metadata(pr_num)
         logging.info(f'PR {pr_num}: Successfully completed task {pr_task["taskid"]}')
         return True
 
-    def _get_pr_task_data(self, pr_num, is_alive=True):
+    def _get_pr_task_data(self, pr_num, is_alive=True, source_commit=None):
         logging.debug(f'_get_pr_task_data called.  pr_num: {pr_num}, is_alive: {is_alive}')
-        return self.git_repository.get_pr_metadata(pr_num)
+        return self.git_repository.get_pr_metadata(pr_num, source_commit)
     
     # Given a PR task, check if it's parent plan has already completed.
     # Note: Completed does not necessarily mean it succeeded.
@@ -86,61 +128,189 @@ class AzdoCicdOrchestrator(CicdOrchestratorInterface):
         planid = pr_task['planid']
         url = f'{planurl}{projectid}/_apis/distributedtask/hubs/build/plans/{planid}'
 
-        response = requests.get(url=url, headers=self.headers)
-        # Throw appropriate exception if request failed
-        response.raise_for_status()
+        plan_state = self._plan_states.get(url)
+        if plan_state is None:
+            response = self.azdo_client.get(url)
+            # Throw appropriate exception if request failed
+            response.raise_for_status()
+
+            plan_info = response.json()
+            state = plan_info['state']
+            logging.debug(f'Check if plan {planid} already completed: state = {state}')
+            urlBase = plan_info['owner']['_links']['self']['href']
+            plan_state = (state == 'completed', f'{urlBase}/timeline?api-version=7.1')
+            self._plan_states.put(url, plan_state, None if plan_state[0] else PLAN_STATE_PENDING_CACHE_TTL)
 
-        plan_info = response.json()
-        state = plan_info['state']
-        logging.debug(f'Check if plan {planid} already completed: state = {state}')
-        plan_state = plan_info['state'] == 'completed'
-        if plan_state:
+        plan_completed, timeline_url = plan_state
+        if plan_completed:
             return True
-        return self._build_job_already_completed(pr_task, plan_info)
+        return self._build_job_already_completed(pr_task, timeline_url)
 
-    def _find_record_by_id(self, records, target_id):
-        for record in records:
-            if record['id'] == target_id:
-                return record
-        return None
+    def _build_job_already_completed(self, pr_task, timeline_url):
+        job_id = pr_task['jobid']
+        job_key = (timeline_url, job_id)
+        if self._plan_states.get(job_key):
+            return True
 
-    def _build_job_already_completed(self, pr_task, plan_info):
-        urlBase = plan_info['owner']['_links']['self']['href']
-        url = f'{urlBase}/timeline?api-version=7.1'
+        record_states = self._timelines.get(timeline_url)
+        if record_states is None:
+            response = self.azdo_client.get(timeline_url)
+            # Throw appropriate exception if request failed
+            response.raise_for_status()
 
-        response = requests.get(url=url, headers=self.headers)
-        # Throw appropriate exception if request failed
-        response.raise_for_status()
+            # Only the states are kept, timelines can have thousands of records
+            records = response.json()['records']
+            record_states = {record['id']: record['state'] for record in records}
+            self._timelines.put(timeline_url, record_states)
 
-        timeline = response.json()
-        records = timeline['records']
-        job_id = pr_task['jobid']
-        job = self._find_record_by_id(records, job_id)
-        job_state = job['state']
+        job_state = record_states.get(job_id)
         logging.debug(f'Check if job {job_id} already completed: state = {job_state}')
         job_state_completed = job_state == 'completed'
+        if job_state_completed:
+            self._plan_states.put(job_key, True)
         return job_state_completed
+
+    def get_metrics(self) -> dict:
+        metrics = self._plan_states.get_metrics('plan_state')
+        metrics.update(self._timelines.get_metrics('timeline'))
+        return metrics
     
+    # Sweeps the PRs abandoned since the watermark and settles
+    # the ones not settled by an earlier sweep on the sweep's worker pool.
+    # The watermark only advances after a listing that covered every PR
+    # closed up to the sweep's end time, see _get_abandoned_prs.
+    # The sweep ends at its deadline: settlements not started by then are
+    # cancelled and the ones running are finished by the next sweep, so sweeps
+    # never settle the same PR twice at the same time.
     def notify_abandoned_pr_tasks(self):
         logging.debug('notify_abandoned_pr_tasks called')
-        update_count = 0
-        prs = self.git_repository.get_prs('abandoned')
+        deadline = time.monotonic() + ABANDONED_PR_SWEEP_DEADLINE
+        watermark = self._abandoned_pr_watermark
+        # PRs abandoned before the task timeout are not processed
+        now = datetime.now(timezone.utc)
+        min_closed_time = now - TASK_CUTOFF_DURATION
+        if watermark.get() is not None:
+            min_closed_time = max(min_closed_time, watermark.get())
+        max_closed_time = now - timedelta(seconds=ABANDONED_PR_SWEEP_SETTLE_TIME)
 
-        if prs:
-            for pr in prs:
-                if not self._should_update_abandoned_pr(pr):
-                    continue
+        # (pr_num, closedDate) -> future, None if settled by an earlier sweep
+        settlements = {}
+        is_listed = False
+        try:
+            for pr in self._get_abandoned_prs(min_closed_time, max_closed_time):
+                key = _get_pr_key(pr)
+                if key[1] and watermark.is_settled(*key):
+                    settlements[key] = None
+                else:
+                    settlements[key] = self._start_settlement(key, pr)
+                if time.monotonic() >= deadline:
+                    logging.warning('Abandoned PR sweep ran out of time while listing PRs')
+                    break
+            else:
+                is_listed = True
+        except ListingChangedError as e:
+            logging.warning(f'{e}, the abandoned PR watermark is kept until the next sweep')
+        finally:
+            running = [future for future in settlements.values() if future is not None]
+            wait(running, timeout=max(0, deadline - time.monotonic()))
 
-                pr_num = pr['pullRequestId']
-                if not self._update_abandoned_pr(pr_num, pr_data=pr):
+        update_count = 0
+        # Closed dates of the PRs not settled by this sweep, and of all PRs
+        unsettled_dates = []
+        closed_dates = []
+        for key, future in settlements.items():
+            closed_date = dateutil.parser.isoparse(key[1]) if key[1] else None
+            if closed_date is not None:
+                closed_dates.append(closed_date)
+            if future is not None:
+                if not future.done():
+                    # Cancelled if not started yet. Either way the next sweep
+                    # lists the PR again.
+                    future.cancel()
+                    if closed_date is not None:
+                        unsettled_dates.append(closed_date)
+                    continue
+                if future.exception() is not None:
+                    logging.error(f'Failed to settle abandoned PR {key[0]}: {future.exception()}')
+                    if closed_date is not None:
+                        unsettled_dates.append(closed_date)
+                    continue
+                if future.result():
                     update_count += 1
-                    logging.debug(f'Updated abandoned PR {pr_num}')
+                    logging.debug(f'Updated abandoned PR {key[0]}')
+                if key[1]:
+                    watermark.settle(*key)
+        # The watermark stays at the oldest unsettled PR, or moves to the
+        # newest one if all were settled. The listing order is not relied on.
+        if is_listed and closed_dates:
+            watermark.advance(min(unsettled_dates) if unsettled_dates else max(closed_dates))
+
+        # Only settlements still running are carried to the next sweep
+        with self._settlements_lock:
+            self._settlements = {key: future for key, future in self._settlements.items() if not future.done()}
 
         if update_count > 0:
             logging.info(f'Processed {update_count} abandoned PRs via query')
 
+    def _start_settlement(self, key, pr):
+        with self._settlements_lock:
+            future = self._settlements.get(key)
+            if future is None or future.cancelled():
+                if self._sweep_pool is None:
+                    self._sweep_pool = ThreadPoolExecutor(max_workers=max(1, ABANDONED_PR_SWEEP_WORKERS),
+                                                          thread_name_prefix='abandoned-pr-sweep')
+                future = self._sweep_pool.submit(self._settle_abandoned_pr, pr)
+                self._settlements[key] = future
+            return future
+
+    def stop(self):
+        with self._settlements_lock:
+            sweep_pool = self._sweep_pool
+            self._sweep_pool = None
+            self._settlements = {}
+        if sweep_pool is not None:
+            sweep_pool.shutdown(wait=False, cancel_futures=True)
+
+    # Returns True if the PR's callback task was completed.
+    def _settle_abandoned_pr(self, pr):
+        if not self._should_update_abandoned_pr(pr):
+            return False
+        return not self._update_abandoned_pr(pr['pullRequestId'], pr_data=pr)
+
+    # Yields the abandoned PRs closed between min_closed_time and
+    # max_closed_time. PRs outside the range the query returns anyway are
+    # skipped, wherever they are in the listing.
+    #
+    # Every page after the first starts with the last PR of the page before.
+    # If it does not, PRs were added or removed in between and may have moved
+    # past the page boundary unseen, so ListingChangedError is raised.
+    def _get_abandoned_prs(self, min_closed_time, max_closed_time):
+        skip = 0
+        last_key = None
+        while True:
+            if last_key is None:
+                prs = self.git_repository.get_prs('abandoned', min_closed_time, ABANDONED_PR_PAGE_SIZE, skip,
+                                                  max_closed_time) or []
+            else:
+                prs = self.git_repository.get_prs('abandoned', min_closed_time, ABANDONED_PR_PAGE_SIZE + 1, skip - 1,
+                                                  max_closed_time) or []
+                if not prs or _get_pr_key(prs[0]) != last_key:
+                    raise ListingChangedError('The abandoned PRs changed while they were listed')
+                prs = prs[1:]
+            for pr in prs:
+                closed_date = pr.get('closedDate')
+                if closed_date:
+                    closed_datetime = dateutil.parser.isoparse(closed_date)
+                    if closed_datetime < min_closed_time or closed_datetime > max_closed_time:
+                        continue
+                yield pr
+            if len(prs) < ABANDONED_PR_PAGE_SIZE:
+                return
+            skip += len(prs)
+            last_key = _get_pr_key(prs[-1])
+
     def _should_update_abandoned_pr(self, pr_data):
-        logging.debug(f'_should_update_abandoned_pr called. pr_data: {json.dumps(pr_data, indent=2)}')
+        debug_event(PR_DATA_EVENT, '_should_update_abandoned_pr called. pr_data: %s', LazyJson(pr_data))
         closed_date = pr_data.get('closedDate')
         if not closed_date:
             logging.debug('_should_update_abandoned_pr.  closed_date not provided so should update')
@@ -162,5 +332,10 @@ class AzdoCicdOrchestrator(CicdOrchestratorInterface):
         logging.debug(f'_update_abandoned_pr called. pr_num: {pr_num}, pr_status: {pr_status}')
         if (pr_status == 'abandoned'):
             # update_pr_task returns True if the task was updated.
-            return not self._update_pr_task(False, str(pr_num), is_alive=False)
+            source_commit = pr_data.get('lastMergeSourceCommit', {}).get('commitId')
+            return not self._update_pr_task(False, str(pr_num), is_alive=False, source_commit=source_commit)
         return True
+
+
+def _get_pr_key(pr):
+    return pr['pullRequestId'], pr.get('closedDate')
@@ -1,6 +1,7 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
+import asyncio
 from abc import ABC, abstractmethod
 from repositories.git_repository import GitRepositoryInterface
 
@@ -17,3 +18,15 @@ class CicdOrchestratorInterface(ABC):
     @abstractmethod
     def notify_abandoned_pr_tasks(self):
         pass
+
+    def get_metrics(self) -> dict:
+        return {}
+
+    # Stops the work started by notify_abandoned_pr_tasks that is still running.
+    def stop(self):
+        pass
+
+    # Non-blocking variant used in ASGI server mode. Orchestrators without a
+    # native implementation fall back to running the blocking call in a thread.
+    async def notify_on_deployment_completion_async(self, commit_id, is_successful):
+        await asyncio.to_thread(self.notify_on_deployment_completion, commit_id, is_successful)
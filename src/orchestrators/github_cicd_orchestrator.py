@@ -3,12 +3,13 @@
 
 import logging
 import utils
-import requests
 from orchestrators.cicd_orchestrator import CicdOrchestratorInterface
 from repositories.git_repository import GitRepositoryInterface
 from clients.github_client import GitHubClient
 from configuration.gitops_config import GitOpsConfig
 
+SOURCE_COMMIT_ID_RUN_ID_FIELD = 'source_commit_id_run_id'
+
 
 class GitHubCicdOrchestrator(CicdOrchestratorInterface):
 
@@ -24,23 +25,40 @@ class GitHubCicdOrchestrator(CicdOrchestratorInterface):
             source_commit_id, run_id, commit_message = self._get_source_commit_id_run_id_commit_mesage(commit_id)
             self._send_repo_dispatch_event(source_commit_id, run_id, commit_message)
 
+    async def notify_on_deployment_completion_async(self, commit_id, is_successful):
+        if is_successful:
+            source_commit_id, run_id, commit_message = await self.git_repository.get_parsed_commit_message_async(
+                commit_id, SOURCE_COMMIT_ID_RUN_ID_FIELD, self._parse_commit_message)
+            url, data = self._build_repo_dispatch_request(source_commit_id, run_id, commit_message)
+            response = await self.github_client.post_async(url, data)
+            # Throw appropriate exception if request failed
+            response.raise_for_status()
+
     def notify_abandoned_pr_tasks(self):
         pass
 
     def _get_source_commit_id_run_id_commit_mesage(self, manifest_commitid):
-        commitMessage = self.git_repository.get_commit_message(manifest_commitid)
+        return self.git_repository.get_parsed_commit_message(
+            manifest_commitid, SOURCE_COMMIT_ID_RUN_ID_FIELD, self._parse_commit_message)
+
+    def _parse_commit_message(self, commitMessage):
         commitMessageArray = commitMessage.split('/')
         runid = commitMessageArray[2]
         if len(commitMessageArray) > 3:
             commitid = commitMessageArray[3]
         logging.info(f'CommitId {commitid}')
-        return commitid, runid, commitMessage
+        # A list rather than a tuple, it is cached as JSON
+        return [commitid, runid, commitMessage]
 
     def _send_repo_dispatch_event(self, commmit_id, run_id, commit_message):
+        url, data = self._build_repo_dispatch_request(commmit_id, run_id, commit_message)
+        response = self.github_client.post(url, data)
+        # Throw appropriate exception if request failed
+        response.raise_for_status()
+
+    def _build_repo_dispatch_request(self, commmit_id, run_id, commit_message):
         url = f'{self.rest_api_url}/{self.gitops_repo_name}/dispatches'
         event_type = 'sync-success'
         data = {'event_type': event_type, 'client_payload': {'sha': commmit_id, 'runid': run_id, 'commitmessage': commit_message}}
         logging.info(f'Dispatch event: url {url}; data {data}')
-        response = requests.post(url=url, headers=self.headers, json=data)
-        # Throw appropriate exception if request failed
-        response.raise_for_status()
+        return url, data
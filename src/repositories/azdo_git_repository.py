@@ -4,13 +4,24 @@
 import os
 import logging
 import json
-import requests
+from urllib.parse import quote
 import utils
+from caching.commit_message_cache import get_commit_message_cache
+from caching.lru_cache import LruCache
 from clients.azdo_client import AzdoClient
+from structured_logging import LazyJson, debug_event, PR_DATA_EVENT, PR_METADATA_EVENT
 from repositories.git_repository import GitRepositoryInterface
 from configuration.gitops_config import GitOpsConfig
 
 PR_METADATA_KEY = "callback-task-id"
+PR_NUM_FIELD = "pr_num"
+
+# PRs whose callback task data is remembered.
+PR_METADATA_CACHE_SIZE = utils.getenv_int('PR_METADATA_CACHE_SIZE', 10000)
+# Seconds the callback task data of a PR is remembered.
+PR_METADATA_CACHE_TTL = utils.getenv_int('PR_METADATA_CACHE_TTL', 3600)
+# Seconds a PR without a pending callback task is remembered as such.
+PR_METADATA_NEGATIVE_CACHE_TTL = utils.getenv_int('PR_METADATA_NEGATIVE_CACHE_TTL', 600)
 
 
 class AzdoGitRepository(GitRepositoryInterface):
@@ -22,9 +33,30 @@ class AzdoGitRepository(GitRepositoryInterface):
         self.repository_api = f'{self.azdo_client.get_rest_api_url()}/_apis/git/repositories/{self.gitops_repo_name}'
         self.pr_repository_api = f'{self.azdo_client.get_rest_api_url()}/_apis/git/repositories/{self.pr_repo_name}'
         self.headers = self.azdo_client.get_rest_api_headers()
+        self.commit_messages = get_commit_message_cache(self.repository_api)
+        # pr_num -> (lastMergeSourceCommit id, task data or None)
+        self._pr_metadata = LruCache(PR_METADATA_CACHE_SIZE, PR_METADATA_CACHE_TTL)
 
     def post_commit_status(self, commit_status):
-        logging.debug(f'post_commit_status called.  commit_status: {commit_status}')
+        logging.debug('post_commit_status called.  commit_status: %s', commit_status)
+        url, data = self._build_commit_status_request(commit_status)
+        response = self.azdo_client.post(url, data)
+
+        # Throw appropriate exception if request failed
+        response.raise_for_status()
+
+    def prewarm_connections(self, connections=1):
+        self.azdo_client.prewarm(connections)
+
+    async def post_commit_status_async(self, commit_status):
+        logging.debug('post_commit_status_async called.  commit_status: %s', commit_status)
+        url, data = self._build_commit_status_request(commit_status)
+        response = await self.azdo_client.post_async(url, data)
+
+        # Throw appropriate exception if request failed
+        response.raise_for_status()
+
+    def _build_commit_status_request(self, commit_status):
         url = f'{self.repository_api}/commits/{commit_status.commit_id}/statuses?api-version=6.0'
 
         azdo_status = self._map_to_azdo_status(commit_status.state)
@@ -41,22 +73,52 @@ class AzdoGitRepository(GitRepositoryInterface):
                 'genre': commit_status.genre
             }
         }
-        response = requests.post(url=url, headers=self.headers, json=data)
-
-        # Throw appropriate exception if request failed
-        response.raise_for_status()
-
-    def get_pr_metadata(self, pr_num):
+        return url, data
+
+    # source_commit is the lastMergeSourceCommit id of the PR if known. Cached
+    # data of an older source commit is refetched, a new push may come with a
+    # new callback task. Without a source commit the cache cannot tell whether
+    # the data is current, so it is always fetched.
+    def get_pr_metadata(self, pr_num, source_commit=None):
+        pr_num = str(pr_num)
+        if source_commit is None:
+            return self._fetch_pr_metadata(pr_num)
+
+        entry = self._pr_metadata.get(pr_num)
+        if entry is not None and entry[0] == source_commit:
+            return entry[1]
+
+        pr_metadata = self._fetch_pr_metadata(pr_num)
+        if pr_metadata is None:
+            self._pr_metadata.put(pr_num, (source_commit, None), PR_METADATA_NEGATIVE_CACHE_TTL)
+        else:
+            self._pr_metadata.put(pr_num, (source_commit, pr_metadata))
+        return pr_metadata
+
+    def complete_pr_metadata(self, pr_num):
+        pr_num = str(pr_num)
+        entry = self._pr_metadata.get(pr_num)
+        if entry is None:
+            return
+        # Nothing is left to call back until the PR gets a new source commit
+        self._pr_metadata.put(pr_num, (entry[0], None), PR_METADATA_NEGATIVE_CACHE_TTL)
+
+    def get_metrics(self) -> dict:
+        metrics = super().get_metrics()
+        metrics.update(self._pr_metadata.get_metrics('pr_metadata'))
+        return metrics
+
+    def _fetch_pr_metadata(self, pr_num):
         # https://docs.microsoft.com/en-us/rest/api/azure/devops/git/pull%20request%20properties/list?view=azure-devops-rest-6.0
         url = f'{self.pr_repository_api}/pullRequests/{pr_num}/properties?api-version=6.0-preview'
 
-        response = requests.get(url=url, headers=self.headers)
+        response = self.azdo_client.get(url)
         # Throw appropriate exception if request failed
         response.raise_for_status()
 
         # Navigate the properties response structure
         result = response.json()
-        logging.debug(f'get_pr_metadata called. metadata: {json.dumps(result, indent=2)}')
+        debug_event(PR_METADATA_EVENT, 'get_pr_metadata called. metadata: %s', LazyJson(result))
         if (result['count'] > 0):
             properties = result['value']
             entry = properties.get(PR_METADATA_KEY)
@@ -67,14 +129,31 @@ class AzdoGitRepository(GitRepositoryInterface):
 
     # Returns an array of PR dictionaries with an optional status filter
     # pr_status values: https://docs.microsoft.com/en-us/rest/api/azure/devops/git/pull%20requests/get%20pull%20requests?view=azure-devops-rest-6.0#pullrequeststatus
-    def get_prs(self, pr_status):
-        pr_status_param = ''
+    # min_closed_time: only PRs closed since this datetime, newest closed first.
+    # max_closed_time: only PRs closed up to this datetime.
+    # top, skip: page of the results.
+    def get_prs(self, pr_status, min_closed_time=None, top=None, skip=None, max_closed_time=None):
+        params = []
         if pr_status:
-            pr_status_param = f'searchCriteria.status={pr_status}&'
-        url = f'{self.pr_repository_api}/pullRequests?{pr_status_param}api-version=6.0'
+            params.append(f'searchCriteria.status={pr_status}')
+        api_version = '6.0'
+        if min_closed_time is not None or max_closed_time is not None:
+            # The closed time range is available from api-version 7.1
+            params.append('searchCriteria.queryTimeRangeType=closed')
+            api_version = '7.1'
+        if min_closed_time is not None:
+            params.append(f'searchCriteria.minTime={quote(min_closed_time.isoformat())}')
+        if max_closed_time is not None:
+            params.append(f'searchCriteria.maxTime={quote(max_closed_time.isoformat())}')
+        if top is not None:
+            params.append(f'$top={top}')
+        if skip:
+            params.append(f'$skip={skip}')
+        params.append(f'api-version={api_version}')
+        url = f'{self.pr_repository_api}/pullRequests?{"&".join(params)}'
 
         logging.debug(f'get_prs: url: {url}')
-        response = requests.get(url=url, headers=self.headers)
+        response = self.azdo_client.get(url)
         # Throw appropriate exception if request failed
         response.raise_for_status()
 
@@ -83,7 +162,7 @@ class AzdoGitRepository(GitRepositoryInterface):
             return None
 
         val = pr_response['value']
-        logging.debug(f'get_prs: value: {val}')
+        debug_event(PR_DATA_EVENT, 'get_prs: value: %s', val)
         return val
 
     def _map_to_azdo_status(self, status):
@@ -117,19 +196,41 @@ class AzdoGitRepository(GitRepositoryInterface):
         return status_map[status]
 
     def get_commit_message(self, commit_id):
+        comment = self.commit_messages.get(commit_id)
+        if comment is not None:
+            return comment
+
         url = f'{self.repository_api}/commits/{commit_id}?api-version=6.0'
 
-        response = requests.get(url=url, headers=self.headers)
+        response = self.azdo_client.get(url)
         # Throw appropriate exception if request failed
         response.raise_for_status()
 
         commit = response.json()
         comment = commit['comment']
 
+        self.commit_messages.put(commit_id, comment)
+        return comment
+
+    async def get_commit_message_async(self, commit_id):
+        comment = self.commit_messages.get(commit_id)
+        if comment is not None:
+            return comment
+
+        url = f'{self.repository_api}/commits/{commit_id}?api-version=6.0'
+
+        response = await self.azdo_client.get_async(url)
+        # Throw appropriate exception if request failed
+        response.raise_for_status()
+
+        comment = response.json()['comment']
+        self.commit_messages.put(commit_id, comment)
         return comment
 
     def get_pr_num(self, commit_id) -> str:
-        comment = self.get_commit_message(commit_id)
+        return self.get_parsed_commit_message(commit_id, PR_NUM_FIELD, self._parse_pr_num)
+
+    def _parse_pr_num(self, comment) -> str:
         MERGED_PR = "Merged PR "
         pr_num = None
         if MERGED_PR in comment:
@@ -139,3 +240,6 @@ class AzdoGitRepository(GitRepositoryInterface):
 
     def is_commit_finished(self, commit_id):
         return False
+
+    async def is_commit_finished_async(self, commit_id):
+        return False
@@ -1,11 +1,16 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
+import asyncio
 from abc import ABC, abstractmethod
 
 
 class GitRepositoryInterface(ABC):
 
+    # Cache of commit messages and the values parsed from them, None to look
+    # them up every time.
+    commit_messages = None
+
     @abstractmethod
     def post_commit_status(self, commit_status):
         pass
@@ -15,17 +20,56 @@ class GitRepositoryInterface(ABC):
         pass
 
     @abstractmethod
-    def get_pr_metadata(self, commit_id):
+    def get_pr_metadata(self, commit_id, source_commit=None):
+        pass
+
+    # Forgets the task data of a PR whose callback task has been completed.
+    def complete_pr_metadata(self, pr_num):
         pass
 
     @abstractmethod
-    def get_prs(self, pr_status):
+    def get_prs(self, pr_status, min_closed_time=None, top=None, skip=None, max_closed_time=None):
         pass
 
     @abstractmethod
     def get_commit_message(self, commit_id):
         pass
 
+    # Returns None if the commit could not be checked right now, which is not
+    # remembered as a pending commit.
     @abstractmethod
     def is_commit_finished(self, commit_id):
         pass
+
+    def get_parsed_commit_message(self, commit_id, field, parser):
+        """Returns parser(commit message), computed once per commit if messages are cached."""
+        message = self.get_commit_message(commit_id)
+        if self.commit_messages is None:
+            return parser(message)
+        return self.commit_messages.parse(commit_id, field, message, parser)
+
+    def get_metrics(self) -> dict:
+        if self.commit_messages is None:
+            return {}
+        return self.commit_messages.get_metrics()
+
+    # Opens keep-alive connections to the upstream ahead of the first status.
+    def prewarm_connections(self, connections=1):
+        pass
+
+    # Non-blocking variants used in ASGI server mode. Repositories without a
+    # native implementation fall back to running the blocking call in a thread.
+    async def post_commit_status_async(self, commit_status):
+        await asyncio.to_thread(self.post_commit_status, commit_status)
+
+    async def is_commit_finished_async(self, commit_id):
+        return await asyncio.to_thread(self.is_commit_finished, commit_id)
+
+    async def get_commit_message_async(self, commit_id):
+        return await asyncio.to_thread(self.get_commit_message, commit_id)
+
+    async def get_parsed_commit_message_async(self, commit_id, field, parser):
+        message = await self.get_commit_message_async(commit_id)
+        if self.commit_messages is None:
+            return parser(message)
+        return self.commit_messages.parse(commit_id, field, message, parser)
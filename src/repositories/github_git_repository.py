@@ -1,10 +1,12 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
-import requests
 import utils
 import logging
+from caching.commit_message_cache import get_commit_message_cache
 from clients.github_client import GitHubClient
+from clients.github_graphql_batcher import CommitLookupBatcher, GITHUB_GRAPHQL_BATCHING
+from clients.github_rate_limiter import RateLimitedError
 from repositories.git_repository import GitRepositoryInterface
 from configuration.gitops_config import GitOpsConfig
 
@@ -17,8 +19,31 @@ class GitHubGitRepository(GitRepositoryInterface):
         self.github_client = GitHubClient(gitops_config)
         self.headers = self.github_client.get_rest_api_headers()
         self.rest_api_url = self.github_client.get_rest_api_url()
+        self.commit_messages = get_commit_message_cache(f'{self.rest_api_url}/{self.gitops_repo_name}')
+        # Commit states and messages are looked up in batches over GraphQL,
+        # REST is the fallback
+        self._commit_lookups = None
+        if GITHUB_GRAPHQL_BATCHING:
+            self._commit_lookups = CommitLookupBatcher(self.github_client, self.gitops_repo_name)
 
     def post_commit_status(self, commit_status):
+        url, data = self._build_commit_status_request(commit_status)
+        logging.info('Url %s: Data %s', url, data)
+        response = self.github_client.post(url, data)
+        # Throw appropriate exception if request failed
+        response.raise_for_status()
+
+    def prewarm_connections(self, connections=1):
+        self.github_client.prewarm(connections)
+
+    async def post_commit_status_async(self, commit_status):
+        url, data = self._build_commit_status_request(commit_status)
+        logging.info('Url %s: Data %s', url, data)
+        response = await self.github_client.post_async(url, data)
+        # Throw appropriate exception if request failed
+        response.raise_for_status()
+
+    def _build_commit_status_request(self, commit_status):
         url = f'{self.rest_api_url}/{self.gitops_repo_name}/statuses/{commit_status.commit_id}'
 
         github_state = self._map_to_github_state(commit_status.state)
@@ -27,22 +52,43 @@ class GitHubGitRepository(GitRepositoryInterface):
             message = message[:self.MAX_DESCR_LENGTH]
 
         data = {'state': github_state, 'description': message, 'context': commit_status.status_name}
-        logging.info(f'Url {url}: Headers {self.headers}: Data {data}')
-        response = requests.post(url=url, headers=self.headers, json=data)
-        # Throw appropriate exception if request failed
-        response.raise_for_status()
+        return url, data
 
     def is_commit_finished(self, commit_id):
         url = f'{self.rest_api_url}/{self.gitops_repo_name}/commits/{commit_id}/status'
 
-        response = requests.get(url=url, headers=self.headers)
+        # The lookup only saves posts to finished commits, it must not hold
+        # up ingest while the rate limit budget is kept for status posts
+        try:
+            commit = self._lookup_commit(commit_id)
+            if commit is not None:
+                return self._is_finished_state(commit_id, commit)
+            response = self.github_client.get(url, wait=False)
+        except RateLimitedError as e:
+            logging.warning(f'Skipping finished check of commit {commit_id}: {e}')
+            return None
         # Throw appropriate exception if request failed
         response.raise_for_status()
 
-        responseJSON = response.json()
+        return self._is_finished_state(commit_id, response.json())
+
+    async def is_commit_finished_async(self, commit_id):
+        url = f'{self.rest_api_url}/{self.gitops_repo_name}/commits/{commit_id}/status'
+
+        try:
+            commit = await self._lookup_commit_async(commit_id)
+            if commit is not None:
+                return self._is_finished_state(commit_id, commit)
+            response = await self.github_client.get_async(url, wait=False)
+        except RateLimitedError as e:
+            logging.warning(f'Skipping finished check of commit {commit_id}: {e}')
+            return None
+        # Throw appropriate exception if request failed
+        response.raise_for_status()
 
-        # logging.debug(f'Url {url}: Headers {self.headers}: Response {responseJSON}')
+        return self._is_finished_state(commit_id, response.json())
 
+    def _is_finished_state(self, commit_id, responseJSON):
         state = responseJSON['state']
 
         logging.info(f'Commit {commit_id}: {state}')
@@ -82,22 +128,94 @@ class GitHubGitRepository(GitRepositoryInterface):
         return state_map[reason]
 
     def get_commit_message(self, commit_id):
+        commitMessage = self.commit_messages.get(commit_id)
+        if commitMessage is not None:
+            return commitMessage
+
+        try:
+            commit = self._lookup_commit(commit_id)
+        except RateLimitedError:
+            # The REST call below waits for the budget
+            commit = None
+        if commit is not None:
+            return commit['message']
+
         url = f'{self.rest_api_url}/{self.gitops_repo_name}/commits/{commit_id}'
 
-        response = requests.get(url=url, headers=self.headers)
+        response = self.github_client.get(url)
         # Throw appropriate exception if request failed
         response.raise_for_status()
 
         responseJSON = response.json()
         commitMessage = responseJSON['commit']['message']
 
+        self.commit_messages.put(commit_id, commitMessage)
         return commitMessage
 
+    async def get_commit_message_async(self, commit_id):
+        commitMessage = self.commit_messages.get(commit_id)
+        if commitMessage is not None:
+            return commitMessage
+
+        try:
+            commit = await self._lookup_commit_async(commit_id)
+        except RateLimitedError:
+            commit = None
+        if commit is not None:
+            return commit['message']
+
+        url = f'{self.rest_api_url}/{self.gitops_repo_name}/commits/{commit_id}'
+
+        response = await self.github_client.get_async(url)
+        # Throw appropriate exception if request failed
+        response.raise_for_status()
+
+        commitMessage = response.json()['commit']['message']
+        self.commit_messages.put(commit_id, commitMessage)
+        return commitMessage
+
+    # Returns the message and combined status state of a commit looked up in a
+    # GraphQL batch, None to fall back to REST. Raises RateLimitedError if the
+    # GraphQL budget is spent.
+    def _lookup_commit(self, commit_id):
+        if self._commit_lookups is None:
+            return None
+        try:
+            commit = self._commit_lookups.lookup(commit_id)
+        except RateLimitedError:
+            raise
+        except Exception as e:
+            logging.warning(f'GraphQL lookup of commit {commit_id} failed, falling back to REST: {e}')
+            return None
+        if commit is not None:
+            self.commit_messages.put(commit_id, commit['message'])
+        return commit
+
+    async def _lookup_commit_async(self, commit_id):
+        if self._commit_lookups is None:
+            return None
+        try:
+            commit = await self._commit_lookups.lookup_async(commit_id)
+        except RateLimitedError:
+            raise
+        except Exception as e:
+            logging.warning(f'GraphQL lookup of commit {commit_id} failed, falling back to REST: {e}')
+            return None
+        if commit is not None:
+            self.commit_messages.put(commit_id, commit['message'])
+        return commit
+
+    def get_metrics(self) -> dict:
+        metrics = super().get_metrics()
+        if self._commit_lookups is not None:
+            metrics.update(self._commit_lookups.get_metrics())
+        return metrics
+
     def get_pr_num(self, commit_id) -> str:
         pass
 
-    def get_pr_metadata(self, commit_id):
+    def get_pr_metadata(self, commit_id, source_commit=None):
         pass
 
-    def get_prs(self, pr_status):
+    def get_prs(self, pr_status, min_closed_time=None, top=None, skip=None, max_closed_time=None):
         pass
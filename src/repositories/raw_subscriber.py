@@ -2,44 +2,127 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
-import dataclasses
+import gzip
 import json
 import logging
 import os
 import os.path
 from urllib.parse import urlparse
-import requests
+from clients.http_session import get_http_session, prewarm_http_session
+from structured_logging import debug_event, SUBSCRIBER_PAYLOAD_EVENT
 
 SUBSCRIBERS_DIR = '/subscribers'
 
+# Batch body formats
+JSON_ARRAY_FORMAT = 'json'
+NDJSON_FORMAT = 'ndjson'
+CONTENT_TYPES = {JSON_ARRAY_FORMAT: 'application/json', NDJSON_FORMAT: 'application/x-ndjson'}
+
+# Backpressure policies of a full subscriber queue
+# The oldest queued status is dropped to make room
+DROP_OLDEST = 'drop-oldest'
+# The status post waits for room, holding up the git repository posts
+BLOCK = 'block'
+
+
+def serialize_commit_status(commit_status) -> bytes:
+    """The JSON document of a status sent to the subscribers, serialized once for all of them."""
+    # The status is flat, vars avoids the deep copy of dataclasses.asdict
+    return json.dumps(vars(commit_status), separators=(',', ':')).encode('utf-8')
+
 
 # An endpoint that handles unprocessed JSON forwarded from notifications.
+# options are the key=value lines following the URL in the subscriber config,
+# e.g. backpressure=block.
+#
+# By default every status is posted as its own JSON document. A subscriber
+# with the batch_size option gets batches of up to that many statuses in one
+# gzip compressed POST, as a JSON array or, with batch_format=ndjson, as
+# newline delimited JSON.
+#
+# Options are validated here, once per subscriber config. An invalid option is
+# logged and its default used, it never rejects the other subscribers.
 class RawSubscriber:
-    def __init__(self, url_endpoint):
+    def __init__(self, url_endpoint, options=None):
         self._url_endpoint = url_endpoint
+        self.options = options or {}
+        self.batch_size = self._get_int_option('batch_size', 0)
+        self.batch_format = self.options.get('batch_format', JSON_ARRAY_FORMAT)
+        if self.batch_format not in CONTENT_TYPES:
+            logging.error(f'Unknown batch format {self.batch_format} of subscriber {self.url_endpoint}, '
+                          f'using {JSON_ARRAY_FORMAT}')
+            self.batch_format = JSON_ARRAY_FORMAT
+        # Delivery options, None uses the delivery's default
+        self.queue_size = self._get_int_option('queue_size', None)
+        self.batch_linger_ms = self._get_int_option('batch_linger_ms', None)
+        self.backpressure = self.options.get('backpressure')
+        if self.backpressure is not None and self.backpressure not in (DROP_OLDEST, BLOCK):
+            logging.error(f'Unknown backpressure policy {self.backpressure} of subscriber {self.url_endpoint}, '
+                          f'using {DROP_OLDEST}')
+            self.backpressure = DROP_OLDEST
+
+    @property
+    def url_endpoint(self):
+        return self._url_endpoint.strip()
+
+    @property
+    def is_batched(self) -> bool:
+        return self.batch_size > 1
+
+    def post_commit_status(self, commit_status, payload=None):
+        """Posts one status, as a batch of one to a batched subscriber."""
+        if payload is None:
+            payload = serialize_commit_status(commit_status)
+        if self.is_batched:
+            self.post_batch([payload])
+            return
+        debug_event(SUBSCRIBER_PAYLOAD_EVENT, 'Sending raw json to subscriber: %s', payload)
+        response = get_http_session(self.url_endpoint).post(
+            url=self.url_endpoint, data=payload, headers={'Content-Type': 'application/json'})
+        response.raise_for_status()
 
-    def post_commit_status(self, commit_status):
-        json_data = dataclasses.asdict(commit_status)
-        logging.debug("Sending raw json to subscriber: " + json.dumps(json_data, indent=2))
-        response = requests.post(url=self._url_endpoint, json=json_data)
+    def post_batch(self, payloads):
+        """Posts serialized statuses in one gzip compressed body."""
+        if self.batch_format == NDJSON_FORMAT:
+            body = b'\n'.join(payloads) + b'\n'
+        else:
+            body = b'[' + b','.join(payloads) + b']'
+        debug_event(SUBSCRIBER_PAYLOAD_EVENT, 'Sending raw json batch to subscriber: %s', body)
+        headers = {'Content-Type': CONTENT_TYPES[self.batch_format], 'Content-Encoding': 'gzip'}
+        response = get_http_session(self.url_endpoint).post(
+            url=self.url_endpoint, data=gzip.compress(body, compresslevel=5), headers=headers)
         response.raise_for_status()
 
+    def prewarm_connections(self, connections=1):
+        prewarm_http_session(self.url_endpoint, connections)
+
+    def _get_int_option(self, name, default):
+        value = self.options.get(name)
+        if value is None:
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            logging.error(f'Invalid {name} {value} of subscriber {self.url_endpoint}, '
+                          f'using {"the default" if default is None else default}')
+            return default
+
 
 class RawSubscriberFactory:
     @staticmethod
-    def new_raw_subscribers() -> list[RawSubscriber]:
+    def new_raw_subscribers(subscribers_dir=None) -> list[RawSubscriber]:
         logging.debug("Adding configured subscribers...")
-        subscribers = RawSubscriberFactory._read_subscribers()
+        subscribers = RawSubscriberFactory._read_subscribers(subscribers_dir or SUBSCRIBERS_DIR)
         logging.debug(f'{len(subscribers)} subscribers added.')
 
         return subscribers
 
     @staticmethod
-    def _read_subscribers():
+    def _read_subscribers(subscribers_dir):
         subscribers = []
 
         try:
-            subscriber_files = os.listdir(SUBSCRIBERS_DIR)
+            subscriber_files = os.listdir(subscribers_dir)
         except FileNotFoundError:
             logging.error("Subscriber config not found. Defaulting to no subscribers.")
             return subscribers
@@ -47,7 +130,7 @@ class RawSubscriberFactory:
             return subscribers
 
         for subscriber_file in subscriber_files:
-            subscriber_file = os.path.join(SUBSCRIBERS_DIR, subscriber_file)
+            subscriber_file = os.path.join(subscribers_dir, subscriber_file)
             if not os.path.isfile(subscriber_file):
                 continue
 
@@ -61,7 +144,7 @@ class RawSubscriberFactory:
                         logging.error(f"URL is invalid, subscriber has not been added: {url}")
                         continue
 
-                    subscriber = RawSubscriber(url)
+                    subscriber = RawSubscriber(url, RawSubscriberFactory._read_options(subscriber_fh))
 
                     subscribers.append(subscriber)
                     logging.info(f"Added subscriber {subscriber_file} with endpoint {url}")
@@ -70,3 +153,17 @@ class RawSubscriberFactory:
                 continue
 
         return subscribers
+
+    @staticmethod
+    def _read_options(subscriber_fh) -> dict:
+        options = {}
+        for line in subscriber_fh:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            key, separator, value = line.partition('=')
+            if not separator:
+                logging.error(f"Ignoring subscriber option without a value: {line}")
+                continue
+            options[key.strip()] = value.strip()
+        return options
@@ -0,0 +1,234 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import threading
+import time
+
+import utils
+import repositories.raw_subscriber as raw_subscriber
+from repositories.raw_subscriber import RawSubscriberFactory
+
+# Seconds between checks of the subscribers directory for changes. With
+# inotify the checks are also made as soon as the directory changes.
+SUBSCRIBERS_POLL_INTERVAL = utils.getenv_int('SUBSCRIBERS_POLL_INTERVAL', 10)
+# Watch the subscribers directory with inotify where the platform has it.
+SUBSCRIBERS_INOTIFY = utils.getenv_bool('SUBSCRIBERS_INOTIFY', True)
+# Seconds a change is given to complete before the directory is read, a
+# configmap update swaps several symlinks.
+SUBSCRIBERS_RELOAD_DELAY = 0.1
+
+# inotify event masks, see inotify(7)
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_IGNORED = 0x8000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+              IN_DELETE_SELF | IN_MOVE_SELF)
+EVENT_HEADER = struct.Struct('iIII')
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_subscriber_registry() -> 'SubscriberRegistry':
+    """Returns the subscribers of the process, read once and shared by all connectors."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = SubscriberRegistry(raw_subscriber.SUBSCRIBERS_DIR)
+        return _registry
+
+
+# The raw subscribers configured in the subscribers directory, reloaded when
+# the directory changes. A reload swaps the whole subscriber set and then calls
+# the listeners with it. Subscribers whose endpoint and options did not change
+# keep their RawSubscriber instance, so listeners can tell what changed by
+# identity.
+#
+# The directory is watched on a thread started with the first listener, with
+# inotify if available and by comparing the files' modification times every
+# SUBSCRIBERS_POLL_INTERVAL seconds otherwise.
+# Instance is shared across threads.
+class SubscriberRegistry:
+
+    def __init__(self, subscribers_dir, poll_interval=SUBSCRIBERS_POLL_INTERVAL, use_inotify=SUBSCRIBERS_INOTIFY):
+        self._subscribers_dir = subscribers_dir
+        self._poll_interval = poll_interval
+        self._use_inotify = use_inotify
+
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._signature = self._get_signature()
+        self._subscribers = tuple(RawSubscriberFactory.new_raw_subscribers(subscribers_dir))
+        self._stopped = threading.Event()
+        self._thread = None
+        self._inotify = None
+
+        self.reload_count = 0
+
+    def get_subscribers(self) -> tuple:
+        return self._subscribers
+
+    def add_listener(self, listener):
+        """Calls listener(subscribers) after every change of the subscribers."""
+        with self._lock:
+            if listener not in self._listeners:
+                self._listeners.append(listener)
+            if self._thread is None:
+                self._inotify = _Inotify.open() if self._use_inotify else None
+                self._thread = threading.Thread(target=self._run, name='subscriber-registry', daemon=True)
+                self._thread.start()
+
+    def remove_listener(self, listener):
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def stop(self):
+        self._stopped.set()
+        inotify = self._inotify
+        if inotify is not None:
+            inotify.interrupt()
+        if self._thread is not None:
+            self._thread.join()
+
+    def reload(self) -> bool:
+        """Reads the subscribers directory if it changed, True if the subscribers did."""
+        signature = self._get_signature()
+        if signature == self._signature:
+            return False
+        self._signature = signature
+
+        current = {subscriber.url_endpoint: subscriber for subscriber in self._subscribers}
+        subscribers = []
+        for subscriber in RawSubscriberFactory.new_raw_subscribers(self._subscribers_dir):
+            unchanged = current.get(subscriber.url_endpoint)
+            if unchanged is not None and unchanged.options == subscriber.options:
+                subscriber = unchanged
+            subscribers.append(subscriber)
+        if [id(subscriber) for subscriber in subscribers] == [id(subscriber) for subscriber in self._subscribers]:
+            return False
+
+        with self._lock:
+            self._subscribers = tuple(subscribers)
+            self.reload_count += 1
+            listeners = list(self._listeners)
+        logging.info(f'Reloaded {len(subscribers)} subscribers from {self._subscribers_dir}')
+        for listener in listeners:
+            try:
+                listener(self._subscribers)
+            except Exception as e:
+                logging.error(f'Failed to apply the reloaded subscribers: {e}')
+        return True
+
+    def get_metrics(self) -> dict:
+        return {
+            'subscriber_registry_subscribers': len(self._subscribers),
+            'subscriber_registry_reloads_total': self.reload_count,
+        }
+
+    def _run(self):
+        inotify = self._inotify
+        if inotify is None:
+            logging.info(f'Polling {self._subscribers_dir} for subscriber changes every {self._poll_interval} seconds')
+        while not self._stopped.is_set():
+            if inotify is not None and inotify.watch(self._subscribers_dir):
+                if inotify.wait(self._poll_interval):
+                    time.sleep(SUBSCRIBERS_RELOAD_DELAY)
+                    inotify.drain()
+            else:
+                self._stopped.wait(self._poll_interval)
+            if self._stopped.is_set():
+                break
+            try:
+                self.reload()
+            except Exception as e:
+                logging.error(f'Failed to reload the subscribers: {e}')
+        if inotify is not None:
+            inotify.close()
+
+    # Names, modification times and sizes of the directory's entries. Entries
+    # are followed through symlinks, as configmap mounts link every file
+    # through the ..data directory swapped on updates.
+    def _get_signature(self):
+        try:
+            names = sorted(os.listdir(self._subscribers_dir))
+        except OSError:
+            return None
+        signature = []
+        for name in names:
+            try:
+                stat = os.stat(os.path.join(self._subscribers_dir, name))
+            except OSError:
+                continue
+            signature.append((name, stat.st_mtime_ns, stat.st_size))
+        return signature
+
+
+# Minimal inotify binding watching a single directory.
+class _Inotify:
+
+    def __init__(self, libc, fd):
+        self._libc = libc
+        self._fd = fd
+        self._watch = None
+        # Wakes up a wait when the registry stops
+        self._interrupt_fd, self._interrupt_write_fd = os.pipe()
+
+    @staticmethod
+    def open():
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            logging.warning(f'inotify is not available: {os.strerror(ctypes.get_errno())}')
+            return None
+        return _Inotify(libc, fd)
+
+    def watch(self, path) -> bool:
+        """Watches path unless it already is, False if it cannot be watched (yet)."""
+        if self._watch is None:
+            watch = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+            if watch >= 0:
+                self._watch = watch
+        return self._watch is not None
+
+    def wait(self, timeout) -> bool:
+        """Waits up to timeout seconds for events, True if there are any."""
+        readable, _, _ = select.select([self._fd, self._interrupt_fd], [], [], timeout)
+        return self._fd in readable
+
+    def interrupt(self):
+        os.write(self._interrupt_write_fd, b'\0')
+
+    def drain(self):
+        while True:
+            try:
+                events = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset < len(events):
+                _, mask, _, name_length = EVENT_HEADER.unpack_from(events, offset)
+                offset += EVENT_HEADER.size + name_length
+                # The directory is gone, it is watched again once it is back
+                if mask & IN_IGNORED:
+                    self._watch = None
+
+    def close(self):
+        for fd in (self._fd, self._interrupt_fd, self._interrupt_write_fd):
+            os.close(fd)
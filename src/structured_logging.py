@@ -0,0 +1,116 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import json
+import logging
+import os
+import random
+
+# Root log level, e.g. DEBUG, INFO, WARNING.
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+# 'text' for the classic logging output, 'json' for one JSON document per line.
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+# Comma separated per event type sampling rates between 0 and 1,
+# e.g. "phase_data=0.01,pr_data=0". Event types not listed are always logged.
+LOG_SAMPLE_RATES = os.getenv('LOG_SAMPLE_RATES', '')
+
+# Event types used for the payload dumps on the hot path.
+RAW_REQUEST_EVENT = 'raw_request'
+PHASE_DATA_EVENT = 'phase_data'
+PR_DATA_EVENT = 'pr_data'
+PR_METADATA_EVENT = 'pr_metadata'
+SUBSCRIBER_PAYLOAD_EVENT = 'subscriber_payload'
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        event = getattr(record, 'event', None)
+        if event:
+            entry['event'] = event
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+# Defers json.dumps until the log record is actually emitted.
+class LazyJson:
+
+    def __init__(self, data, indent=2):
+        self._data = data
+        self._indent = indent
+
+    def __str__(self):
+        return json.dumps(self._data, indent=self._indent)
+
+
+# Defers an arbitrary message builder until the log record is actually emitted.
+class LazyCall:
+
+    def __init__(self, func, *args):
+        self._func = func
+        self._args = args
+
+    def __str__(self):
+        return str(self._func(*self._args))
+
+
+class EventSampler:
+
+    def __init__(self, rates: dict):
+        self._rates = rates
+
+    def should_log(self, event_type) -> bool:
+        rate = self._rates.get(event_type)
+        if rate is None or rate >= 1:
+            return True
+        if rate <= 0:
+            return False
+        return random.random() < rate
+
+
+def parse_sample_rates(spec: str) -> dict:
+    rates = {}
+    for entry in spec.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        event_type, _, rate = entry.partition('=')
+        try:
+            rates[event_type.strip()] = float(rate)
+        except ValueError:
+            logging.error(f'Invalid log sample rate: {entry}')
+    return rates
+
+
+_sampler = EventSampler(parse_sample_rates(LOG_SAMPLE_RATES))
+
+
+def configure_logging():
+    handler = logging.StreamHandler()
+    if LOG_FORMAT == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    logging.basicConfig(level=LOG_LEVEL.upper(), handlers=[handler])
+
+
+# Logs a message for the given event type. The level check and the sampling
+# decision both happen before any argument is formatted, so disabled or
+# sampled out events cost neither string building nor serialization.
+def log_event(event_type, level, msg, *args):
+    if not logging.root.isEnabledFor(level):
+        return
+    if not _sampler.should_log(event_type):
+        return
+    logging.log(level, msg, *args, extra={'event': event_type})
+
+
+def debug_event(event_type, msg, *args):
+    log_event(event_type, logging.DEBUG, msg, *args)
@@ -0,0 +1,146 @@
+import asyncio
+import json
+
+import pytest
+
+from ingestion.asgi_application import GitOpsPhaseAsgiApplication
+from ingestion.backpressure import STATUS_QUEUE_FULL
+
+
+def test_batch_reports_a_result_per_item(connector_manager):
+    application = GitOpsPhaseAsgiApplication(connector_manager)
+    connector_manager.saturated_ids = {2}
+
+    status, headers, body = _request(application, '/gitopsphase/batch', b'{"id": 1}\n{"id": 2}\nnot json\n[1]\n')
+
+    assert status == 200
+    results = json.loads(body)
+    assert results['accepted'] == 1
+    assert results['rejected'] == 3
+    assert [result['status'] for result in results['results']] == ['accepted', 'rejected', 'rejected', 'rejected']
+    assert results['results'][1]['reason'] == STATUS_QUEUE_FULL
+    assert results['results'][2]['reason'].startswith('Malformed JSON')
+    assert results['results'][3]['reason'] == 'Expected a JSON object'
+    # A saturated status queue asks the sender to retry the batch later
+    assert headers[b'retry-after'] == b'5'
+    assert connector_manager.connector.processed == [{'id': 1}]
+
+
+def test_phase_is_processed(connector_manager):
+    application = GitOpsPhaseAsgiApplication(connector_manager)
+
+    status, _, _ = _request(application, '/gitopsphase', b'{"id": 1}')
+
+    assert status == 200
+    assert connector_manager.connector.processed == [{'id': 1}]
+
+
+def test_async_ingestion_accepts_and_processes_in_background(connector_manager):
+    application = GitOpsPhaseAsgiApplication(connector_manager, async_ingestion=True)
+
+    status, _, _ = _request(application, '/gitopsphase', b'{"id": 1}')
+
+    assert status == 202
+    assert connector_manager.connector.processed == [{'id': 1}]
+
+
+def test_async_ingestion_rejects_when_full(connector_manager):
+    application = GitOpsPhaseAsgiApplication(connector_manager, async_ingestion=True, max_pending=0)
+
+    status, headers, _ = _request(application, '/gitopsphase', b'{"id": 1}')
+
+    assert status == 503
+    assert headers[b'retry-after'] == b'1'
+    assert connector_manager.connector.processed == []
+
+
+def test_saturated_status_queue_asks_to_slow_down(connector_manager):
+    application = GitOpsPhaseAsgiApplication(connector_manager)
+    connector_manager.saturated_ids = {1}
+
+    status, headers, _ = _request(application, '/gitopsphase', b'{"id": 1}')
+
+    assert status == 429
+    assert headers[b'retry-after'] == b'5'
+
+
+@pytest.mark.parametrize('body, content_type', [
+    (b'{"id": 1}', b'text/plain'),
+    (b'{"id": ', b'application/json'),
+])
+def test_invalid_request_is_rejected(connector_manager, body, content_type):
+    application = GitOpsPhaseAsgiApplication(connector_manager)
+
+    status, _, _ = _request(application, '/gitopsphase', body, content_type=content_type)
+
+    assert status == 400
+    assert connector_manager.connector.processed == []
+
+
+def test_metrics(connector_manager):
+    application = GitOpsPhaseAsgiApplication(connector_manager)
+
+    status, _, body = _request(application, '/metrics', b'', method='GET')
+
+    assert status == 200
+    assert 'gitops_connector_ingest_throttled_total{connector="singleInstance"} 1' in body
+
+
+@pytest.mark.parametrize('path, method, expected_status', [
+    ('/unknown', 'POST', 404),
+    ('/gitopsphase', 'GET', 405),
+])
+def test_unknown_routes(connector_manager, path, method, expected_status):
+    application = GitOpsPhaseAsgiApplication(connector_manager)
+
+    status, _, _ = _request(application, path, b'', method=method)
+
+    assert status == expected_status
+
+
+def _request(application, path, body, method='POST', content_type=b'application/json'):
+    scope = {'type': 'http', 'method': method, 'path': path, 'headers': [(b'content-type', content_type)]}
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    async def run():
+        await application(scope, receive, send)
+        # Lets notifications accepted for background processing finish
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    return sent[0]['status'], dict(sent[0]['headers']), sent[1]['body'].decode('utf-8')
+
+
+class FakeConnector:
+    def __init__(self):
+        self.processed = []
+
+    async def process_gitops_phase_async(self, payload, req_time):
+        self.processed.append(payload)
+
+
+class FakeConnectorManager:
+    def __init__(self):
+        self.connector = FakeConnector()
+        self.saturated_ids = set()
+
+    def is_saturated(self, payload):
+        return payload.get('id') in self.saturated_ids
+
+    def get_supported_gitops_connector(self, payload):
+        return self.connector
+
+    def get_metrics(self):
+        return {'singleInstance': {'ingest_throttled_total': 1}}
+
+
+@pytest.fixture
+def connector_manager():
+    return FakeConnectorManager()
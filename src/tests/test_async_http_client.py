@@ -0,0 +1,84 @@
+import asyncio
+
+import httpx
+import pytest
+
+import clients.async_http_client as async_http_client
+from clients.async_http_client import async_request, close_async_http_client, get_async_http_client
+
+
+def test_client_is_reused_until_closed():
+    async def run():
+        client = get_async_http_client()
+        assert get_async_http_client() is client
+        await close_async_http_client()
+        assert client.is_closed
+        reopened = get_async_http_client()
+        assert reopened is not client
+        await close_async_http_client()
+
+    asyncio.run(run())
+
+
+def test_calls_share_the_client(transport):
+    async def run():
+        for path in ('a', 'b', 'c'):
+            response = await async_request('GET', f'https://dev.azure.com/{path}')
+            assert response.status_code == 200
+        client = get_async_http_client()
+        await close_async_http_client()
+        return client
+
+    client = asyncio.run(run())
+    assert transport.clients == {id(client)}
+    assert transport.requests == 3
+
+
+def test_calls_in_flight_are_limited_per_host(transport, monkeypatch):
+    monkeypatch.setattr(async_http_client, 'ASYNC_HTTP_MAX_CONCURRENCY_PER_HOST', 2)
+
+    async def run():
+        urls = [f'https://dev.azure.com/{i}' for i in range(6)] + [f'https://api.github.com/{i}' for i in range(6)]
+        await asyncio.gather(*(async_request('GET', url) for url in urls))
+        await close_async_http_client()
+
+    asyncio.run(run())
+    assert transport.max_in_flight == {'dev.azure.com': 2, 'api.github.com': 2}
+    assert transport.requests == 12
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+
+    def __init__(self):
+        self.in_flight = {}
+        self.max_in_flight = {}
+        self.requests = 0
+        self.clients = set()
+
+    async def handle_async_request(self, request):
+        host = request.url.host
+        self.in_flight[host] = self.in_flight.get(host, 0) + 1
+        self.max_in_flight[host] = max(self.max_in_flight.get(host, 0), self.in_flight[host])
+        self.clients.add(id(async_http_client._async_client))
+        await asyncio.sleep(0.01)
+        self.in_flight[host] -= 1
+        self.requests += 1
+        return httpx.Response(200)
+
+
+@pytest.fixture(autouse=True)
+def client_state(monkeypatch):
+    monkeypatch.setattr(async_http_client, '_async_client', None)
+    monkeypatch.setattr(async_http_client, '_host_semaphores', {})
+
+
+@pytest.fixture
+def transport(monkeypatch):
+    transport = RecordingTransport()
+    client_class = httpx.AsyncClient
+
+    def new_client(**kwargs):
+        return client_class(transport=transport, **kwargs)
+
+    monkeypatch.setattr(async_http_client.httpx, 'AsyncClient', new_client)
+    return transport
@@ -0,0 +1,245 @@
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import requests
+
+from configuration.gitops_config import GitOpsConfig
+from orchestrators import azdo_cicd_orchestrator
+from orchestrators.abandoned_pr_watermark import AbandonedPrWatermark
+from orchestrators.azdo_cicd_orchestrator import AzdoCicdOrchestrator
+
+PR_TASK = {'taskid': 't1', 'jobid': 'j1', 'planid': 'p1', 'planurl': 'https://dev.azure.com/', 'projectid': 'proj'}
+TIMELINE_URL = 'https://dev.azure.com/build/1/timeline?api-version=7.1'
+
+
+def test_completed_plan_is_fetched_once(orchestrator, upstream):
+    upstream.plan_state = 'completed'
+
+    assert orchestrator._plan_already_completed(PR_TASK)
+    assert orchestrator._plan_already_completed(PR_TASK)
+    assert upstream.fetched_urls == [upstream.plan_url]
+
+
+def test_completed_job_is_remembered(orchestrator, upstream):
+    upstream.job_state = 'completed'
+
+    assert orchestrator._plan_already_completed(PR_TASK)
+    orchestrator._timelines.pop(TIMELINE_URL)
+    assert orchestrator._plan_already_completed(PR_TASK)
+    assert upstream.fetched_urls == [upstream.plan_url, TIMELINE_URL]
+
+
+def test_pending_job_is_fetched_again_after_ttl(orchestrator, upstream):
+    assert not orchestrator._plan_already_completed(PR_TASK)
+    assert not orchestrator._plan_already_completed(PR_TASK)
+    assert len(upstream.fetched_urls) == 2
+
+    orchestrator._plan_states.pop(upstream.plan_url)
+    orchestrator._timelines.pop(TIMELINE_URL)
+    upstream.job_state = 'completed'
+
+    assert orchestrator._plan_already_completed(PR_TASK)
+    assert len(upstream.fetched_urls) == 4
+
+
+def test_sweep_pages_and_skips_settled_prs(orchestrator, repository, settled_prs):
+    repository.abandon(1, minutes_ago=30)
+    repository.abandon(2, minutes_ago=20)
+    repository.abandon(3, minutes_ago=10)
+
+    orchestrator.notify_abandoned_pr_tasks()
+    assert settled_prs == [3, 2, 1]
+    # The second page overlaps the first by one PR
+    assert repository.skips == [0, 1]
+
+    repository.abandon(4, minutes_ago=5)
+    orchestrator.notify_abandoned_pr_tasks()
+    assert settled_prs == [3, 2, 1, 4]
+
+
+def test_failed_pr_holds_the_watermark(orchestrator, repository, settled_prs, monkeypatch):
+    repository.abandon(1, minutes_ago=30)
+    repository.abandon(2, minutes_ago=20)
+    repository.abandon(3, minutes_ago=10)
+    failing = {2}
+
+    def update_abandoned_pr(pr_num, pr_data):
+        if pr_num in failing:
+            raise requests.ConnectionError('unreachable')
+        settled_prs.append(pr_num)
+        return True
+
+    monkeypatch.setattr(orchestrator, '_update_abandoned_pr', update_abandoned_pr)
+    orchestrator.notify_abandoned_pr_tasks()
+    assert settled_prs == [3, 1]
+    assert orchestrator._abandoned_pr_watermark.get() == repository.closed_dates[2]
+
+    failing.clear()
+    orchestrator.notify_abandoned_pr_tasks()
+    assert settled_prs == [3, 1, 2]
+    assert orchestrator._abandoned_pr_watermark.get() == repository.closed_dates[3]
+
+
+def test_unordered_listing_holds_the_watermark_at_oldest_failure(orchestrator, repository, settled_prs, monkeypatch):
+    repository.abandon(1, minutes_ago=30)
+    repository.abandon(2, minutes_ago=20)
+    repository.abandon(3, minutes_ago=10)
+    repository.abandon(4, minutes_ago=5)
+    orchestrator._abandoned_pr_watermark.advance(repository.closed_dates[2])
+    # Oldest first, with a PR closed before the watermark listed first
+    repository.newest_first = False
+    repository.min_time_filter = False
+    failing = {2, 4}
+
+    def update_abandoned_pr(pr_num, pr_data):
+        if pr_num in failing:
+            raise requests.ConnectionError('unreachable')
+        settled_prs.append(pr_num)
+        return True
+
+    monkeypatch.setattr(orchestrator, '_update_abandoned_pr', update_abandoned_pr)
+    orchestrator.notify_abandoned_pr_tasks()
+    assert settled_prs == [3]
+    assert orchestrator._abandoned_pr_watermark.get() == repository.closed_dates[2]
+
+
+def test_listing_changed_between_pages_keeps_the_watermark(orchestrator, repository, settled_prs):
+    for pr_num, minutes_ago in ((1, 40), (2, 30), (3, 20), (4, 10)):
+        repository.abandon(pr_num, minutes_ago)
+
+    def reactivate_newest():
+        # Shifts PR 2 to the first page after it was read
+        repository.on_page = None
+        del repository.closed_dates[4]
+
+    repository.on_page = reactivate_newest
+    orchestrator.notify_abandoned_pr_tasks()
+    assert settled_prs == [4, 3]
+    assert orchestrator._abandoned_pr_watermark.get() is None
+
+    orchestrator.notify_abandoned_pr_tasks()
+    assert settled_prs == [4, 3, 2, 1]
+    assert orchestrator._abandoned_pr_watermark.get() == repository.closed_dates[3]
+
+
+def test_prs_closed_during_the_sweep_wait_for_the_next_one(orchestrator, repository, settled_prs):
+    repository.abandon(1, minutes_ago=10)
+    repository.closed_dates[2] = datetime.now(timezone.utc)
+
+    orchestrator.notify_abandoned_pr_tasks()
+
+    assert settled_prs == [1]
+    assert orchestrator._abandoned_pr_watermark.get() == repository.closed_dates[1]
+
+
+def test_sweep_deadline_carries_unfinished_prs(orchestrator, repository, settled_prs, monkeypatch):
+    repository.abandon(1, minutes_ago=20)
+    repository.abandon(2, minutes_ago=10)
+    release = threading.Event()
+    started = []
+
+    def update_abandoned_pr(pr_num, pr_data):
+        started.append(pr_num)
+        release.wait()
+        settled_prs.append(pr_num)
+        return True
+
+    monkeypatch.setattr(orchestrator, '_update_abandoned_pr', update_abandoned_pr)
+    monkeypatch.setattr(azdo_cicd_orchestrator, 'ABANDONED_PR_SWEEP_DEADLINE', 0.2)
+    orchestrator.notify_abandoned_pr_tasks()
+    assert started == [2]
+    assert orchestrator._abandoned_pr_watermark.get() == repository.closed_dates[1]
+
+    release.set()
+    monkeypatch.setattr(azdo_cicd_orchestrator, 'ABANDONED_PR_SWEEP_DEADLINE', 10)
+    orchestrator.notify_abandoned_pr_tasks()
+    assert sorted(started) == [1, 2]
+    assert sorted(settled_prs) == [1, 2]
+    assert orchestrator._abandoned_pr_watermark.get() == repository.closed_dates[2]
+
+
+def test_watermark_survives_restart(tmp_path):
+    path = str(tmp_path / 'state.json')
+    closed_date = datetime.now(timezone.utc).isoformat()
+    watermark = AbandonedPrWatermark(path)
+    watermark.settle(7, closed_date)
+    watermark.advance(datetime.fromisoformat(closed_date))
+
+    reloaded = AbandonedPrWatermark(path)
+
+    assert reloaded.get() == datetime.fromisoformat(closed_date)
+    assert reloaded.is_settled(7, closed_date)
+
+
+class FakeRepository:
+    def __init__(self):
+        self.closed_dates = {}
+        self.skips = []
+        self.newest_first = True
+        self.min_time_filter = True
+        self.on_page = None
+
+    def abandon(self, pr_num, minutes_ago):
+        self.closed_dates[pr_num] = datetime.now(timezone.utc) - timedelta(minutes=minutes_ago)
+
+    def get_prs(self, pr_status, min_closed_time=None, top=None, skip=None, max_closed_time=None):
+        if self.skips and self.on_page is not None:
+            self.on_page()
+        self.skips.append(skip)
+        prs = sorted(self.closed_dates.items(), key=lambda item: item[1], reverse=self.newest_first)
+        prs = [{'pullRequestId': pr_num, 'status': pr_status, 'closedDate': closed_date.isoformat()}
+               for pr_num, closed_date in prs
+               if not self.min_time_filter or min_closed_time <= closed_date <= max_closed_time]
+        return prs[skip:skip + top] or None
+
+
+class FakeUpstream:
+    plan_url = 'https://dev.azure.com/proj/_apis/distributedtask/hubs/build/plans/p1'
+
+    def __init__(self):
+        self.plan_state = 'inProgress'
+        self.job_state = 'inProgress'
+        self.fetched_urls = []
+
+    def get(self, url):
+        self.fetched_urls.append(url)
+        if url == self.plan_url:
+            body = {'state': self.plan_state, 'owner': {'_links': {'self': {'href': 'https://dev.azure.com/build/1'}}}}
+        else:
+            body = {'records': [{'id': 'other', 'state': 'completed'}, {'id': 'j1', 'state': self.job_state}]}
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps(body).encode('utf-8')
+        return response
+
+
+@pytest.fixture
+def upstream():
+    return FakeUpstream()
+
+
+@pytest.fixture
+def repository():
+    return FakeRepository()
+
+
+@pytest.fixture
+def settled_prs():
+    return []
+
+
+@pytest.fixture
+def orchestrator(monkeypatch, upstream, repository, settled_prs):
+    monkeypatch.setenv('PAT', 'pat')
+    monkeypatch.setattr(azdo_cicd_orchestrator, 'ABANDONED_PR_PAGE_SIZE', 2)
+    monkeypatch.setattr(azdo_cicd_orchestrator, 'ABANDONED_PR_SWEEP_WORKERS', 1)
+    monkeypatch.setattr(azdo_cicd_orchestrator, 'get_abandoned_pr_watermark', lambda url: AbandonedPrWatermark())
+    config = GitOpsConfig(name='test', git_repository_type='AZDO', cicd_orchestrator_type='AZDO',
+                          gitops_operator_type='ARGOCD', gitops_app_url='https://argocd',
+                          azdo_org_url='https://dev.azure.com/org/project')
+    orchestrator = AzdoCicdOrchestrator(repository, config)
+    monkeypatch.setattr(orchestrator.azdo_client, 'get', upstream.get)
+    monkeypatch.setattr(orchestrator, '_update_abandoned_pr', lambda pr_num, pr_data: settled_prs.append(pr_num))
+    return orchestrator
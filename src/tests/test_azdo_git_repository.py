@@ -0,0 +1,88 @@
+import json
+
+import pytest
+import requests
+
+from configuration.gitops_config import GitOpsConfig
+from repositories.azdo_git_repository import AzdoGitRepository, PR_METADATA_KEY
+
+PR_TASK = {'taskid': 't1', 'jobid': 'j1', 'planid': 'p1', 'planurl': 'https://dev.azure.com/', 'projectid': 'proj'}
+
+
+def test_pr_metadata_is_fetched_once(repository, fetched_urls):
+    assert repository.get_pr_metadata(1, 'c1') == PR_TASK
+    assert repository.get_pr_metadata('1', 'c1') == PR_TASK
+    assert len(fetched_urls) == 1
+
+
+def test_pr_metadata_without_source_commit_is_always_fetched(repository, fetched_urls):
+    repository.get_pr_metadata(1, 'c1')
+
+    assert repository.get_pr_metadata(1) == PR_TASK
+    assert len(fetched_urls) == 2
+
+
+def test_pr_without_callback_task_is_cached(repository, fetched_urls):
+    assert repository.get_pr_metadata(2, 'c1') is None
+    assert repository.get_pr_metadata(2, 'c1') is None
+    assert len(fetched_urls) == 1
+
+
+def test_new_source_commit_refetches_pr_metadata(repository, fetched_urls):
+    repository.get_pr_metadata(1, 'c1')
+    repository.get_pr_metadata(1, 'c2')
+
+    assert len(fetched_urls) == 2
+
+
+def test_completed_task_is_not_fetched_again(repository, fetched_urls):
+    repository.get_pr_metadata(1, 'c1')
+    repository.complete_pr_metadata(1)
+
+    assert repository.get_pr_metadata(1, 'c1') is None
+    assert len(fetched_urls) == 1
+
+
+def test_new_push_after_completion_gets_its_task(repository, fetched_urls, pr_tasks):
+    # Deployment completion, which does not know the PR's source commit
+    assert repository.get_pr_metadata(1) == PR_TASK
+    repository.complete_pr_metadata(1)
+
+    # A new push runs the pipeline again, with a new callback task
+    pr_tasks['1'] = dict(PR_TASK, taskid='t2')
+
+    assert repository.get_pr_metadata(1) == pr_tasks['1']
+
+
+@pytest.fixture
+def pr_tasks():
+    return {'1': PR_TASK}
+
+
+@pytest.fixture
+def fetched_urls():
+    return []
+
+
+@pytest.fixture
+def repository(monkeypatch, fetched_urls, pr_tasks):
+    monkeypatch.setenv('PAT', 'pat')
+    config = GitOpsConfig(name='test', git_repository_type='AZDO', cicd_orchestrator_type='AZDO',
+                          gitops_operator_type='ARGOCD', gitops_app_url='https://argocd',
+                          azdo_gitops_repo_name='manifests', azdo_pr_repo_name='manifests',
+                          azdo_org_url='https://dev.azure.com/org/project')
+    repository = AzdoGitRepository(config)
+
+    def get(url):
+        fetched_urls.append(url)
+        properties = {}
+        pr_num = url.split('/pullRequests/')[1].split('/')[0]
+        if pr_num in pr_tasks:
+            properties[PR_METADATA_KEY] = {'$value': json.dumps(pr_tasks[pr_num])}
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps({'count': len(properties), 'value': properties}).encode('utf-8')
+        return response
+
+    monkeypatch.setattr(repository.azdo_client, 'get', get)
+    return repository
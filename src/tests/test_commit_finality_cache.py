@@ -0,0 +1,93 @@
+import asyncio
+import threading
+
+import pytest
+
+from caching.commit_finality_cache import CommitFinalityCache
+
+
+def test_finished_commit_is_not_looked_up_again(repository, cache):
+    repository.finished = True
+
+    assert cache.is_commit_finished('abc')
+    assert cache.is_commit_finished('abc')
+    assert repository.lookups == 1
+
+
+def test_pending_commit_uses_pending_ttl(repository):
+    cache = CommitFinalityCache(repository.lookup, repository.lookup_async, finished_ttl=60, pending_ttl=0)
+
+    assert not cache.is_commit_finished('abc')
+    assert not cache.is_commit_finished('abc')
+    assert repository.lookups == 2
+
+
+def test_skipped_lookup_is_not_remembered(repository, cache):
+    repository.finished = None
+
+    assert cache.is_commit_finished('abc') is None
+    repository.finished = True
+    assert cache.is_commit_finished('abc')
+    assert repository.lookups == 2
+
+
+def test_invalidate_forgets_commit(repository, cache):
+    cache.is_commit_finished('abc')
+    repository.finished = True
+    cache.invalidate('abc')
+
+    assert cache.is_commit_finished('abc')
+    assert repository.lookups == 2
+
+
+def test_concurrent_lookups_are_collapsed(repository, cache):
+    repository.release = threading.Event()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.is_commit_finished('abc'))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    while cache.collapsed_count < 4:
+        pass
+    repository.release.set()
+    for thread in threads:
+        thread.join()
+
+    assert results == [False] * 5
+    assert repository.lookups == 1
+
+
+def test_concurrent_async_lookups_are_collapsed(repository, cache):
+    async def lookup_all():
+        return await asyncio.gather(*(cache.is_commit_finished_async('abc') for _ in range(5)))
+
+    assert asyncio.run(lookup_all()) == [False] * 5
+    assert repository.lookups == 1
+    assert cache.get_metrics()['commit_finality_lookups_collapsed_total'] == 4
+
+
+class FakeRepository:
+    def __init__(self):
+        self.finished = False
+        self.lookups = 0
+        self.release = None
+
+    def lookup(self, commit_id):
+        self.lookups += 1
+        if self.release is not None:
+            self.release.wait()
+        return self.finished
+
+    async def lookup_async(self, commit_id):
+        self.lookups += 1
+        await asyncio.sleep(0.01)
+        return self.finished
+
+
+@pytest.fixture
+def repository():
+    return FakeRepository()
+
+
+@pytest.fixture
+def cache(repository):
+    return CommitFinalityCache(repository.lookup, repository.lookup_async, finished_ttl=60, pending_ttl=60)
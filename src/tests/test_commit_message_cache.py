@@ -0,0 +1,56 @@
+import pytest
+
+from caching.commit_message_cache import CommitMessageCache, ENTRY_OVERHEAD
+
+
+def test_parsed_values_are_computed_once(cache):
+    parsed = []
+
+    def parser(message):
+        parsed.append(message)
+        return message.split(' ')[1]
+
+    cache.put('abc', 'Merged 42')
+
+    assert cache.parse('abc', 'pr_num', cache.get('abc'), parser) == '42'
+    assert cache.parse('abc', 'pr_num', cache.get('abc'), parser) == '42'
+    assert parsed == ['Merged 42']
+
+
+def test_least_recently_used_commits_are_evicted_by_size():
+    cache = CommitMessageCache(max_bytes=2 * (ENTRY_OVERHEAD + 13))
+    cache.put('a', 'x' * 12)
+    cache.put('b', 'x' * 12)
+    cache.get('a')
+    cache.put('c', 'x' * 12)
+
+    assert cache.get('a') is not None
+    assert cache.get('b') is None
+    assert cache.get('c') is not None
+    assert cache.eviction_count == 1
+
+
+def test_cache_survives_restart(tmp_path):
+    path = str(tmp_path / 'messages.db')
+    cache = CommitMessageCache(max_bytes=1024 * 1024, path=path)
+    cache.put('abc', 'x/y/1/def')
+    cache.parse('abc', 'run_id', 'x/y/1/def', lambda message: message.split('/')[2])
+
+    reloaded = CommitMessageCache(max_bytes=1024 * 1024, path=path)
+
+    assert reloaded.get('abc') == 'x/y/1/def'
+    assert reloaded.parse('abc', 'run_id', 'x/y/1/def', None) == '1'
+
+
+def test_unusable_directory_keeps_cache_in_memory(tmp_path):
+    blocker = tmp_path / 'file'
+    blocker.write_text('')
+    cache = CommitMessageCache(max_bytes=1024, path=str(blocker / 'messages.db'))
+    cache.put('abc', 'message')
+
+    assert cache.get('abc') == 'message'
+
+
+@pytest.fixture
+def cache():
+    return CommitMessageCache(max_bytes=1024 * 1024)
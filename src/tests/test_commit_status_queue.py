@@ -0,0 +1,133 @@
+from queue import Empty
+
+import pytest
+
+from configuration.commit_status_queue import CoalescingCommitStatusQueue
+from operators.git_commit_status import GitCommitStatus
+
+
+def test_get_returns_statuses_in_request_time_order(queue):
+    queue.put(2, _status('abc', 'Health', 'Healthy'))
+    queue.put(1, _status('abc', 'Sync', 'Synced'))
+    queue.put(3, _status('def', 'Sync', 'Synced'))
+
+    assert [queue.get().req_time for _ in range(3)] == [1, 2, 3]
+
+
+def test_put_elides_pending_status_for_same_context(queue):
+    queue.put(1, _status('abc', 'Status', 'Progressing'))
+    queue.put(2, _status('abc', 'deployment.apps', 'NotApplicable'))
+    queue.put(3, _status('abc', 'Status', 'ReconciliationSucceeded'))
+
+    first = queue.get()
+    second = queue.get()
+
+    assert first.commit_status.status_name == 'deployment.apps'
+    assert second.commit_status.state == 'ReconciliationSucceeded'
+    assert second.req_time == 3
+    assert queue.qsize() == 0
+    assert queue.get_metrics()['commit_status_elided_total'] == 1
+
+
+def test_put_keeps_newer_pending_status(queue):
+    queue.put(5, _status('abc', 'Status', 'ReconciliationSucceeded'))
+    queue.put(4, _status('abc', 'Status', 'Progressing'))
+
+    assert queue.get().commit_status.state == 'ReconciliationSucceeded'
+    assert queue.get_metrics()['commit_status_elided_total'] == 1
+
+
+def test_statuses_of_different_commits_are_not_coalesced(queue):
+    queue.put(1, _status('abc', 'Status', 'Progressing'))
+    queue.put(2, _status('def', 'Status', 'Progressing'))
+
+    assert queue.qsize() == 2
+
+
+def test_get_nowait_raises_until_closed(queue):
+    with pytest.raises(Empty):
+        queue.get_nowait()
+
+    queue.put(1, _status('abc', 'Status', 'Progressing'))
+    queue.close()
+
+    assert queue.get_nowait().req_time == 1
+    assert queue.get_nowait() is None
+    assert queue.get() is None
+
+
+def test_full_queue_sheds_not_applicable_before_in_progress(bounded_queue):
+    bounded_queue.put(1, _status('abc', 'Status', 'Progressing'))
+    bounded_queue.put(2, _status('abc', 'deployment.apps', 'NotApplicable'))
+    bounded_queue.put(3, _status('def', 'Status', 'Progressing'))
+    bounded_queue.put(4, _status('ghi', 'Status', 'Progressing'))
+
+    metrics = bounded_queue.get_metrics()
+    assert metrics['commit_status_shed_not_applicable_total'] == 1
+    assert metrics['commit_status_shed_in_progress_total'] == 0
+    assert [bounded_queue.get().commit_status.commit_id for _ in range(3)] == ['abc', 'def', 'ghi']
+
+
+def test_full_queue_sheds_in_progress_for_terminal(bounded_queue):
+    bounded_queue.put(1, _status('abc', 'Status', 'Progressing'))
+    bounded_queue.put(2, _status('def', 'Status', 'Progressing'))
+    bounded_queue.put(3, _status('ghi', 'Status', 'Progressing'))
+    bounded_queue.put(4, _status('jkl', 'Status', 'ReconciliationSucceeded'))
+    bounded_queue.put(5, _status('mno', 'Status', 'Progressing'))
+
+    assert bounded_queue.get_metrics()['commit_status_shed_in_progress_total'] == 2
+    assert [bounded_queue.get().req_time for _ in range(3)] == [2, 3, 4]
+
+
+def test_shed_statuses_are_reported():
+    shed = []
+    queue = CoalescingCommitStatusQueue(high_watermark=2, low_watermark=1, on_shed=shed.append)
+    queue.put(1, _status('abc', 'deployment.apps', 'NotApplicable'))
+    queue.put(2, _status('def', 'Status', 'Progressing'))
+
+    # Sheds the pending NotApplicable summary, then the incoming status itself
+    queue.put(3, _status('ghi', 'Status', 'Progressing'))
+    queue.put(4, _status('jkl', 'Status', 'Progressing'))
+
+    assert [(queued_status.req_time, queued_status.commit_status.commit_id) for queued_status in shed] == \
+        [(1, 'abc'), (4, 'jkl')]
+
+
+def test_full_queue_never_sheds_terminal(bounded_queue):
+    for req_time, commit_id in enumerate(['abc', 'def', 'ghi', 'jkl']):
+        bounded_queue.put(req_time, _status(commit_id, 'Status', 'ReconciliationFailed'))
+
+    assert bounded_queue.qsize() == 4
+
+
+def test_saturated_until_below_low_watermark(bounded_queue):
+    for req_time, commit_id in enumerate(['abc', 'def', 'ghi']):
+        bounded_queue.put(req_time, _status(commit_id, 'Status', 'Progressing'))
+    assert bounded_queue.is_saturated()
+
+    bounded_queue.get()
+    assert bounded_queue.is_saturated()
+
+    bounded_queue.get()
+    assert not bounded_queue.is_saturated()
+
+
+def _status(commit_id, status_name, state):
+    return GitCommitStatus(
+        commit_id=commit_id,
+        status_name=status_name,
+        state=state,
+        message='',
+        callback_url='https://example.com/testing',
+        gitops_operator='Flux',
+        genre='Kustomization')
+
+
+@pytest.fixture
+def queue():
+    return CoalescingCommitStatusQueue()
+
+
+@pytest.fixture
+def bounded_queue():
+    return CoalescingCommitStatusQueue(high_watermark=3, low_watermark=1)
@@ -0,0 +1,183 @@
+import threading
+import time
+
+import pytest
+import requests
+
+from configuration.commit_status_retrier import CommitStatusRetrier
+from configuration.dead_letter_store import DeadLetterStore
+from operators.git_commit_status import GitCommitStatus
+
+
+def test_failed_post_is_retried(retrier, target):
+    target.failures = 1
+
+    retrier.on_failure('git', _status('abc', 'Progressing'), ConnectionError())
+
+    _wait_for(lambda: target.posted)
+    assert target.posted[0].commit_id == 'abc'
+    assert retrier.get_metrics()['commit_status_retry_recovered_total'] == 1
+
+
+def test_permanent_error_is_dropped(retrier, target):
+    response = requests.Response()
+    response.status_code = 422
+
+    retrier.on_failure('git', _status('abc', 'Progressing'), requests.HTTPError(response=response))
+
+    assert retrier.get_metrics()['commit_status_dropped_total'] == 1
+    assert retrier.get_metrics()['commit_status_retry_pending'] == 0
+
+
+def test_exhausted_status_is_dead_lettered_and_replayed_on_recovery(retrier, target, store):
+    target.failures = 10
+    retrier.on_failure('git', _status('abc', 'Progressing'), ConnectionError())
+    _wait_for(lambda: store.size() == 1)
+
+    target.failures = 0
+    retrier.on_success('git', _status('def', 'Succeeded'))
+
+    _wait_for(lambda: target.posted)
+    assert target.posted[0].commit_id == 'abc'
+    _wait_for(lambda: store.size() == 0)
+
+
+def test_newer_status_supersedes_dead_letter(retrier, target, store):
+    store.add('git', _status('abc', 'Progressing'))
+
+    retrier.on_success('git', _status('abc', 'Succeeded'))
+
+    assert store.size() == 0
+
+
+def test_dead_letter_store_is_bounded_and_reloaded(tmp_path):
+    store = DeadLetterStore(str(tmp_path), max_entries=2)
+    store.add('git', _status('abc', 'Progressing'))
+    store.add('git', _status('def', 'Progressing'))
+    store.add('git', _status('ghi', 'Progressing'))
+
+    reloaded = DeadLetterStore(str(tmp_path), max_entries=2)
+
+    assert store.evicted_count == 1
+    assert [status.commit_id for status in reloaded.get_entries('git')] == ['def', 'ghi']
+
+
+def test_failed_probe_keeps_the_dead_letter_without_counting_it_again(target, store):
+    store.add('git', _status('abc', 'Progressing'))
+    target.failures = 10
+    retrier = CommitStatusRetrier({'git': target}, store, max_attempts=3, probe_interval=0.05)
+    retrier.start()
+
+    _wait_for(lambda: retrier.get_metrics()['dead_letter_probe_failures_total'] >= 2)
+    retrier.stop()
+    metrics = retrier.get_metrics()
+    assert metrics['commit_status_dead_lettered_total'] == 0
+    assert metrics['commit_status_retried_total'] == 0
+    assert store.size() == 1
+
+
+def test_successful_probe_replays_the_dead_letters(target, store):
+    store.add('git', _status('abc', 'Progressing'))
+    store.add('git', _status('def', 'Progressing'))
+    retrier = CommitStatusRetrier({'git': target}, store, max_attempts=3, probe_interval=0.05)
+    retrier.start()
+
+    _wait_for(lambda: store.size() == 0)
+    retrier.stop()
+    assert sorted(status.commit_id for status in target.posted) == ['abc', 'def']
+    assert retrier.get_metrics()['dead_letter_probes_total'] == 1
+
+
+def test_post_waits_for_a_retry_in_flight(retrier, target):
+    target.release = threading.Event()
+    retrier.on_failure('git', _status('abc', 'Progressing'), ConnectionError())
+    _wait_for(lambda: target.started)
+
+    def post_newer():
+        with retrier.posting('git', _status('abc', 'Succeeded')):
+            target.posted.append(_status('abc', 'Succeeded'))
+
+    poster = threading.Thread(target=post_newer)
+    poster.start()
+    time.sleep(0.1)
+    assert target.posted == []
+
+    target.release.set()
+    poster.join(timeout=5)
+    assert [status.state for status in target.posted] == ['Progressing', 'Succeeded']
+
+
+def test_retry_is_skipped_while_a_newer_status_is_posted(retrier, target):
+    with retrier.posting('git', _status('abc', 'Succeeded')):
+        retrier.on_failure('git', _status('abc', 'Progressing'), ConnectionError())
+        _wait_for(lambda: retrier.get_metrics()['commit_status_retry_pending'] == 0)
+        time.sleep(0.1)
+
+    assert target.posted == []
+    assert retrier.get_metrics()['commit_status_retried_total'] == 0
+
+
+def test_recovered_posts_are_reported(target, store):
+    recovered = []
+    retrier = CommitStatusRetrier({'git': target}, store, max_attempts=3, base_delay=0.01, max_delay=0.05,
+                                  on_recovered=lambda target, commit_status: recovered.append(commit_status.commit_id))
+    retrier.start()
+    retrier.on_failure('git', _status('abc', 'Progressing'), ConnectionError())
+
+    _wait_for(lambda: recovered)
+    retrier.stop()
+    assert recovered == ['abc']
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def _status(commit_id, state):
+    return GitCommitStatus(
+        commit_id=commit_id,
+        status_name='Status',
+        state=state,
+        message='',
+        callback_url='https://example.com/testing',
+        gitops_operator='Flux',
+        genre='Kustomization')
+
+
+class FlakyTarget:
+    def __init__(self):
+        self.failures = 0
+        self.posted = []
+        self.started = False
+        self.release = None
+
+    def post_commit_status(self, commit_status):
+        self.started = True
+        if self.release is not None:
+            self.release.wait()
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('upstream unavailable')
+        self.posted.append(commit_status)
+
+
+@pytest.fixture
+def target():
+    return FlakyTarget()
+
+
+@pytest.fixture
+def store(tmp_path):
+    return DeadLetterStore(str(tmp_path), max_entries=10)
+
+
+@pytest.fixture
+def retrier(target, store):
+    retrier = CommitStatusRetrier({'git': target}, store, max_attempts=3, base_delay=0.01, max_delay=0.05,
+                                  probe_interval=60)
+    retrier.start()
+    yield retrier
+    retrier.stop()
@@ -0,0 +1,75 @@
+import pytest
+
+from configuration.commit_status_wal import CommitStatusWal
+from operators.git_commit_status import GitCommitStatus
+
+
+def test_unacknowledged_statuses_survive_reopen(wal, tmp_path):
+    wal.append(1, _status('abc', 'Progressing'))
+    wal.append(2, _status('def', 'Progressing'))
+    wal.ack(1, _status('abc', 'Progressing'))
+    wal.stop()
+
+    reopened = CommitStatusWal(str(tmp_path / 'wal.db'))
+
+    assert [status.commit_id for _, status in reopened.requeue_pending(100)] == ['def']
+    reopened.stop()
+
+
+def test_requeued_statuses_stay_until_acknowledged(wal, tmp_path):
+    wal.append(5, _status('abc', 'Progressing'))
+    wal.append(7, _status('def', 'Progressing'))
+
+    requeued = wal.requeue_pending(100)
+    # Crashes before the requeued statuses were posted
+    wal.stop()
+    reopened = CommitStatusWal(str(tmp_path / 'wal.db'), commit_interval=60000)
+
+    assert [(req_time, status.commit_id) for req_time, status in requeued] == [(100, 'abc'), (101, 'def')]
+    assert [status.commit_id for _, status in reopened.requeue_pending(200)] == ['abc', 'def']
+    reopened.ack(200, _status('abc', 'Progressing'))
+    reopened.ack(201, _status('def', 'Progressing'))
+    assert reopened.requeue_pending(300) == []
+    reopened.stop()
+
+
+def test_log_keeps_newest_status_per_context(wal):
+    wal.append(2, _status('abc', 'Succeeded'))
+    wal.append(1, _status('abc', 'Progressing'))
+    wal.append(3, _status('def', 'Progressing'))
+
+    assert [status.state for _, status in wal.requeue_pending(100)] == ['Succeeded', 'Progressing']
+
+
+def test_ack_of_superseded_status_keeps_newer_one(wal):
+    wal.append(1, _status('abc', 'Progressing'))
+    wal.append(2, _status('abc', 'Succeeded'))
+    wal.ack(1, _status('abc', 'Progressing'))
+
+    assert [status.state for _, status in wal.requeue_pending(100)] == ['Succeeded']
+
+
+def test_buffered_operations_are_committed_together(wal):
+    for req_time in range(100):
+        wal.append(req_time, _status(f'commit{req_time}', 'Progressing'))
+    wal.flush()
+    wal.compact()
+
+    assert wal.get_metrics()['commit_status_wal_commits_total'] == 1
+
+
+def _status(commit_id, state):
+    return GitCommitStatus(
+        commit_id=commit_id,
+        status_name='Status',
+        state=state,
+        message='',
+        callback_url='https://example.com/testing',
+        gitops_operator='Flux',
+        genre='Kustomization')
+
+
+@pytest.fixture
+def wal(tmp_path):
+    # Commits only on flush within the tests
+    return CommitStatusWal(str(tmp_path / 'wal.db'), commit_interval=60000)
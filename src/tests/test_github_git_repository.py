@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+import requests
+
+from caching.commit_finality_cache import CommitFinalityCache
+from clients.github_rate_limiter import RateLimitedError
+from configuration.gitops_config import GitOpsConfig
+from repositories.github_git_repository import GitHubGitRepository
+
+
+def test_rate_limited_finished_check_is_not_remembered(repository, statuses):
+    cache = CommitFinalityCache(repository.is_commit_finished, repository.is_commit_finished_async)
+    statuses.append(RateLimitedError('Budget kept for status posts'))
+
+    assert not cache.is_commit_finished('abc')
+
+    statuses.append('success')
+    assert cache.is_commit_finished('abc')
+
+
+def test_rate_limited_async_finished_check_is_not_remembered(repository, statuses):
+    cache = CommitFinalityCache(repository.is_commit_finished, repository.is_commit_finished_async)
+    statuses.append(RateLimitedError('Budget kept for status posts'))
+
+    assert not asyncio.run(cache.is_commit_finished_async('abc'))
+
+    statuses.append('success')
+    assert asyncio.run(cache.is_commit_finished_async('abc'))
+
+
+def _response(state):
+    response = requests.Response()
+    response.status_code = 200
+    response._content = ('{"state": "%s"}' % state).encode()
+    return response
+
+
+@pytest.fixture
+def statuses():
+    return []
+
+
+@pytest.fixture
+def repository(monkeypatch, statuses):
+    monkeypatch.setenv('PAT', 'pat')
+    config = GitOpsConfig(name='test', git_repository_type='GITHUB', cicd_orchestrator_type='GITHUB',
+                          gitops_operator_type='FLUX', gitops_app_url='https://app',
+                          github_gitops_repo_name='source', github_gitops_manifests_repo_name='manifests',
+                          github_org_url='https://api.github.com/repos/org')
+    repository = GitHubGitRepository(config)
+    # Commit states come from REST, not GraphQL batches
+    repository._commit_lookups = None
+
+    def get(url, wait=True):
+        status = statuses.pop(0)
+        if isinstance(status, Exception):
+            raise status
+        return _response(status)
+
+    async def get_async(url, wait=True):
+        return get(url, wait)
+
+    monkeypatch.setattr(repository.github_client, 'get', get)
+    monkeypatch.setattr(repository.github_client, 'get_async', get_async)
+    return repository
@@ -0,0 +1,128 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+import requests
+
+from clients.github_graphql_batcher import CommitLookupBatcher, GraphQLError
+
+FINISHED_COMMIT = 'a' * 40
+PENDING_COMMIT = 'b' * 40
+MISSING_COMMIT = 'c' * 40
+
+
+def test_concurrent_lookups_are_batched(batcher, github_client):
+    results = {}
+
+    def lookup(commit_id):
+        results[commit_id] = batcher.lookup(commit_id)
+
+    threads = [threading.Thread(target=lookup, args=(commit_id,))
+               for commit_id in (FINISHED_COMMIT, PENDING_COMMIT, MISSING_COMMIT)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results[FINISHED_COMMIT] == {'message': 'x/y/1/abc', 'state': 'success'}
+    assert results[PENDING_COMMIT] == {'message': 'x/y/2/def', 'state': 'pending'}
+    assert results[MISSING_COMMIT] is None
+    assert [len(variables) - 2 for variables in github_client.queries] == [2, 1]
+
+
+def test_sender_only_sends_its_own_batch(batcher, github_client):
+    results = {}
+
+    def lookup(commit_id):
+        results[commit_id] = batcher.lookup(commit_id)
+
+    def on_query():
+        # A lookup arriving while the first query is in flight
+        github_client.on_query = None
+        thread = threading.Thread(target=lookup, args=(PENDING_COMMIT,), name='second')
+        thread.start()
+        _wait_for(lambda: PENDING_COMMIT in batcher._pending)
+        threads.append(thread)
+
+    threads = []
+    github_client.on_query = on_query
+    first = threading.Thread(target=lookup, args=(FINISHED_COMMIT,), name='first')
+    first.start()
+    first.join()
+    threads[0].join()
+
+    assert results[FINISHED_COMMIT]['state'] == 'success'
+    assert results[PENDING_COMMIT]['state'] == 'pending'
+    assert github_client.senders == ['first', 'second']
+
+
+def test_async_lookups_are_split_by_batch_size(batcher, github_client):
+    async def lookup_all():
+        return await asyncio.gather(*(batcher.lookup_async(commit_id)
+                                      for commit_id in (FINISHED_COMMIT, PENDING_COMMIT, MISSING_COMMIT)))
+
+    results = asyncio.run(lookup_all())
+
+    assert [result and result['state'] for result in results] == ['success', 'pending', None]
+    assert [len(variables) - 2 for variables in github_client.queries] == [2, 1]
+
+
+def test_malformed_commit_id_is_not_queried(batcher, github_client):
+    assert batcher.lookup('abc123') is None
+    assert github_client.queries == []
+
+
+def test_query_errors_are_raised(batcher, github_client):
+    github_client.errors = [{'message': 'Bad credentials'}]
+
+    with pytest.raises(GraphQLError):
+        batcher.lookup(FINISHED_COMMIT)
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+class FakeGitHubClient:
+    def __init__(self):
+        self.queries = []
+        self.senders = []
+        self.errors = None
+        self.on_query = None
+
+    def get_owner(self):
+        return 'org'
+
+    def graphql(self, query, variables, wait=True):
+        self.queries.append(variables)
+        self.senders.append(threading.current_thread().name)
+        if self.on_query is not None:
+            self.on_query()
+        commits = {
+            FINISHED_COMMIT: {'message': 'x/y/1/abc', 'status': {'state': 'SUCCESS'}},
+            PENDING_COMMIT: {'message': 'x/y/2/def', 'status': None},
+        }
+        repository = {name: commits.get(commit_id) for name, commit_id in variables.items() if name.startswith('c')}
+        body = {'errors': self.errors} if self.errors else {'data': {'repository': repository}}
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps(body).encode('utf-8')
+        return response
+
+    async def graphql_async(self, query, variables, wait=True):
+        return self.graphql(query, variables, wait)
+
+
+@pytest.fixture
+def github_client():
+    return FakeGitHubClient()
+
+
+@pytest.fixture
+def batcher(github_client):
+    return CommitLookupBatcher(github_client, 'manifests', window=50, batch_size=2)
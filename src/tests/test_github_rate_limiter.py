@@ -0,0 +1,81 @@
+import email.utils
+import time
+
+import pytest
+import requests
+
+from clients.github_rate_limiter import GitHubRateLimiter, RateLimitedError, READ_PRIORITY, WRITE_PRIORITY
+
+
+def test_calls_are_not_delayed_while_budget_is_plentiful(rate_limiter):
+    rate_limiter.observe(_response(200, remaining=4000))
+
+    assert rate_limiter._reserve(READ_PRIORITY, wait=True) == 0
+    assert rate_limiter._reserve(WRITE_PRIORITY, wait=True) == 0
+
+
+def test_reads_yield_to_writes_when_budget_is_low(rate_limiter):
+    rate_limiter.observe(_response(200, remaining=50))
+
+    with pytest.raises(RateLimitedError):
+        rate_limiter.acquire(READ_PRIORITY, wait=False)
+    assert rate_limiter._reserve(WRITE_PRIORITY, wait=True) == 0
+
+
+def test_calls_are_paced_below_threshold(rate_limiter):
+    rate_limiter.observe(_response(200, remaining=500, reset_in=1000))
+
+    first = rate_limiter._reserve(WRITE_PRIORITY, wait=True)
+    second = rate_limiter._reserve(WRITE_PRIORITY, wait=True)
+
+    assert first == 0
+    assert second == pytest.approx(2, abs=0.1)
+
+
+def test_exhausted_budget_pauses_until_reset(rate_limiter):
+    assert rate_limiter.observe(_response(403, remaining=0, reset_in=30))
+
+    assert rate_limiter._reserve(WRITE_PRIORITY, wait=True) == pytest.approx(30, abs=1)
+
+
+def test_secondary_rate_limit_honors_retry_after(rate_limiter):
+    response = _response(429, remaining=4000)
+    response.headers['Retry-After'] = '10'
+
+    assert rate_limiter.observe(response)
+    assert rate_limiter._reserve(WRITE_PRIORITY, wait=True) == pytest.approx(10, abs=1)
+
+
+def test_retry_after_accepts_http_date(rate_limiter):
+    response = _response(429, remaining=4000)
+    response.headers['Retry-After'] = email.utils.formatdate(time.time() + 20, usegmt=True)
+
+    assert rate_limiter.observe(response)
+    assert rate_limiter._reserve(WRITE_PRIORITY, wait=True) == pytest.approx(20, abs=2)
+
+
+def test_invalid_retry_after_pauses_for_default(rate_limiter):
+    response = _response(429, remaining=4000)
+    response.headers['Retry-After'] = 'soon'
+
+    assert rate_limiter.observe(response)
+    assert rate_limiter._reserve(WRITE_PRIORITY, wait=True) == pytest.approx(60, abs=1)
+
+
+def test_forbidden_without_rate_limit_is_not_a_pause(rate_limiter):
+    assert not rate_limiter.observe(_response(403, remaining=4000))
+
+
+def _response(status_code, remaining, reset_in=3600):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = b'{}'
+    response.headers['X-RateLimit-Limit'] = '5000'
+    response.headers['X-RateLimit-Remaining'] = str(remaining)
+    response.headers['X-RateLimit-Reset'] = str(int(time.time()) + reset_in)
+    return response
+
+
+@pytest.fixture
+def rate_limiter():
+    return GitHubRateLimiter(read_reserve=0.1, pacing_threshold=0.2, secondary_pause=60)
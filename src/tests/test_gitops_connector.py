@@ -0,0 +1,247 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import configuration.gitops_connector as gitops_connector
+from configuration.gitops_config import GitOpsConfig
+from configuration.commit_status_wal import CommitStatusWal
+from configuration.gitops_connector import GitopsConnector
+from operators.git_commit_status import GitCommitStatus
+import repositories.raw_subscriber as raw_subscriber
+from repositories.subscriber_registry import SubscriberRegistry
+
+
+def test_statuses_of_a_commit_stay_in_order_on_one_shard(repository, connector_factory):
+    connector = connector_factory(dispatch_workers=4)
+    commit_ids = _commits_on_distinct_shards(connector, 4)
+    connector.start_background_work()
+
+    for index in range(3):
+        connector._put_commit_statuses(index, [_status(commit_id, f'context-{index}') for commit_id in commit_ids])
+
+    _wait_for(lambda: len(repository.posted) == 12)
+    connector.stop_background_work()
+    for commit_id in commit_ids:
+        posts = [post for post in repository.posted if post[1] == commit_id]
+        assert [status_name for _, _, status_name in posts] == ['context-0', 'context-1', 'context-2']
+        assert len({thread for thread, _, _ in posts}) == 1
+    # Different commits were posted at the same time
+    assert repository.max_concurrent_posts > 1
+
+
+def test_a_commit_always_maps_to_the_same_shard(connector_factory):
+    connector = connector_factory(dispatch_workers=4)
+
+    assert connector._get_shard('abc123') == connector._get_shard('abc123')
+    assert {connector._get_shard(f'commit-{index}') for index in range(100)} == {0, 1, 2, 3}
+
+
+def test_replayed_statuses_stay_in_the_wal_until_posted(repository, connector_factory, wal, tmp_path):
+    wal.append(1, _status('abc', 'Status'))
+    wal.append(2, _status('def', 'Status'))
+    connector = connector_factory()
+    connector._status_wal = wal
+    repository.release = threading.Event()
+
+    connector.start_background_work()
+    _wait_for(lambda: repository.started)
+    # Nothing was posted yet, a crash now must not lose the statuses
+    wal.flush()
+    with sqlite3.connect(str(tmp_path / 'wal.db')) as connection:
+        assert connection.execute('SELECT commit_id FROM commit_statuses ORDER BY req_time').fetchall() == \
+            [('abc',), ('def',)]
+
+    repository.release.set()
+    _wait_for(lambda: len(repository.posted) == 2)
+    connector.stop_background_work()
+    assert wal.requeue_pending(0) == []
+
+
+def test_shed_statuses_are_acknowledged(monkeypatch, repository, connector_factory, wal):
+    monkeypatch.setattr(gitops_connector, 'STATUS_QUEUE_HIGH_WATERMARK', 2)
+    monkeypatch.setattr(gitops_connector, 'STATUS_QUEUE_LOW_WATERMARK', 1)
+    connector = connector_factory()
+    connector._status_wal = wal
+
+    for index, commit_id in enumerate(('abc', 'def', 'ghi')):
+        connector._put_commit_statuses(index, [_status(commit_id, 'Status')])
+    connector.start_background_work()
+
+    _wait_for(lambda: len(repository.posted) == 2)
+    connector.stop_background_work()
+    assert connector.get_metrics()['commit_status_shed_in_progress_total'] == 1
+    assert wal.requeue_pending(0) == []
+
+
+def test_statuses_stay_in_the_wal_until_subscribers_report(monkeypatch, repository, connector_factory,
+                                                           subscriber_registry, wal, tmp_path):
+    session = FakeSession()
+    monkeypatch.setattr(raw_subscriber, 'get_http_session', lambda url: session)
+    monkeypatch.setattr(raw_subscriber, 'prewarm_http_session', lambda url, connections: None)
+    (tmp_path / 'subscribers' / 'a').write_text('https://subscriber.example.com/api\n')
+    subscriber_registry.reload()
+    connector = connector_factory()
+    connector._status_wal = wal
+    connector.start_background_work()
+
+    try:
+        connector._put_commit_statuses(1, [_status('abc', 'Status')])
+        _wait_for(lambda: repository.posted and session.started)
+        # Posted to the git repository but not to the subscriber yet
+        wal.flush()
+        with sqlite3.connect(str(tmp_path / 'wal.db')) as connection:
+            assert connection.execute('SELECT commit_id FROM commit_statuses').fetchall() == [('abc',)]
+
+        session.release.set()
+        _wait_for(lambda: session.posted)
+    finally:
+        session.release.set()
+        connector.stop_background_work()
+    assert wal.requeue_pending(0) == []
+
+
+def test_recovered_posts_update_the_posted_statuses(repository, connector_factory):
+    connector = connector_factory()
+    connector._status_retrier._base_delay = 0.01
+    repository.failures = 1
+    connector.start_background_work()
+
+    connector._put_commit_statuses(1, [_status('abc', 'Status')])
+    _wait_for(lambda: repository.posted)
+    connector.stop_background_work()
+
+    assert connector.get_metrics()['commit_status_retry_recovered_total'] == 1
+    assert connector._is_already_posted(gitops_connector.GIT_REPOSITORY_TARGET, _status('abc', 'Status'))
+
+
+def _commits_on_distinct_shards(connector, count):
+    commit_ids = {}
+    index = 0
+    while len(commit_ids) < count:
+        commit_id = f'commit-{index}'
+        commit_ids.setdefault(connector._get_shard(commit_id), commit_id)
+        index += 1
+    return list(commit_ids.values())
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def _status(commit_id, status_name):
+    return GitCommitStatus(
+        commit_id=commit_id,
+        status_name=status_name,
+        state='Progressing',
+        message='',
+        callback_url='https://example.com/testing',
+        gitops_operator='Flux',
+        genre='Kustomization')
+
+
+class FakeRepository:
+    def __init__(self):
+        self.posted = []
+        self.failures = 0
+        self.started = False
+        self.release = None
+        self.max_concurrent_posts = 0
+        self._concurrent_posts = 0
+        self._lock = threading.Lock()
+
+    def post_commit_status(self, commit_status):
+        self.started = True
+        if self.release is not None:
+            self.release.wait()
+        with self._lock:
+            self._concurrent_posts += 1
+            self.max_concurrent_posts = max(self.max_concurrent_posts, self._concurrent_posts)
+        time.sleep(0.02)
+        with self._lock:
+            self._concurrent_posts -= 1
+            if self.failures:
+                self.failures -= 1
+                raise ConnectionError('Post failed')
+            self.posted.append((threading.current_thread().name, commit_status.commit_id, commit_status.status_name))
+
+    def prewarm_connections(self, connections=1):
+        pass
+
+    def is_commit_finished(self, commit_id):
+        return False
+
+    async def is_commit_finished_async(self, commit_id):
+        return False
+
+    def get_metrics(self):
+        return {}
+
+
+class FakeResponse:
+    def raise_for_status(self):
+        pass
+
+
+class FakeSession:
+    def __init__(self):
+        self.posted = []
+        self.started = False
+        self.release = threading.Event()
+
+    def post(self, url, data, headers):
+        self.started = True
+        self.release.wait()
+        self.posted.append(data)
+        return FakeResponse()
+
+
+class FakeOrchestrator:
+    def notify_abandoned_pr_tasks(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def get_metrics(self):
+        return {}
+
+
+@pytest.fixture
+def repository():
+    return FakeRepository()
+
+
+@pytest.fixture
+def wal(tmp_path):
+    wal = CommitStatusWal(str(tmp_path / 'wal.db'), commit_interval=60000)
+    yield wal
+    wal.stop()
+
+
+@pytest.fixture
+def subscriber_registry(tmp_path):
+    subscribers_dir = tmp_path / 'subscribers'
+    subscribers_dir.mkdir()
+    registry = SubscriberRegistry(str(subscribers_dir), poll_interval=60, use_inotify=False)
+    yield registry
+    registry.stop()
+
+
+@pytest.fixture
+def connector_factory(monkeypatch, repository, subscriber_registry):
+    monkeypatch.setattr(gitops_connector.GitopsOperatorFactory, 'new_gitops_operator', staticmethod(lambda config: None))
+    monkeypatch.setattr(gitops_connector.GitRepositoryFactory, 'new_git_repository', staticmethod(lambda config: repository))
+    monkeypatch.setattr(gitops_connector.CicdOrchestratorFactory, 'new_cicd_orchestrator',
+                        staticmethod(lambda git_repository, config: FakeOrchestrator()))
+    monkeypatch.setattr(gitops_connector, 'get_subscriber_registry', lambda: subscriber_registry)
+
+    def connector_factory(dispatch_workers=1):
+        config = GitOpsConfig('test', 'GITHUB', 'GITHUB', 'FLUX', 'https://example.com',
+                              status_dispatch_workers=dispatch_workers)
+        return GitopsConnector(config)
+    return connector_factory
@@ -0,0 +1,104 @@
+import threading
+
+import pytest
+
+import configuration.gitops_connector_manager as gitops_connector_manager
+from configuration.gitops_config import GitOpsConfig
+from configuration.gitops_connector_manager import CONFIG_NAME_KEY, GitOpsConnectorManager
+
+
+def test_payload_is_routed_by_config_name(manager):
+    manager.add_or_update_configuration(_config('a'))
+    manager.add_or_update_configuration(_config('b'))
+
+    assert manager.get_supported_gitops_connector({CONFIG_NAME_KEY: 'a'}).name == 'a'
+    assert manager.get_supported_gitops_connector({'metadata': {CONFIG_NAME_KEY: 'b'}}).name == 'b'
+    assert manager.get_supported_gitops_connector({CONFIG_NAME_KEY: 'c'}) is None
+
+
+def test_update_replaces_and_stops_the_connector(manager):
+    manager.add_or_update_configuration(_config('a'))
+    replaced = manager.connectors['a']
+
+    manager.add_or_update_configuration(_config('a'))
+
+    assert manager.connectors['a'] is not replaced
+    assert replaced.stopped
+    assert manager.connectors['a'].started
+
+
+def test_remove_stops_the_connector(manager):
+    manager.add_or_update_configuration(_config('a'))
+    connector = manager.connectors['a']
+
+    manager.remove_configuration(_config('a'))
+
+    assert connector.stopped
+    assert manager.get_supported_gitops_connector({CONFIG_NAME_KEY: 'a'}) is None
+
+
+def test_routing_table_is_never_mutated_in_place(manager):
+    manager.add_or_update_configuration(_config('a'))
+    table = manager.connectors
+
+    manager.add_or_update_configuration(_config('b'))
+    manager.remove_configuration(_config('a'))
+
+    assert list(table) == ['a']
+    assert list(manager.connectors) == ['b']
+
+
+def test_reads_during_concurrent_updates(manager):
+    manager.add_or_update_configuration(_config('stable'))
+    stop = threading.Event()
+    errors = []
+
+    def read():
+        while not stop.is_set():
+            try:
+                assert manager.get_supported_gitops_connector({CONFIG_NAME_KEY: 'stable'}).name == 'stable'
+                connector = manager.get_supported_gitops_connector({CONFIG_NAME_KEY: 'churn'})
+                assert connector is None or connector.name == 'churn'
+                # Iterating the table while it is swapped must not raise
+                list(manager.connectors.items())
+            except Exception as e:
+                errors.append(e)
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    for _ in range(500):
+        manager.add_or_update_configuration(_config('churn'))
+        manager.remove_configuration(_config('churn'))
+    stop.set()
+    for reader in readers:
+        reader.join()
+
+    assert errors == []
+    assert list(manager.connectors) == ['stable']
+
+
+def _config(name):
+    return GitOpsConfig(name, 'GITHUB', 'GITHUB', 'FLUX', 'https://example.com')
+
+
+class FakeConnector:
+    def __init__(self, config):
+        self.name = config.name
+        self.started = False
+        self.stopped = False
+
+    def start_background_work(self, event_loop=None):
+        self.started = True
+
+    def stop_background_work(self):
+        self.stopped = True
+
+    def is_supported_message(self, payload):
+        return True
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    monkeypatch.setattr(gitops_connector_manager, 'GitopsConnector', FakeConnector)
+    return GitOpsConnectorManager()
@@ -0,0 +1,96 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import clients.http_session as http_session
+from clients.http_session import get_http_session, host_concurrency_limit, prewarm_http_session
+
+
+def test_session_is_shared_per_host():
+    session = get_http_session('https://dev.azure.com/org/project/_apis/git')
+
+    assert get_http_session(' https://dev.azure.com/other ') is session
+    assert get_http_session('https://api.github.com/repos') is not session
+
+
+def test_prewarmed_connection_is_reused(server):
+    prewarm_http_session(server.url)
+    _wait_for(lambda: server.requests and not _prewarming())
+
+    response = get_http_session(server.url).get(server.url + 'status')
+
+    assert response.status_code == 200
+    assert [method for method, _ in server.requests] == ['HEAD', 'GET']
+    assert len({client_address for _, client_address in server.requests}) == 1
+
+
+def test_prewarm_failure_is_ignored():
+    prewarm_http_session('http://127.0.0.1:1/')
+
+
+def test_host_concurrency_limit_is_per_host(monkeypatch):
+    monkeypatch.setattr(http_session, 'HTTP_MAX_CONCURRENCY_PER_HOST', 1)
+    entered = threading.Event()
+
+    def call():
+        with host_concurrency_limit('https://dev.azure.com/org'):
+            entered.set()
+
+    with host_concurrency_limit('https://dev.azure.com/org'):
+        with host_concurrency_limit('https://api.github.com/'):
+            pass
+        thread = threading.Thread(target=call)
+        thread.start()
+        assert not entered.wait(0.2)
+    thread.join(timeout=5)
+    assert entered.is_set()
+
+
+def _prewarming() -> bool:
+    return any(thread.name == 'http-prewarm' for thread in threading.enumerate())
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+class RecordingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self):
+        self._respond()
+
+    def do_GET(self):
+        self._respond()
+
+    def _respond(self):
+        self.server.requests.append((self.command, self.client_address))
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def sessions(monkeypatch):
+    monkeypatch.setattr(http_session, '_sessions', {})
+    monkeypatch.setattr(http_session, '_host_semaphores', {})
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RecordingHandler)
+    server.requests = []
+    server.url = f'http://127.0.0.1:{server.server_address[1]}/'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
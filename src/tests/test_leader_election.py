@@ -0,0 +1,56 @@
+import threading
+import time
+
+import pytest
+
+from ingestion.leader_election import LeaderElector
+
+
+def test_only_one_process_is_elected(lock_file):
+    leader = LeaderElector(lock_file, poll_interval=0.05)
+    follower = LeaderElector(lock_file, poll_interval=0.05)
+    elected = []
+
+    leader.start(on_elected=lambda: elected.append('leader'))
+    follower.start(on_elected=lambda: elected.append('follower'))
+    time.sleep(0.2)
+
+    assert leader.is_leader()
+    assert not follower.is_leader()
+    assert elected == ['leader']
+    follower.stop()
+    leader.stop()
+
+
+def test_follower_takes_over_when_the_leader_stops(lock_file):
+    leader = LeaderElector(lock_file, poll_interval=0.05)
+    follower = LeaderElector(lock_file, poll_interval=0.05)
+    took_over = threading.Event()
+    leader.start(on_elected=lambda: None)
+    follower.start(on_elected=took_over.set)
+
+    leader.stop()
+
+    assert took_over.wait(timeout=5)
+    assert follower.is_leader()
+    assert not leader.is_leader()
+    follower.stop()
+
+
+def test_stopped_follower_stops_competing(lock_file):
+    leader = LeaderElector(lock_file, poll_interval=0.05)
+    follower = LeaderElector(lock_file, poll_interval=0.05)
+    elected = threading.Event()
+    leader.start(on_elected=lambda: None)
+    follower.start(on_elected=elected.set)
+
+    follower.stop()
+    leader.stop()
+
+    assert not elected.wait(timeout=0.2)
+    assert not follower.is_leader()
+
+
+@pytest.fixture
+def lock_file(tmp_path):
+    return str(tmp_path / 'leader.lock')
@@ -0,0 +1,93 @@
+import os
+import tempfile
+
+import pytest
+
+from ingestion.backpressure import STATUS_QUEUE_FULL, get_rejection_status, get_retry_response
+from ingestion.leader_relay import LEADER_UNAVAILABLE, LeaderRelayClient, LeaderRelayServer
+
+
+def test_accepted_payload_is_forwarded(socket_path, ingested):
+    server = _start_server(socket_path, ingested)
+
+    error = LeaderRelayClient(socket_path).forward({'id': 1}, 100)
+
+    server.stop()
+    assert error is None
+    assert ingested == [({'id': 1}, 100)]
+
+
+def test_retryable_rejection_is_returned(socket_path, ingested):
+    server = _start_server(socket_path, ingested, error=STATUS_QUEUE_FULL)
+
+    error = LeaderRelayClient(socket_path).forward({'id': 1}, 100)
+
+    server.stop()
+    assert error == STATUS_QUEUE_FULL
+    assert get_retry_response(error) == (429, 5)
+
+
+def test_rejection_is_returned(socket_path, ingested):
+    server = _start_server(socket_path, ingested, error='No GitOps connector supports the message')
+
+    error = LeaderRelayClient(socket_path).forward({'id': 1}, 100)
+
+    server.stop()
+    assert get_retry_response(error) is None
+    assert get_rejection_status(error) == 400
+
+
+def test_processing_failure_is_returned(socket_path):
+    def ingest_phase(payload, req_time):
+        raise RuntimeError('broken')
+    server = LeaderRelayServer(ingest_phase, socket_path)
+    server.start()
+
+    error = LeaderRelayClient(socket_path).forward({'id': 1}, 100)
+
+    server.stop()
+    assert error == 'Failed to process message: broken'
+    assert get_rejection_status(error) == 500
+
+
+def test_missing_leader_is_unavailable(socket_path):
+    error = LeaderRelayClient(socket_path, timeout=1).forward({'id': 1}, 100)
+
+    assert error == LEADER_UNAVAILABLE
+    assert get_retry_response(error) == (503, 1)
+
+
+def test_client_reconnects_to_a_new_leader(socket_path, ingested):
+    client = LeaderRelayClient(socket_path)
+    server = _start_server(socket_path, ingested)
+    assert client.forward({'id': 1}, 1) is None
+    server.stop()
+
+    server = _start_server(socket_path, ingested)
+    error = client.forward({'id': 2}, 2)
+
+    server.stop()
+    assert error is None
+    assert ingested == [({'id': 1}, 1), ({'id': 2}, 2)]
+
+
+def _start_server(socket_path, ingested, error=None):
+    def ingest_phase(payload, req_time):
+        ingested.append((payload, req_time))
+        return error
+    server = LeaderRelayServer(ingest_phase, socket_path)
+    server.start()
+    return server
+
+
+@pytest.fixture
+def socket_path():
+    # Unix socket paths are limited to ~100 characters, too short for tmp_path
+    directory = tempfile.mkdtemp()
+    yield os.path.join(directory, 'leader.sock')
+    os.rmdir(directory)
+
+
+@pytest.fixture
+def ingested():
+    return []
@@ -0,0 +1,39 @@
+import time
+
+from caching.lru_cache import LruCache
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LruCache(max_entries=2, ttl=60)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.eviction_count == 1
+
+
+def test_entries_expire_after_ttl():
+    cache = LruCache(max_entries=10, ttl=60)
+    cache.put('a', 1, ttl=0.01)
+    cache.put('b', 2)
+    time.sleep(0.02)
+
+    assert cache.get('a') is None
+    assert cache.get('b') == 2
+    assert len(cache) == 1
+
+
+def test_metrics_count_hits_and_misses():
+    cache = LruCache(max_entries=10, ttl=60)
+    cache.put('a', 1)
+    cache.get('a')
+    cache.get('b')
+
+    metrics = cache.get_metrics('test')
+    assert metrics['test_cache_hits_total'] == 1
+    assert metrics['test_cache_misses_total'] == 1
+    assert metrics['test_cache_size'] == 1
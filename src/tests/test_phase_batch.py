@@ -0,0 +1,40 @@
+import pytest
+
+from ingestion.phase_batch import parse_phase_batch
+
+
+def test_json_array():
+    entries = parse_phase_batch('[{"id": 1}, {"id": 2}]')
+
+    assert entries == [({'id': 1}, None), ({'id': 2}, None)]
+
+
+def test_ndjson_skips_blank_lines():
+    entries = parse_phase_batch('{"id": 1}\n\n  \n{"id": 2}\n')
+
+    assert entries == [({'id': 1}, None), ({'id': 2}, None)]
+
+
+def test_malformed_ndjson_line_rejects_only_that_item():
+    entries = parse_phase_batch('{"id": 1}\n{"id": \n{"id": 3}')
+
+    assert entries[0] == ({'id': 1}, None)
+    assert entries[1][0] is None
+    assert entries[1][1].startswith('Malformed JSON')
+    assert entries[2] == ({'id': 3}, None)
+
+
+def test_items_that_are_not_objects_are_rejected():
+    entries = parse_phase_batch('[{"id": 1}, 2, "three"]')
+
+    assert entries == [({'id': 1}, None), (None, 'Expected a JSON object'), (None, 'Expected a JSON object')]
+
+
+def test_malformed_json_array_rejects_the_batch():
+    with pytest.raises(ValueError):
+        parse_phase_batch('[{"id": 1},')
+
+
+@pytest.mark.parametrize('body', ['', '  \n\n'])
+def test_empty_body(body):
+    assert parse_phase_batch(body) == []
@@ -0,0 +1,116 @@
+import importlib
+import threading
+import time
+
+import pytest
+
+from configuration.gitops_config_operator import GitOpsConfigOperator
+from ingestion.phase_ingestor import PhaseIngestor
+
+
+def test_submitted_payload_is_processed(connector_manager):
+    ingestor = PhaseIngestor(connector_manager, workers=1, queue_size=10)
+    ingestor.start()
+
+    # Accepted, the handler answers 202
+    assert ingestor.submit({'id': 1}, 100)
+
+    _wait_for(lambda: connector_manager.connector.processed)
+    ingestor.stop()
+    assert connector_manager.connector.processed == [({'id': 1}, 100)]
+
+
+def test_full_queue_rejects_with_retry_after(connector_manager, event_handler, monkeypatch):
+    connector_manager.connector.release = threading.Event()
+    ingestor = PhaseIngestor(connector_manager, workers=1, queue_size=1)
+    ingestor.start()
+    monkeypatch.setattr(event_handler, 'phase_ingestor', ingestor)
+    client = event_handler.application.test_client()
+    try:
+        assert client.post('/gitopsphase', json={'id': 1}).status_code == 202
+        _wait_for(lambda: connector_manager.connector.started)
+        assert client.post('/gitopsphase', json={'id': 2}).status_code == 202
+
+        response = client.post('/gitopsphase', json={'id': 3})
+
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+    finally:
+        connector_manager.connector.release.set()
+        ingestor.stop()
+    assert [payload['id'] for payload, _ in connector_manager.connector.processed] == [1, 2]
+
+
+def test_stop_drains_the_queue(connector_manager):
+    connector_manager.connector.release = threading.Event()
+    ingestor = PhaseIngestor(connector_manager, workers=2, queue_size=10)
+    ingestor.start()
+    for index in range(5):
+        assert ingestor.submit({'id': index}, index)
+
+    threading.Timer(0.1, connector_manager.connector.release.set).start()
+    ingestor.stop()
+
+    assert sorted(payload['id'] for payload, _ in connector_manager.connector.processed) == [0, 1, 2, 3, 4]
+    assert ingestor.backlog() == 0
+
+
+def test_processing_error_does_not_stop_the_worker(connector_manager):
+    connector_manager.connector.failures = 1
+    ingestor = PhaseIngestor(connector_manager, workers=1, queue_size=10)
+    ingestor.start()
+    ingestor.submit({'id': 1}, 1)
+    ingestor.submit({'id': 2}, 2)
+
+    ingestor.stop()
+
+    assert connector_manager.connector.processed == [({'id': 2}, 2)]
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+class FakeConnector:
+    def __init__(self):
+        self.processed = []
+        self.started = False
+        self.release = None
+        self.failures = 0
+
+    def process_gitops_phase(self, payload, req_time):
+        self.started = True
+        if self.release is not None:
+            self.release.wait()
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError('Processing failed')
+        self.processed.append((payload, req_time))
+
+
+class FakeConnectorManager:
+    def __init__(self):
+        self.connector = FakeConnector()
+
+    def get_supported_gitops_connector(self, payload):
+        return self.connector
+
+
+@pytest.fixture
+def connector_manager():
+    return FakeConnectorManager()
+
+
+@pytest.fixture
+def event_handler(monkeypatch):
+    # Without the ENV configuration the handler starts with no connectors
+    monkeypatch.delenv('GIT_REPOSITORY_TYPE', raising=False)
+    monkeypatch.delenv('ASYNC_INGESTION', raising=False)
+    # and runs the gitopsconfig operator, which needs a cluster
+    monkeypatch.setattr(GitOpsConfigOperator, 'run', lambda self: None)
+    event_handler = importlib.import_module('gitops_event_handler')
+    monkeypatch.setattr(event_handler.connector_manager, 'is_saturated', lambda payload: False)
+    return event_handler
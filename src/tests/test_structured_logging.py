@@ -0,0 +1,90 @@
+import json
+import logging
+import sys
+
+import pytest
+
+import structured_logging
+from structured_logging import EventSampler, JsonFormatter, LazyCall, LazyJson, debug_event, parse_sample_rates
+
+
+def test_sample_rates_are_parsed():
+    assert parse_sample_rates('phase_data=0.01, pr_data=0,bad=x,') == {'phase_data': 0.01, 'pr_data': 0.0}
+
+
+def test_sampler(monkeypatch):
+    sampler = EventSampler({'never': 0, 'always': 1, 'half': 0.5})
+
+    assert not sampler.should_log('never')
+    assert sampler.should_log('always')
+    assert sampler.should_log('unlisted')
+
+    monkeypatch.setattr(structured_logging.random, 'random', lambda: 0.4)
+    assert sampler.should_log('half')
+    monkeypatch.setattr(structured_logging.random, 'random', lambda: 0.6)
+    assert not sampler.should_log('half')
+
+
+def test_disabled_event_is_never_formatted(monkeypatch, caplog):
+    monkeypatch.setattr(structured_logging, '_sampler', EventSampler({'sampled_out': 0}))
+    formatted = Formatted()
+    caplog.set_level(logging.INFO)
+
+    debug_event('phase_data', 'Payload: %s', LazyCall(formatted))
+    caplog.set_level(logging.DEBUG)
+    debug_event('sampled_out', 'Payload: %s', LazyCall(formatted))
+
+    assert formatted.calls == 0
+    assert caplog.records == []
+
+
+def test_enabled_event_is_formatted_when_emitted(monkeypatch, caplog):
+    monkeypatch.setattr(structured_logging, '_sampler', EventSampler({}))
+    formatted = Formatted()
+    caplog.set_level(logging.DEBUG)
+
+    debug_event('phase_data', 'Payload: %s %s', LazyCall(formatted), LazyJson({'a': 1}, indent=None))
+
+    assert caplog.records[0].getMessage() == 'Payload: formatted {"a": 1}'
+    assert caplog.records[0].event == 'phase_data'
+
+
+def test_json_formatter():
+    record = logging.LogRecord('root', logging.WARNING, __file__, 1, 'Commit %s', ('abc',), None)
+    record.event = 'phase_data'
+
+    entry = json.loads(JsonFormatter().format(record))
+
+    assert entry['level'] == 'WARNING'
+    assert entry['logger'] == 'root'
+    assert entry['message'] == 'Commit abc'
+    assert entry['event'] == 'phase_data'
+    assert 'time' in entry
+
+
+def test_json_formatter_includes_the_exception():
+    try:
+        raise ValueError('broken')
+    except ValueError:
+        record = logging.LogRecord('root', logging.ERROR, __file__, 1, 'Failed', (), sys.exc_info())
+
+    entry = json.loads(JsonFormatter().format(record))
+
+    assert 'event' not in entry
+    assert 'ValueError: broken' in entry['exception']
+
+
+class Formatted:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return 'formatted'
+
+
+@pytest.fixture(autouse=True)
+def restore_root_level():
+    level = logging.root.level
+    yield
+    logging.root.setLevel(level)
@@ -0,0 +1,265 @@
+import gzip
+import json
+import threading
+import time
+
+import pytest
+
+import configuration.subscriber_delivery as subscriber_delivery
+from configuration.subscriber_delivery import SubscriberDelivery, SubscriberStoppedError
+from operators.git_commit_status import GitCommitStatus
+import repositories.raw_subscriber as raw_subscriber
+from repositories.raw_subscriber import RawSubscriber, serialize_commit_status
+
+
+def test_statuses_are_delivered_in_order(subscriber, results):
+    delivery = _delivery(subscriber, results)
+    delivery.start()
+    for commit_id in ('a', 'b', 'c'):
+        delivery.put(_status(commit_id))
+
+    _wait_for(lambda: len(subscriber.posted) == 3)
+    delivery.stop()
+    assert subscriber.posted == ['a', 'b', 'c']
+    assert [commit_id for _, commit_id in results['success']] == ['a', 'b', 'c']
+
+
+def test_full_queue_drops_oldest_status(results):
+    subscriber = FakeSubscriber({'queue_size': '2'})
+    delivery = _delivery(subscriber, results)
+    for commit_id in ('a', 'b', 'c'):
+        delivery.put(_status(commit_id))
+
+    delivery.start()
+    _wait_for(lambda: len(subscriber.posted) == 2)
+    delivery.stop()
+    assert subscriber.posted == ['b', 'c']
+    assert delivery.get_metrics()['subscriber_dropped_total'] == 1
+
+
+def test_full_queue_blocks_until_there_is_room(results):
+    subscriber = FakeSubscriber({'queue_size': '1', 'backpressure': 'block'})
+    subscriber.release = threading.Event()
+    delivery = _delivery(subscriber, results)
+    delivery.start()
+    delivery.put(_status('a'))
+    _wait_for(lambda: subscriber.started)
+    delivery.put(_status('b'))
+
+    putter = threading.Thread(target=delivery.put, args=(_status('c'),))
+    putter.start()
+    time.sleep(0.1)
+    assert putter.is_alive()
+
+    subscriber.release.set()
+    putter.join(timeout=5)
+    _wait_for(lambda: len(subscriber.posted) == 3)
+    delivery.stop()
+    assert subscriber.posted == ['a', 'b', 'c']
+    assert delivery.get_metrics()['subscriber_blocked_total'] == 1
+
+
+def test_undelivered_statuses_fail_on_stop(subscriber, results):
+    delivery = _delivery(subscriber, results)
+    delivery.put(_status('a'))
+
+    delivery.stop()
+
+    assert [commit_id for _, commit_id in results['failure']] == ['a']
+    assert isinstance(results['errors'][0], SubscriberStoppedError)
+
+
+def test_batch_is_posted_when_full(results):
+    subscriber = FakeSubscriber({'batch_size': '2', 'batch_linger_ms': '60000'})
+    delivery = _delivery(subscriber, results)
+    delivery.start()
+    for commit_id in ('a', 'b', 'c'):
+        delivery.put(_status(commit_id), serialize_commit_status(_status(commit_id)))
+
+    _wait_for(lambda: len(subscriber.batches) == 1)
+    assert [json.loads(payload)['commit_id'] for payload in subscriber.batches[0]] == ['a', 'b']
+    assert delivery.get_metrics()['subscriber_queue_depth'] == 1
+    delivery.stop()
+    assert [commit_id for _, commit_id in results['failure']] == ['c']
+
+
+def test_partial_batch_is_posted_after_linger(results):
+    subscriber = FakeSubscriber({'batch_size': '10', 'batch_linger_ms': '50'})
+    delivery = _delivery(subscriber, results)
+    delivery.start()
+    delivery.put(_status('a'))
+    delivery.put(_status('b'))
+
+    _wait_for(lambda: len(subscriber.batches) == 1)
+    delivery.stop()
+    assert [json.loads(payload)['commit_id'] for payload in subscriber.batches[0]] == ['a', 'b']
+    assert [commit_id for _, commit_id in results['success']] == ['a', 'b']
+    assert delivery.get_metrics()['subscriber_batches_total'] == 1
+
+
+@pytest.mark.parametrize('batch_format, content_type, expected_body', [
+    ('json', 'application/json', b'[{"n":1},{"n":2}]'),
+    ('ndjson', 'application/x-ndjson', b'{"n":1}\n{"n":2}\n'),
+])
+def test_batch_body_is_compressed(monkeypatch, batch_format, content_type, expected_body):
+    session = FakeSession()
+    monkeypatch.setattr(raw_subscriber, 'get_http_session', lambda url: session)
+    subscriber = RawSubscriber('https://subscriber.example.com/api\n',
+                               {'batch_size': '10', 'batch_format': batch_format})
+
+    subscriber.post_batch([b'{"n":1}', b'{"n":2}'])
+
+    assert session.url == 'https://subscriber.example.com/api'
+    assert session.headers == {'Content-Type': content_type, 'Content-Encoding': 'gzip'}
+    assert gzip.decompress(session.data) == expected_body
+
+
+def test_update_keeps_queued_statuses(results):
+    subscriber = FakeSubscriber({'batch_size': '10', 'batch_linger_ms': '60000'})
+    delivery = _delivery(subscriber, results)
+    delivery.start()
+    delivery.put(_status('a'))
+
+    updated = FakeSubscriber()
+    delivery.update(updated)
+
+    _wait_for(lambda: updated.posted == ['a'])
+    delivery.stop()
+    assert subscriber.batches == []
+
+
+def test_invalid_options_use_the_defaults(results):
+    subscriber = FakeSubscriber({'queue_size': 'many', 'batch_linger_ms': '1s', 'backpressure': 'wait'})
+    delivery = _delivery(subscriber, results)
+
+    delivery.update(FakeSubscriber({'queue_size': '-', 'batch_size': '2', 'batch_linger_ms': 'x'}))
+
+    assert delivery._max_size == subscriber_delivery.SUBSCRIBER_QUEUE_SIZE
+    assert delivery._backpressure == subscriber_delivery.DROP_OLDEST
+    assert delivery._batch_linger == subscriber_delivery.SUBSCRIBER_BATCH_LINGER / 1000
+    assert delivery.subscriber.batch_size == 2
+
+
+def test_closed_delivery_finishes_its_queue(subscriber, results):
+    subscriber.release = threading.Event()
+    delivery = _delivery(subscriber, results)
+    delivery.start()
+    for commit_id in ('a', 'b'):
+        delivery.put(_status(commit_id))
+
+    delivery.close()
+    subscriber.release.set()
+
+    _wait_for(lambda: not delivery.is_running)
+    assert subscriber.posted == ['a', 'b']
+    delivery.stop()
+    assert results['failure'] == []
+
+
+def test_status_is_reported_delivered_after_its_result(subscriber, results):
+    delivered = []
+    delivery = _delivery(subscriber, results)
+    delivery.start()
+
+    delivery.put(_status('a'), on_delivered=lambda: delivered.append(list(results['success'])))
+
+    _wait_for(lambda: delivered)
+    delivery.stop()
+    assert delivered == [[(subscriber.url_endpoint, 'a')]]
+
+
+def test_dropped_status_is_reported_delivered(results):
+    subscriber = FakeSubscriber({'queue_size': '1'})
+    delivered = []
+    delivery = _delivery(subscriber, results)
+
+    delivery.put(_status('a'), on_delivered=lambda: delivered.append('a'))
+    delivery.put(_status('b'), on_delivered=lambda: delivered.append('b'))
+
+    assert delivered == ['a']
+    delivery.stop()
+    assert delivered == ['a', 'b']
+
+
+@pytest.mark.parametrize('shutdown', ['close', 'stop'])
+def test_put_after_shutdown_fails_immediately(subscriber, results, shutdown):
+    delivered = []
+    delivery = _delivery(subscriber, results)
+    delivery.start()
+    getattr(delivery, shutdown)()
+    _wait_for(lambda: not delivery.is_running)
+
+    delivery.put(_status('a'), on_delivered=lambda: delivered.append('a'))
+
+    assert [commit_id for _, commit_id in results['failure']] == ['a']
+    assert isinstance(results['errors'][0], SubscriberStoppedError)
+    assert delivered == ['a']
+    assert delivery.get_metrics()['subscriber_queue_depth'] == 0
+    delivery.stop()
+
+
+def _delivery(subscriber, results):
+    return SubscriberDelivery(
+        subscriber,
+        lambda target, commit_status: results['success'].append((target, commit_status.commit_id)),
+        lambda target, commit_status, error: (results['failure'].append((target, commit_status.commit_id)),
+                                              results['errors'].append(error)))
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def _status(commit_id):
+    return GitCommitStatus(
+        commit_id=commit_id,
+        status_name='Status',
+        state='Succeeded',
+        message='',
+        callback_url='https://example.com/testing',
+        gitops_operator='Flux',
+        genre='Kustomization')
+
+
+class FakeSubscriber(RawSubscriber):
+    def __init__(self, options=None):
+        super().__init__('https://subscriber.example.com/api', options)
+        self.posted = []
+        self.batches = []
+        self.started = False
+        self.release = None
+
+    def post_commit_status(self, commit_status, payload=None):
+        self.started = True
+        if self.release is not None:
+            self.release.wait()
+        self.posted.append(commit_status.commit_id)
+
+    def post_batch(self, payloads):
+        self.batches.append(payloads)
+
+
+class FakeResponse:
+    def raise_for_status(self):
+        pass
+
+
+class FakeSession:
+    def post(self, url, data, headers):
+        self.url = url
+        self.data = data
+        self.headers = headers
+        return FakeResponse()
+
+
+@pytest.fixture
+def subscriber():
+    return FakeSubscriber()
+
+
+@pytest.fixture
+def results():
+    return {'success': [], 'failure': [], 'errors': []}
@@ -0,0 +1,89 @@
+import os
+import time
+
+import pytest
+
+from repositories.subscriber_registry import SubscriberRegistry
+
+
+def test_reload_keeps_unchanged_subscribers(subscribers_dir):
+    _write(subscribers_dir, 'a', 'https://a.example.com/api\n')
+    _write(subscribers_dir, 'b', 'https://b.example.com/api\nqueue_size=10\n')
+    registry = SubscriberRegistry(subscribers_dir, use_inotify=False)
+    subscribers = {subscriber.url_endpoint: subscriber for subscriber in registry.get_subscribers()}
+    unchanged = subscribers['https://a.example.com/api']
+    changed = subscribers['https://b.example.com/api']
+
+    _write(subscribers_dir, 'b', 'https://b.example.com/api\nqueue_size=20\n')
+    _write(subscribers_dir, 'c', 'https://c.example.com/api\n')
+
+    assert registry.reload()
+    subscribers = {subscriber.url_endpoint: subscriber for subscriber in registry.get_subscribers()}
+    assert subscribers['https://a.example.com/api'] is unchanged
+    assert subscribers['https://b.example.com/api'] is not changed
+    assert subscribers['https://b.example.com/api'].options == {'queue_size': '20'}
+    assert 'https://c.example.com/api' in subscribers
+    assert not registry.reload()
+
+
+def test_invalid_option_does_not_reject_subscribers(subscribers_dir):
+    _write(subscribers_dir, 'a', 'https://a.example.com/api\nbatch_size=ten\n')
+    _write(subscribers_dir, 'b', 'https://b.example.com/api\nbatch_size=10\n')
+
+    registry = SubscriberRegistry(subscribers_dir, use_inotify=False)
+
+    subscribers = {subscriber.url_endpoint: subscriber for subscriber in registry.get_subscribers()}
+    assert not subscribers['https://a.example.com/api'].is_batched
+    assert subscribers['https://b.example.com/api'].batch_size == 10
+
+
+def test_reload_without_changes_keeps_the_subscribers(subscribers_dir):
+    _write(subscribers_dir, 'a', 'https://a.example.com/api\n')
+    registry = SubscriberRegistry(subscribers_dir, use_inotify=False)
+    subscribers = registry.get_subscribers()
+
+    # Rewritten with the same content
+    _write(subscribers_dir, 'a', 'https://a.example.com/api\n', mtime_offset=10)
+
+    assert not registry.reload()
+    assert registry.get_subscribers() is subscribers
+
+
+@pytest.mark.parametrize('use_inotify', [True, False])
+def test_listeners_get_the_reloaded_subscribers(subscribers_dir, use_inotify):
+    _write(subscribers_dir, 'a', 'https://a.example.com/api\n')
+    registry = SubscriberRegistry(subscribers_dir, poll_interval=0.05 if not use_inotify else 60,
+                                  use_inotify=use_inotify)
+    reloads = []
+    registry.add_listener(reloads.append)
+    try:
+        # Gives the watcher time to start watching
+        time.sleep(0.1)
+        os.remove(os.path.join(subscribers_dir, 'a'))
+
+        _wait_for(lambda: reloads)
+    finally:
+        registry.stop()
+    assert reloads == [()]
+    assert registry.get_metrics()['subscriber_registry_reloads_total'] == 1
+
+
+def _write(subscribers_dir, name, content, mtime_offset=0):
+    path = os.path.join(subscribers_dir, name)
+    with open(path, 'w') as subscriber_fh:
+        subscriber_fh.write(content)
+    if mtime_offset:
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + mtime_offset * 10**9))
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def subscribers_dir(tmp_path):
+    return str(tmp_path)
@@ -11,3 +11,21 @@ def getenv(key, default=None):
         raise IndentationError(f'The env variable {key} is not initialized')
 
     return env_value
+
+
+def getenv_bool(key, default=False) -> bool:
+    env_value = os.getenv(key)
+
+    if env_value is None or env_value == '':
+        return default
+
+    return env_value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def getenv_int(key, default) -> int:
+    env_value = os.getenv(key)
+
+    if env_value is None or env_value == '':
+        return default
+
+    return int(env_value)